@@ -0,0 +1,88 @@
+"""
+## codec_benchmark.py -- Compression throughput & ratio per S3_Unzip 'ExtractCodec'
+#  Run from the repo root:  python benchmark/codec_benchmark.py --mb 64 --output codec_results.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+
+for path in [ './lambda/S3_Unzip', './benchmark' ]:
+    if path not in sys.path: sys.path.append(path)
+
+from unzip_functions import open_codec_writer, CODEC_EXTENSIONS, DEFAULT_CHUNK_SIZE
+from fiscaldata_generator import generate_csv, DATASETS
+
+def decompress( codec, data ):
+    ''' Decompress a whole codec payload (to time the reader side) '''
+    if codec == 'gzip':
+        import gzip
+        return gzip.decompress( data )
+    elif codec == 'bz2':
+        import bz2
+        return bz2.decompress( data )
+    elif codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader( io.BytesIO(data) ).read()
+    return data
+
+def benchmark_codec( codec, compress_level, csv_data, chunk_size=DEFAULT_CHUNK_SIZE ):
+    ''' Compress csv_data in S3_Unzip-sized chunks; report MB/s both ways and compression ratio '''
+    out = io.BytesIO()
+    start = time.perf_counter()
+    with open_codec_writer( codec, out, compress_level ) as writer:
+        for offset in range( 0, len(csv_data), chunk_size ):
+            writer.write( csv_data[offset:offset + chunk_size] )
+    compress_seconds = time.perf_counter() - start
+
+    compressed = out.getvalue()
+    start = time.perf_counter()
+    assert decompress( codec, compressed ) == csv_data
+    decompress_seconds = time.perf_counter() - start
+
+    mb = len(csv_data) / (1024 * 1024)
+    return {
+        "Codec" : codec,
+        "CompressLevel" : compress_level,
+        "InputBytes" : len(csv_data),
+        "OutputBytes" : len(compressed),
+        "CompressionRatio" : round( len(csv_data) / max(len(compressed), 1), 2 ),
+        "CompressMBps" : round( mb / compress_seconds, 1 ),
+        "DecompressMBps" : round( mb / decompress_seconds, 1 )
+    }
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( '--mb', type=float, default=32, help='MB of CSV per dataset' )
+    parser.add_argument( '--datasets', nargs='+', default=DATASETS )
+    parser.add_argument( '--codecs', nargs='+', default=[ 'none', 'gzip:1', 'gzip:6', 'gzip:9', 'zstd:1', 'zstd:3', 'zstd:9', 'bz2:9' ],
+                         help='codec[:level] list' )
+    parser.add_argument( '--output', default='', help='write JSON results to this path' )
+    args = parser.parse_args()
+
+    results = []
+    for dataset in args.datasets:
+        csv_data = generate_csv( dataset, int(args.mb * 1024 * 1024) )
+        for codec_spec in args.codecs:
+            codec, _, level = codec_spec.partition(':')
+            if codec not in CODEC_EXTENSIONS.keys():
+                raise Exception(f"Unknown codec '{codec}'")
+            try:
+                result = benchmark_codec( codec, int(level) if level else None, csv_data )
+            except ImportError as e:
+                print(f"Skipping {codec_spec}: {e}")
+                continue
+            result['Dataset'] = dataset
+            results.append( result )
+            print(f"{dataset:20} {codec_spec:8} ratio {result['CompressionRatio']:6.2f}  compress {result['CompressMBps']:8.1f} MB/s  decompress {result['DecompressMBps']:8.1f} MB/s")
+
+    if args.output > '':
+        with open( args.output, 'w' ) as f:
+            json.dump( { "Benchmark" : "codec", "Results" : results }, f, indent=2 )
+        print( f"Output to file '{args.output}'" )
+
+if __name__ == '__main__':
+    main()
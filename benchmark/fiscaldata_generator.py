@@ -0,0 +1,85 @@
+"""
+## fiscaldata_generator.py -- Synthetic FiscalData-shaped CSV content & archives for benchmarks
+#  (column names & types come from the data/metadata/*.raml Data Types, so row widths
+#   and value mixes resemble the real top_federal, top_state, and avg_interest_rates feeds)
+"""
+
+import io
+import csv
+import random
+import datetime
+
+METADATA_FOLDER = 'data/metadata'
+DATASETS = [ 'top_federal', 'top_state', 'avg_interest_rates' ]
+
+WORDS = [ 'Treasury', 'Department', 'Agriculture', 'Education', 'Federal', 'State', 'Program', 'Offset',
+          'Administrative', 'Payment', 'Salary', 'Vendor', 'Tax', 'Refund', 'Benefit', 'Debt', 'Loan',
+          'Notes', 'Bills', 'Bonds', 'Marketable', 'Non-marketable', 'Services', 'Commission', 'Office' ]
+
+def raml_columns( dataset, metadata_folder=METADATA_FOLDER ):
+    ''' List (name, raml type, FiscalData type) for a dataset's RAML Data Type '''
+    import yaml
+    with open( f"{metadata_folder}/{dataset}.raml" ) as f:
+        raml = yaml.safe_load( f.read() )
+    data_type = list( raml['types'].values() )[0]
+    return [ ( name, prop.get('type','string'), prop.get('(fd_data_type)','STRING') ) for name, prop in data_type['properties'].items() ]
+
+def column_value( rand, raml_type, fd_data_type, record_date, string_width ):
+    ''' One synthetic value shaped like the FiscalData column '''
+    if fd_data_type == 'DATE':
+        return record_date.isoformat()
+    if fd_data_type == 'CURRENCY':
+        return f"{rand.uniform(-1e6, 1e8):.2f}"
+    if fd_data_type == 'PERCENTAGE':
+        return f"{rand.uniform(0, 12):.3f}"
+    if fd_data_type == 'YEAR':
+        return str(record_date.year)
+    if fd_data_type == 'QUARTER':
+        return str((record_date.month - 1) // 3 + 1)
+    if fd_data_type == 'MONTH':
+        return str(record_date.month)
+    if fd_data_type == 'DAY':
+        return str(record_date.day)
+    if fd_data_type == 'NUMBER':
+        return str(rand.randint(0, 250000))
+    if rand.random() < 0.3:
+        return f"{rand.choice('ABCDEFGHJKLMNPRSTUVWXYZ')}{rand.randint(0, 9999):04d}"    # code-like columns
+    words = []
+    while sum( len(w) + 1 for w in words ) < rand.randint(1, string_width):
+        words.append( rand.choice(WORDS) )
+    value = ' '.join(words)
+    if rand.random() < 0.02:
+        value += ', "Inc."'     # exercise quoting & escaped quotes
+    return value
+
+def generate_csv( dataset, target_bytes, string_width=40, seed=0, metadata_folder=METADATA_FOLDER ):
+    ''' Generate about target_bytes of FiscalData-shaped CSV (all values quoted, like the API's CSV format) '''
+    rand = random.Random( seed )
+    columns = raml_columns( dataset, metadata_folder )
+    out = io.StringIO()
+    writer = csv.writer( out, quoting=csv.QUOTE_ALL, lineterminator='\n' )
+    writer.writerow( [ name for name, raml_type, fd_data_type in columns ] )
+    record_date = datetime.date(2022, 10, 1)
+    while out.tell() < target_bytes:
+        writer.writerow( [ column_value( rand, raml_type, fd_data_type, record_date, string_width ) for name, raml_type, fd_data_type in columns ] )
+        if rand.random() < 0.01:
+            record_date -= datetime.timedelta(days=1)
+
+    return out.getvalue().encode('utf-8')
+
+def member_names( datasets, member_count, batch_date ):
+    ''' FiscalData member names '{dataset}.D{yymmdd}.full.csv' -- datasets round-robin, a day earlier on each pass '''
+    names = []
+    for i in range( member_count ):
+        member_date = batch_date - datetime.timedelta( days = i // len(datasets) )
+        names.append( f"{datasets[i % len(datasets)]}.D{member_date.strftime('%y%m%d')}.full.csv" )
+    return names
+
+def generate_zip( zip_path, datasets=DATASETS, member_count=3, member_mb=8, string_width=40, batch_date=datetime.date(2022, 12, 12), seed=0, metadata_folder=METADATA_FOLDER ):
+    ''' Write a FiscalData-shaped archive (deflated, like get_fiscaldata.ipynb builds), returning its member names '''
+    import zipfile
+    names = member_names( datasets, member_count, batch_date )
+    with zipfile.ZipFile( zip_path, 'w', zipfile.ZIP_DEFLATED ) as archive:
+        for i, name in enumerate( names ):
+            archive.writestr( name, generate_csv( name.split('.')[0], int(member_mb * 1024 * 1024), string_width, seed + i, metadata_folder ) )
+    return names
@@ -0,0 +1,330 @@
+"""
+## glue_local_benchmark.py -- Rows/sec, time per stage & output file statistics of Convert_CSV_To_Parquet per reader & writer mode
+#  Runs its CsvToParquet on local[*] Spark (pip install pyspark, with a Java runtime) against synthetic FiscalData CSVs,
+#  a local folder standing in for the landing pad & Datalake buckets, and a stub Glue Catalog -- no Glue job, no DPUs.
+#  Without awsglue, the 'DynamicFrame' reader is Spark's CSV reader cast to the catalog types & the writer is Spark's parquet.
+#  Every scenario must write the same rows to the same '{table}/{partition_folder}/' folders -- a row count & an
+#  order-independent row checksum per folder is compared across scenarios (--check-only: just the reader modes, once).
+#  Run from the repo root:
+#    python benchmark/glue_local_benchmark.py --member-mb 32 --output glue_local_results.json
+#    python benchmark/glue_local_benchmark.py --member-mb 32 --baseline glue_local_results.json
+"""
+
+import os
+import sys
+import io
+import copy
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import contextlib
+
+for path in [ './glue', './benchmark' ]:
+    if path not in sys.path: sys.path.append(path)
+
+from fiscaldata_generator import generate_csv, raml_columns, DATASETS
+
+GLUE_DATABASE_NAME = 'benchmark'
+S3_INPUT_BUCKET = 'benchmark-landing-pad'
+S3_INPUT_FOLDER = 'FSDATA/Inbound'
+S3_OUTPUT_BUCKET = 'benchmark-datalake'
+S3_OUTPUT_FOLDER = 'FSDATA/PARQUET'
+
+# process_parms per reader & writer mode -- each scenario is a reader mode with a writer mode
+READER_MODES = {
+    "PerPartition-DynamicFrame" : { "GlueReadMode" : "PerPartition", "GlueCsvReader" : "DynamicFrame" },
+    "PerPartition-Native"       : { "GlueReadMode" : "PerPartition", "GlueCsvReader" : "Native" },
+    "SinglePass-DynamicFrame"   : { "GlueReadMode" : "SinglePass", "GlueCsvReader" : "DynamicFrame" },
+    "SinglePass-Native"         : { "GlueReadMode" : "SinglePass", "GlueCsvReader" : "Native" },
+}
+WRITER_MODES = {
+    "Default"     : {},
+    "TargetFile"  : { "TargetFileMB" : 16, "RowGroupMB" : 8 },
+    "Sorted"      : { "SortKeys" : { "top_federal" : [ "record_date", "creditor_agency_id" ], "top_state" : [ "record_date", "state_cd" ], "*" : [ "record_date" ] } },
+    "SortedBloom" : { "SortKeys" : { "top_federal" : [ "record_date", "creditor_agency_id" ], "top_state" : [ "record_date", "state_cd" ], "*" : [ "record_date" ] },
+                      "BloomFilterColumns" : { "top_federal" : [ "creditor_agency_id" ] } },
+}
+RAML_TO_GLUE_TYPES = { 'number' : 'double', 'integer' : 'int' }     # as glue_functions import_raml_to_glue
+
+class LocalStorage:
+    ''' S3Storage on a local folder -- '{root}/{bucket}/{key}', with file:// urls Spark reads & writes '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def url(self, s3_bucket, s3_key):
+        return f"file://{self.root}/{s3_bucket}/{s3_key}"
+
+    def split_url(self, s3_url):
+        return tuple( s3_url[len(f"file://{self.root}/"):].split('/', 1) )
+
+    def list_objects(self, s3_bucket, s3_prefix):
+        bucket_folder = f"{self.root}/{s3_bucket}"
+        for folder, folder_names, file_names in os.walk( bucket_folder ):
+            for file_name in sorted( file_names ):
+                file_path = f"{folder}/{file_name}"
+                s3_key = file_path[len(bucket_folder)+1:]
+                if s3_key.startswith( s3_prefix ):
+                    stat = os.stat( file_path )
+                    yield {
+                        "Key" : s3_key,
+                        "Size" : stat.st_size,
+                        "ETag" : f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+                        "LastModified" : datetime.datetime.fromtimestamp( stat.st_mtime, datetime.timezone.utc )
+                    }
+
+    def read_json(self, s3_bucket, s3_key):
+        if not os.path.exists( f"{self.root}/{s3_bucket}/{s3_key}" ):
+            return None
+        with open( f"{self.root}/{s3_bucket}/{s3_key}" ) as f:
+            return json.load( f )
+
+    def write_json(self, s3_bucket, s3_key, value):
+        os.makedirs( os.path.dirname( f"{self.root}/{s3_bucket}/{s3_key}" ), exist_ok=True )
+        with open( f"{self.root}/{s3_bucket}/{s3_key}", 'w' ) as f:
+            json.dump( value, f )
+
+    def delete_prefix(self, s3_bucket, s3_prefix):
+        self.delete_objects( s3_bucket, [ s3_object['Key'] for s3_object in self.list_objects( s3_bucket, s3_prefix ) ] )
+
+    def delete_objects(self, s3_bucket, s3_keys):
+        for s3_key in s3_keys:
+            os.remove( f"{self.root}/{s3_bucket}/{s3_key}" )
+
+    def move_objects(self, s3_bucket, s3_key_moves):
+        for from_key, to_key in s3_key_moves.items():
+            os.makedirs( os.path.dirname( f"{self.root}/{s3_bucket}/{to_key}" ), exist_ok=True )
+            os.replace( f"{self.root}/{s3_bucket}/{from_key}", f"{self.root}/{s3_bucket}/{to_key}" )
+
+class StubCatalog:
+    ''' The Glue Catalog calls CsvToParquet makes -- get_table, batch_create_partition & batch_update_partition -- in memory '''
+
+    def __init__(self):
+        self.tables = {}
+        self.partitions = {}
+
+    def add_table(self, glue_database_name, glue_table_name, columns, location, parameters={}):
+        self.tables[(glue_database_name, glue_table_name)] = {
+            "Name" : glue_table_name,
+            "DatabaseName" : glue_database_name,
+            "StorageDescriptor" : { "Columns" : columns, "Location" : location },
+            "PartitionKeys" : [ { "Name" : "partition_0", "Type" : "string" } ],
+            "Parameters" : dict( parameters, classification='parquet' )
+        }
+        self.partitions[(glue_database_name, glue_table_name)] = {}
+
+    def get_table(self, DatabaseName, Name):
+        return { "Table" : copy.deepcopy( self.tables[(DatabaseName, Name)] ) }
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        partitions = self.partitions[(DatabaseName, TableName)]
+        errors = []
+        for partition_input in PartitionInputList:
+            if tuple( partition_input['Values'] ) in partitions.keys():
+                errors.append( { "PartitionValues" : partition_input['Values'], "ErrorDetail" : { "ErrorCode" : "AlreadyExistsException" } } )
+            else:
+                partitions[tuple( partition_input['Values'] )] = partition_input
+        return { "Errors" : errors }
+
+    def batch_update_partition(self, DatabaseName, TableName, Entries):
+        partitions = self.partitions[(DatabaseName, TableName)]
+        for entry in Entries:
+            partitions[tuple( entry['PartitionValueList'] )] = entry['PartitionInput']
+        return { "Errors" : [] }
+
+def land_batch( storage, datasets, partition_count, files_per_partition, member_mb, string_width ):
+    ''' Synthetic CSVs in the landing folder -- their S3ExtractedUrls, partition folders, row count & bytes '''
+    batch_date = datetime.date(2022, 12, 12)
+    partition_folders = [ f"D{( batch_date - datetime.timedelta( days=n ) ).strftime('%y%m%d')}.full" for n in range( partition_count ) ]
+    s3_urls, rows, landed_bytes = [], 0, 0
+    for i, dataset in enumerate( datasets ):
+        for j, partition_folder in enumerate( partition_folders ):
+            for k in range( files_per_partition ):
+                csv_data = generate_csv( dataset, int( member_mb * 1024 * 1024 / files_per_partition ), string_width, seed=i * 1000 + j * 10 + k )
+                s3_key = f"{S3_INPUT_FOLDER}/{dataset}/{partition_folder}/{dataset}.{partition_folder}.part{k:04d}.csv"
+                os.makedirs( os.path.dirname( f"{storage.root}/{S3_INPUT_BUCKET}/{s3_key}" ), exist_ok=True )
+                with open( f"{storage.root}/{S3_INPUT_BUCKET}/{s3_key}", 'wb' ) as f:
+                    f.write( csv_data )
+                s3_urls.append( storage.url( S3_INPUT_BUCKET, s3_key ) )
+                rows += csv_data.count( b'\n' ) - 1
+                landed_bytes += len(csv_data)
+    return s3_urls, partition_folders, rows, landed_bytes
+
+def stub_catalog( storage, datasets ):
+    ''' A Glue Table per dataset, with the RAML column types as glue_functions would import them '''
+    glue_client = StubCatalog()
+    for dataset in datasets:
+        columns = [ { "Name" : name, "Type" : RAML_TO_GLUE_TYPES.get( raml_type, raml_type ) } for name, raml_type, fd_data_type in raml_columns( dataset ) ]
+        glue_client.add_table( GLUE_DATABASE_NAME, dataset, columns, storage.url( S3_OUTPUT_BUCKET, f"{S3_OUTPUT_FOLDER}/{dataset}" ) )
+    return glue_client
+
+def written_folders( spark, storage, datasets ):
+    ''' Rows & an order-independent checksum of the rows in each '{table}/{partition_folder}' of the Parquet written '''
+    from pyspark.sql.functions import input_file_name, regexp_extract, xxhash64, col, count, sum as sum_
+    folders = {}
+    for dataset in datasets:
+        table_url = storage.url( S3_OUTPUT_BUCKET, f"{S3_OUTPUT_FOLDER}/{dataset}" )
+        if not os.path.isdir( table_url[len('file://'):] ):
+            continue
+        table_df = spark.read.option( 'recursiveFileLookup', 'true' ).parquet( table_url )
+        folder_stats = table_df.select(
+            regexp_extract( input_file_name(), f"/({dataset}/[^/]+)/[^/]+$", 1 ).alias( 'Folder' ),
+            xxhash64( *[ col(f"`{name}`") for name in table_df.columns ] ).cast( 'decimal(38,0)' ).alias( 'RowHash' )
+        ).groupBy( 'Folder' ).agg( count( '*' ).alias( 'Rows' ), sum_( 'RowHash' ).alias( 'Checksum' ) ).collect()
+        for row in folder_stats:
+            folders[row['Folder']] = { "Rows" : row['Rows'], "Checksum" : str( row['Checksum'] ) }
+    return dict( sorted( folders.items() ) )
+
+def run_scenario( spark, storage, scenario, process_parms, datasets, s3_urls, partition_folders, rows, landed_bytes, quiet=True ):
+    ''' Run CsvToParquet once for a scenario, measure it & check every landed row was written '''
+    from Convert_CSV_To_Parquet import CsvToParquet
+    shutil.rmtree( f"{storage.root}/{S3_OUTPUT_BUCKET}", ignore_errors=True )
+    glue_client = stub_catalog( storage, datasets )
+    batch_parms = dict( process_parms,
+        GlueDatabaseName = GLUE_DATABASE_NAME,
+        S3LandingPadBucket = S3_INPUT_BUCKET,
+        S3LandingPadInput = S3_INPUT_FOLDER,
+        S3DatalakeBucket = S3_OUTPUT_BUCKET,
+        S3DatalakeOutput = S3_OUTPUT_FOLDER,
+        ZipExtracted = { "GlueTableNames" : datasets, "PartitionFolders" : partition_folders, "S3ExtractedUrls" : s3_urls }
+    )
+    with ( contextlib.redirect_stdout( io.StringIO() ) if quiet else contextlib.nullcontext() ):
+        start = time.perf_counter()
+        result = CsvToParquet( batch_parms, spark, glue_client, storage ).run()
+        seconds = time.perf_counter() - start
+
+    folders = written_folders( spark, storage, datasets )
+    written_rows = sum( folder['Rows'] for folder in folders.values() )
+    partitions = sum( len(table_partitions) for table_partitions in glue_client.partitions.values() )
+    file_stats = result['OutputFiles']
+    return {
+        "Scenario" : scenario,
+        "ProcessParms" : process_parms,
+        "Seconds" : round( seconds, 3 ),
+        "Rows" : rows,
+        "WrittenRows" : written_rows,
+        "RowsPerSec" : round( rows / seconds ),
+        "ThroughputMBps" : round( landed_bytes / (1024 * 1024) / seconds, 1 ),
+        "StageSeconds" : result['StageSeconds'],
+        "Partitions" : partitions,
+        "Folders" : folders,
+        "OutputFiles" : {
+            "Files" : sum( stats['Files'] for stats in file_stats ),
+            "MB" : round( sum( stats['MB'] for stats in file_stats ), 1 ),
+            "MinMB" : min( [ stats['MinMB'] for stats in file_stats ] or [ 0 ] ),
+            "MedianMB" : sorted( [ stats['MedianMB'] for stats in file_stats ] or [ 0 ] )[len(file_stats) // 2],
+            "MaxMB" : max( [ stats['MaxMB'] for stats in file_stats ] or [ 0 ] )
+        }
+    }
+
+def compare_results( results, baseline, tolerance ):
+    ''' List scenarios whose rows/sec dropped more than tolerance (fraction) below the baseline run, or that lost rows '''
+    baseline_results = { result['Scenario'] : result for result in baseline['Results'] }
+    regressions = [ result['Scenario'] for result in results if result['WrittenRows'] != result['Rows'] ]
+    for result in results:
+        if result['Scenario'] not in baseline_results.keys():
+            continue
+        previous = baseline_results[result['Scenario']]
+        change = ( result['RowsPerSec'] - previous['RowsPerSec'] ) / max( previous['RowsPerSec'], 1 )
+        result['BaselineRowsPerSec'] = previous['RowsPerSec']
+        result['RowsPerSecChange'] = round( change, 3 )
+        if change < -tolerance and result['Scenario'] not in regressions:
+            regressions.append( result['Scenario'] )
+    return regressions
+
+def compare_outputs( results ):
+    ''' List scenarios whose '{table}/{partition_folder}' rows or checksums differ from the first scenario's '''
+    mismatches = []
+    for result in results[1:]:
+        if result['Folders'] != results[0]['Folders']:
+            differing = sorted( folder for folder in set( result['Folders'] ) | set( results[0]['Folders'] ) if result['Folders'].get( folder ) != results[0]['Folders'].get( folder ) )
+            print(f"{result['Scenario']:38} output differs from {results[0]['Scenario']} in {differing}")
+            mismatches.append( result['Scenario'] )
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( '--datasets', nargs='+', default=DATASETS )
+    parser.add_argument( '--partitions', type=int, default=2, help='partition folders (batch dates) per table' )
+    parser.add_argument( '--files', type=int, default=2, help='landed CSV files per table partition' )
+    parser.add_argument( '--member-mb', type=float, default=16, help='MB of CSV per table partition' )
+    parser.add_argument( '--string-width', type=int, default=40, help='max characters of STRING columns' )
+    parser.add_argument( '--readers', nargs='+', default=list( READER_MODES.keys() ), choices=list( READER_MODES.keys() ) )
+    parser.add_argument( '--writers', nargs='+', default=list( WRITER_MODES.keys() ), choices=list( WRITER_MODES.keys() ) )
+    parser.add_argument( '--table-concurrency', type=int, default=1, help="'GlueTableConcurrency' for every scenario" )
+    parser.add_argument( '--master', default='local[*]', help='Spark master' )
+    parser.add_argument( '--repeat', type=int, default=1, help='runs per scenario (fastest is kept)' )
+    parser.add_argument( '--verbose', action='store_true', help="show CsvToParquet's output" )
+    parser.add_argument( '--output', default='', help='write JSON results to this path' )
+    parser.add_argument( '--baseline', default='', help='JSON results of an earlier run to compare rows/sec against' )
+    parser.add_argument( '--tolerance', type=float, default=0.10, help='rows/sec drop (fraction) reported as a regression' )
+    parser.add_argument( '--check-only', action='store_true', help='only check every reader mode writes the same output (Default writer, one run each)' )
+    args = parser.parse_args()
+    if args.check_only:
+        args.readers, args.writers, args.repeat = list( READER_MODES.keys() ), [ 'Default' ], 1
+
+    from pyspark.sql import SparkSession
+    spark = SparkSession.builder.master( args.master ).appName( 'glue_local_benchmark' ) \
+        .config( 'spark.scheduler.mode', 'FAIR' ).config( 'spark.ui.enabled', 'false' ).getOrCreate()
+    spark.sparkContext.setLogLevel( 'ERROR' )
+
+    work_root = tempfile.mkdtemp( prefix='glue_local_benchmark_' )
+    storage = LocalStorage( work_root )
+    start = time.perf_counter()
+    s3_urls, partition_folders, rows, landed_bytes = land_batch( storage, args.datasets, args.partitions, args.files, args.member_mb, args.string_width )
+    print(f"Landed {len(s3_urls)} CSVs ({rows} rows, {landed_bytes} bytes) for {args.datasets} in {time.perf_counter() - start:.1f}s")
+
+    results = []
+    for reader in args.readers:
+        for writer in args.writers:
+            scenario = f"{reader}/{writer}"
+            process_parms = dict( READER_MODES[reader], **WRITER_MODES[writer], GlueTableConcurrency=args.table_concurrency )
+            runs = [ run_scenario( spark, storage, scenario, process_parms, args.datasets, s3_urls, partition_folders, rows, landed_bytes, not args.verbose ) for n in range( args.repeat ) ]
+            result = min( runs, key=lambda r: r['Seconds'] )
+            results.append( result )
+            stages = '  '.join( f"{stage} {seconds:.2f}s" for stage, seconds in result['StageSeconds'].items() )
+            files = result['OutputFiles']
+            print(f"{scenario:38} {result['RowsPerSec']:10} rows/s  {files['Files']:4} files  MB min {files['MinMB']:.1f} median {files['MedianMB']:.1f} max {files['MaxMB']:.1f}  {stages}")
+            if result['WrittenRows'] != result['Rows']:
+                print(f"{scenario:38} wrote {result['WrittenRows']} of {result['Rows']} rows")
+    spark.stop()
+    shutil.rmtree( work_root, ignore_errors=True )
+
+    regressions = []
+    if args.baseline > '':
+        with open( args.baseline ) as f:
+            regressions = compare_results( results, json.load( f ), args.tolerance )
+        for result in results:
+            if 'RowsPerSecChange' in result.keys():
+                print(f"{result['Scenario']:38} {result['RowsPerSecChange']:+8.1%} vs baseline {result['BaselineRowsPerSec']} rows/s")
+    else:
+        regressions = [ result['Scenario'] for result in results if result['WrittenRows'] != result['Rows'] ]
+    regressions.extend( [ scenario for scenario in compare_outputs( results ) if scenario not in regressions ] )
+
+    if args.output > '':
+        with open( args.output, 'w' ) as f:
+            json.dump( {
+                "Benchmark" : "glue_local",
+                "Batch" : {
+                    "Datasets" : args.datasets,
+                    "PartitionFolders" : partition_folders,
+                    "Files" : len(s3_urls),
+                    "Rows" : rows,
+                    "LandedBytes" : landed_bytes,
+                    "StringWidth" : args.string_width,
+                    "Master" : args.master
+                },
+                "Results" : results,
+                "Regressions" : regressions
+            }, f, indent=2 )
+        print( f"Output to file '{args.output}'" )
+
+    if len(regressions) > 0:
+        print(f"Regressions (rows/sec beyond {args.tolerance:.0%}, rows lost, or output unlike the first scenario's): {regressions}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
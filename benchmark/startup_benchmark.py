@@ -0,0 +1,153 @@
+"""
+## startup_benchmark.py -- Cold start cost of each Lambda function: import time & time to first response
+#  Each cold start is a fresh Python process (like a new Lambda container) against moto stand-ins (pip install moto).
+#  'ImportMs' & 'TopImports' come from python -X importtime without moto loaded; 'FirstResponseMs' is import, init,
+#  and the first invocation; 'WarmResponseMs' is the second invocation in the same process.
+#  Run from the repo root:  python benchmark/startup_benchmark.py --repeat 5 --output startup_results.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+LAYER_FOLDER = './layer/Lambda_Runtime/python'
+FUNCTIONS = [ 'Process_Initiator', 'S3_Unzip' ]
+S3_BUCKET = 'benchmark-landing-pad'
+
+def function_env( function_name ):
+    ''' Environment for a child process that imports function_name's lambda_function (plus the Layer) '''
+    env = dict( os.environ )
+    env['PYTHONPATH'] = os.pathsep.join( [ f"./lambda/{function_name}", LAYER_FOLDER, './benchmark' ] )
+    env.setdefault( 'AWS_DEFAULT_REGION', 'us-east-1' )
+    env.setdefault( 'AWS_ACCESS_KEY_ID', 'benchmark' )
+    env.setdefault( 'AWS_SECRET_ACCESS_KEY', 'benchmark' )
+    return env
+
+def import_profile( function_name, top=5 ):
+    ''' Cumulative import time of lambda_function, and the modules with the most self time (python -X importtime) '''
+    result = subprocess.run( [ sys.executable, '-X', 'importtime', '-c', 'import lambda_function' ],
+                             env=function_env( function_name ), capture_output=True, text=True, check=True )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = [ field.strip() for field in line[len('import time:'):].split('|') ]
+        modules.append( ( name, int(self_us), int(cumulative_us) ) )
+    import_us = [ cumulative_us for name, self_us, cumulative_us in modules if name == 'lambda_function' ][0]
+    return {
+        "ImportMs" : round( import_us / 1000, 1 ),
+        "TopImports" : { name : round( self_us / 1000, 1 ) for name, self_us, cumulative_us in sorted( modules, key=lambda m: -m[1] )[:top] }
+    }
+
+def sample_event( function_name, n ):
+    ''' Invocation n's event (unique per invocation, so Step Function execution names do not collide) '''
+    if function_name == 'Process_Initiator':
+        return {
+            "source" : "aws.s3",
+            "detail" : { "bucket" : { "name" : S3_BUCKET }, "object" : { "key" : f"FSDATA/Inbound/FDMD.FSDATA.D22121{n}.FULL.ZIP" } },
+            "process_parms" : { "StepFnArn" : os.environ['BenchmarkStepFnArn'] }
+        }
+    return {
+        "source" : "aws.s3",
+        "detail" : { "bucket" : { "name" : S3_BUCKET }, "object" : { "key" : "FSDATA/Inbound/FDMD.FSDATA.D221212.FULL.ZIP" } },
+        "process_parms" : { "BatchId" : "FDMD.FSDATA.D221212.FULL.ZIP", "ExtractMode" : "Stream" }
+    }
+
+class LambdaContext:
+    ''' Just enough of the Lambda context object '''
+    function_name = 'benchmark-Process_Initiator'
+
+def cold_start( function_name ):
+    ''' Child process: moto stand-ins, then time the import & first two invocations of lambda_function '''
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+    import boto3
+
+    with mock_aws(), tempfile.TemporaryDirectory() as work_root:
+        os.environ['WorkFolder'] = work_root
+        if function_name == 'Process_Initiator':
+            state_machine = boto3.client('stepfunctions').create_state_machine(
+                name = 'benchmark-Extract_Zip_to_Parquet',
+                definition = json.dumps( { "StartAt" : "Done", "States" : { "Done" : { "Type" : "Succeed" } } } ),
+                roleArn = 'arn:aws:iam::123456789012:role/benchmark'
+            )
+            os.environ['BenchmarkStepFnArn'] = state_machine['stateMachineArn']
+        else:
+            from fiscaldata_generator import generate_zip
+            generate_zip( f"{work_root}/archive.zip", member_count=3, member_mb=0.25 )
+            s3_client = boto3.client('s3')
+            s3_client.create_bucket( Bucket=S3_BUCKET )
+            s3_client.upload_file( f"{work_root}/archive.zip", S3_BUCKET, sample_event( function_name, 0 )['detail']['object']['key'] )
+
+        with contextlib.redirect_stdout( io.StringIO() ):
+            start = time.perf_counter()
+            import lambda_function
+            imported = time.perf_counter()
+            lambda_function.lambda_handler( sample_event( function_name, 1 ), LambdaContext() )
+            first_response = time.perf_counter()
+            lambda_function.lambda_handler( sample_event( function_name, 2 ), LambdaContext() )
+            warm_response = time.perf_counter()
+
+    print( json.dumps( {
+        "ImportMs" : round( ( imported - start ) * 1000, 1 ),
+        "FirstResponseMs" : round( ( first_response - start ) * 1000, 1 ),
+        "WarmResponseMs" : round( ( warm_response - first_response ) * 1000, 1 )
+    } ) )
+
+def benchmark_function( function_name, repeat ):
+    ''' Median cold start over repeat fresh processes '''
+    runs = []
+    for n in range( repeat ):
+        start = time.perf_counter()
+        result = subprocess.run( [ sys.executable, __file__, '--cold-start', function_name ],
+                                 env=function_env( function_name ), capture_output=True, text=True )
+        if result.returncode != 0:
+            raise Exception(f"{function_name} cold start failed:\n{result.stderr}")
+        run = json.loads( result.stdout.strip().splitlines()[-1] )
+        run['ProcessMs'] = round( ( time.perf_counter() - start ) * 1000, 1 )
+        runs.append( run )
+
+    profile = import_profile( function_name )
+    return {
+        "Function" : function_name,
+        "Runs" : repeat,
+        "ImportMs" : profile['ImportMs'],
+        "TopImports" : profile['TopImports'],
+        **{ metric : round( statistics.median( run[metric] for run in runs ), 1 ) for metric in [ 'FirstResponseMs', 'WarmResponseMs', 'ProcessMs' ] }
+    }
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( '--functions', nargs='+', default=FUNCTIONS, choices=FUNCTIONS )
+    parser.add_argument( '--repeat', type=int, default=3, help='cold starts per function (median is reported)' )
+    parser.add_argument( '--output', default='', help='write JSON results to this path' )
+    parser.add_argument( '--cold-start', default='', help=argparse.SUPPRESS )     # child process mode
+    args = parser.parse_args()
+
+    if args.cold_start > '':
+        cold_start( args.cold_start )
+        return
+
+    results = []
+    for function_name in args.functions:
+        result = benchmark_function( function_name, args.repeat )
+        results.append( result )
+        print(f"{function_name:18} import {result['ImportMs']:7.1f} ms  first response {result['FirstResponseMs']:7.1f} ms  warm {result['WarmResponseMs']:7.1f} ms")
+        print(f"{'':18} top imports (self ms): {result['TopImports']}")
+
+    if args.output > '':
+        with open( args.output, 'w' ) as f:
+            json.dump( { "Benchmark" : "startup", "Results" : results }, f, indent=2 )
+        print( f"Output to file '{args.output}'" )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+## unzip_benchmark.py -- Throughput, peak RSS, peak /tmp, and time per stage for S3_Unzip lambda_handler
+#  Runs offline against a moto S3 stand-in (pip install moto) with a synthetic FiscalData archive.
+#  Run from the repo root:
+#    python benchmark/unzip_benchmark.py --members 6 --member-mb 32 --output unzip_results.json
+#    python benchmark/unzip_benchmark.py --members 6 --member-mb 32 --baseline unzip_results.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+
+for path in [ './lambda/S3_Unzip', './layer/Lambda_Runtime/python', './benchmark' ]:
+    if path not in sys.path: sys.path.append(path)
+
+from fiscaldata_generator import generate_zip, DATASETS
+
+S3_BUCKET = 'benchmark-landing-pad'
+S3_INPUT_FOLDER = 'FSDATA/Inbound'
+
+# process_parms per scenario -- add more to compare other S3_Unzip options
+SCENARIOS = {
+    "Extract"          : { "ExtractMode" : "Extract" },
+    "Stream"           : { "ExtractMode" : "Stream" },
+    "Range-Stream"     : { "ExtractMode" : "Stream", "ArchiveReader" : "Range" },
+    "Range-Stream-x4"  : { "ExtractMode" : "Stream", "ArchiveReader" : "Range", "ExtractWorkers" : 4 },
+    "Stream-zstd"      : { "ExtractMode" : "Stream", "ExtractCodec" : "zstd" },
+}
+
+DOWNLOAD_METHODS = [ 'download_file', 'head_object', 'get_object' ]
+UPLOAD_METHODS = [ 'upload_file', 'put_object', 'create_multipart_upload', 'upload_part', 'complete_multipart_upload' ]
+
+def mock_s3():
+    ''' moto mock for S3 (moto 5 mock_aws, or mock_s3 in earlier releases) '''
+    os.environ.setdefault( 'AWS_ACCESS_KEY_ID', 'benchmark' )
+    os.environ.setdefault( 'AWS_SECRET_ACCESS_KEY', 'benchmark' )
+    os.environ.setdefault( 'AWS_DEFAULT_REGION', 'us-east-1' )
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+    return mock_aws()
+
+def folder_bytes( folder ):
+    ''' Total size of files under folder (0 when it does not exist) '''
+    total = 0
+    for root, dirs, files in os.walk( folder ):
+        for name in files:
+            try:
+                total += os.path.getsize( os.path.join( root, name ) )
+            except OSError:
+                pass    # removed while walking
+    return total
+
+def current_rss():
+    ''' Resident set size of this process in bytes '''
+    try:
+        with open( '/proc/self/statm' ) as f:
+            return int( f.read().split()[1] ) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss * 1024     # peak, not current, off Linux
+
+class PeakSampler:
+    ''' Background thread sampling peak RSS & work folder usage while a scenario runs '''
+
+    def __init__(self, work_folder, interval=0.01):
+        self.work_folder = work_folder
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_tmp = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread( target=self.run, daemon=True )
+
+    def sample(self):
+        self.peak_rss = max( self.peak_rss, current_rss() )
+        self.peak_tmp = max( self.peak_tmp, folder_bytes( self.work_folder ) )
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait( self.interval )
+
+    def __enter__(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+class StageTimer:
+    ''' Accumulates seconds per stage across worker threads by wrapping S3 client methods & extract_member '''
+
+    def __init__(self):
+        self.seconds = { "Download" : 0.0, "MemberDownload" : 0.0, "Upload" : 0.0, "Members" : 0.0 }
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.seconds[stage] += seconds
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            if stage == 'Download' and getattr( self.local, 'in_member', False ):
+                timed_stage = 'MemberDownload'  # ranged GETs issued while a member streams
+            else:
+                timed_stage = stage
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add( timed_stage, time.perf_counter() - start )
+        return timed
+
+    def wrap_member(self, function):
+        def timed(*args, **kwargs):
+            self.local.in_member = True
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.in_member = False
+                self.add( 'Members', time.perf_counter() - start )
+        return timed
+
+    @contextlib.contextmanager
+    def instrument(self, lambda_function):
+        ''' Patch lambda_function's S3 client & extract_member for the duration of one run '''
+        s3_client = lambda_function.s3_client
+        for method in DOWNLOAD_METHODS + UPLOAD_METHODS:
+            setattr( s3_client, method, self.wrap( 'Download' if method in DOWNLOAD_METHODS else 'Upload', getattr( s3_client, method ) ) )
+        extract_member = lambda_function.extract_member
+        lambda_function.extract_member = self.wrap_member( extract_member )
+        try:
+            yield self
+        finally:
+            lambda_function.extract_member = extract_member
+            for method in DOWNLOAD_METHODS + UPLOAD_METHODS:
+                delattr( s3_client, method )
+
+    def stages(self):
+        ''' Thread-seconds per stage; 'ExtractCompress' is member time not spent waiting on S3 '''
+        return {
+            "Download" : round( self.seconds['Download'] + self.seconds['MemberDownload'], 3 ),
+            "ExtractCompress" : round( max( 0.0, self.seconds['Members'] - self.seconds['Upload'] - self.seconds['MemberDownload'] ), 3 ),
+            "Upload" : round( self.seconds['Upload'], 3 )
+        }
+
+def run_scenario( lambda_function, scenario, process_parms, s3_key, archive_bytes, uncompressed_bytes, work_root ):
+    ''' Run lambda_handler once for a scenario and measure it '''
+    work_folder = f"{work_root}/{scenario}"
+    os.environ['WorkFolder'] = work_folder
+    event = {
+        "source" : "aws.s3",
+        "detail" : { "bucket" : { "name" : S3_BUCKET }, "object" : { "key" : s3_key } },
+        "process_parms" : dict( process_parms, S3ExtractFolder = f"FSDATA/Benchmark/{scenario}" )
+    }
+    timer = StageTimer()
+    with timer.instrument( lambda_function ), PeakSampler( work_folder ) as sampler, contextlib.redirect_stdout( io.StringIO() ):
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler( event, None )
+        seconds = time.perf_counter() - start
+    shutil.rmtree( work_folder, ignore_errors=True )
+
+    mb = uncompressed_bytes / (1024 * 1024)
+    return {
+        "Scenario" : scenario,
+        "ProcessParms" : process_parms,
+        "Seconds" : round( seconds, 3 ),
+        "ThroughputMBps" : round( mb / seconds, 1 ),
+        "ArchiveMBps" : round( archive_bytes / (1024 * 1024) / seconds, 1 ),
+        "PeakRssMB" : round( sampler.peak_rss / (1024 * 1024), 1 ),
+        "PeakTmpMB" : round( sampler.peak_tmp / (1024 * 1024), 1 ),
+        "StageSeconds" : timer.stages(),
+        "ExtractedObjects" : len( response['body']['process_parms']['ZipExtracted']['S3ExtractedUrls'] )
+    }
+
+def compare_results( results, baseline, tolerance ):
+    ''' List scenarios whose throughput dropped more than tolerance (fraction) below the baseline run '''
+    baseline_results = { result['Scenario'] : result for result in baseline['Results'] }
+    regressions = []
+    for result in results:
+        if result['Scenario'] not in baseline_results.keys():
+            continue
+        previous = baseline_results[result['Scenario']]
+        change = ( result['ThroughputMBps'] - previous['ThroughputMBps'] ) / max( previous['ThroughputMBps'], 0.1 )
+        result['BaselineThroughputMBps'] = previous['ThroughputMBps']
+        result['ThroughputChange'] = round( change, 3 )
+        if change < -tolerance:
+            regressions.append( result['Scenario'] )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( '--members', type=int, default=3, help='archive member count (datasets round-robin)' )
+    parser.add_argument( '--member-mb', type=float, default=16, help='MB of CSV per member' )
+    parser.add_argument( '--string-width', type=int, default=40, help='max characters of STRING columns' )
+    parser.add_argument( '--datasets', nargs='+', default=DATASETS )
+    parser.add_argument( '--scenarios', nargs='+', default=list( SCENARIOS.keys() ), choices=list( SCENARIOS.keys() ) )
+    parser.add_argument( '--repeat', type=int, default=1, help='runs per scenario (fastest is kept)' )
+    parser.add_argument( '--output', default='', help='write JSON results to this path' )
+    parser.add_argument( '--baseline', default='', help='JSON results of an earlier run to compare throughput against' )
+    parser.add_argument( '--tolerance', type=float, default=0.10, help='throughput drop (fraction) reported as a regression' )
+    args = parser.parse_args()
+
+    work_root = tempfile.mkdtemp( prefix='unzip_benchmark_' )
+    zip_name = 'FDMD.FSDATA.D221212.FULL.ZIP'
+    zip_path = f"{work_root}/{zip_name}"
+    start = time.perf_counter()
+    member_names = generate_zip( zip_path, args.datasets, args.members, args.member_mb, args.string_width )
+    import zipfile
+    with zipfile.ZipFile( zip_path ) as archive:
+        uncompressed_bytes = sum( member.file_size for member in archive.infolist() )
+    archive_bytes = os.path.getsize( zip_path )
+    print(f"Generated '{zip_name}' ({len(member_names)} members, {uncompressed_bytes} bytes, {archive_bytes} zipped) in {time.perf_counter() - start:.1f}s")
+
+    results = []
+    with mock_s3():
+        import boto3
+        import lambda_function     # after the mock starts, so its module-level clients talk to moto
+        boto3.client('s3').create_bucket( Bucket=S3_BUCKET )
+        s3_key = f"{S3_INPUT_FOLDER}/{zip_name}"
+        lambda_function.s3_client.upload_file( zip_path, S3_BUCKET, s3_key )
+        os.remove( zip_path )
+
+        for scenario in args.scenarios:
+            try:
+                runs = [ run_scenario( lambda_function, scenario, SCENARIOS[scenario], s3_key, archive_bytes, uncompressed_bytes, work_root ) for n in range( args.repeat ) ]
+            except ImportError as e:
+                print(f"Skipping {scenario}: {e}")
+                continue
+            result = min( runs, key=lambda r: r['Seconds'] )
+            results.append( result )
+            stages = '  '.join( f"{stage} {seconds:.2f}s" for stage, seconds in result['StageSeconds'].items() )
+            print(f"{scenario:16} {result['ThroughputMBps']:8.1f} MB/s  RSS {result['PeakRssMB']:7.1f} MB  /tmp {result['PeakTmpMB']:7.1f} MB  {stages}")
+    shutil.rmtree( work_root, ignore_errors=True )
+
+    regressions = []
+    if args.baseline > '':
+        with open( args.baseline ) as f:
+            regressions = compare_results( results, json.load( f ), args.tolerance )
+        for result in results:
+            if 'ThroughputChange' in result.keys():
+                print(f"{result['Scenario']:16} {result['ThroughputChange']:+8.1%} vs baseline {result['BaselineThroughputMBps']} MB/s")
+
+    if args.output > '':
+        with open( args.output, 'w' ) as f:
+            json.dump( {
+                "Benchmark" : "unzip",
+                "Archive" : {
+                    "Name" : zip_name,
+                    "Members" : member_names,
+                    "UncompressedBytes" : uncompressed_bytes,
+                    "ArchiveBytes" : archive_bytes,
+                    "StringWidth" : args.string_width
+                },
+                "Results" : results,
+                "Regressions" : regressions
+            }, f, indent=2 )
+        print( f"Output to file '{args.output}'" )
+
+    if len(regressions) > 0:
+        print(f"Throughput regressions beyond {args.tolerance:.0%}: {regressions}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
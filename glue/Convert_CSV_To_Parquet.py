@@ -1,123 +1,753 @@
-import sys
-from awsglue.transforms import *
-from awsglue.utils import getResolvedOptions
-from pyspark.context import SparkContext
-from awsglue.context import GlueContext
-from awsglue.job import Job
-
-args = getResolvedOptions(sys.argv, ["JOB_NAME","ProcessParms"])
-#print(args)
-sc = SparkContext()
-glueContext = GlueContext(sc)
-spark = glueContext.spark_session
-job = Job(glueContext)
-job.init(args["JOB_NAME"], args)
+"""
+## Convert_CSV_To_Parquet.py -- Glue ETL job: a batch's landed CSV members to Parquet in the Datalake, partitions in the Glue Catalog
+#  (CsvToParquet takes its Spark session, Glue Catalog client & S3 storage as arguments -- main() runs it in Glue with GlueContext,
+#   and benchmark/glue_local_benchmark.py runs it on local[*] Spark with a stub catalog & a local folder standing in for S3)
+"""
 
+import sys
 import json
-batch_parms_s = args['ProcessParms']
-#print(batch_parms_s)
-batch_parms = json.loads(batch_parms_s)
-
-glue_database_name = batch_parms['GlueDatabaseName']
-#s3_bucket = batch_parms['S3OutputBucket']
-#s3_input_folder  = batch_parms['S3InputFolder']
-#s3_output_folder = batch_parms['S3OutputFolder']
-s3_input_bucket  = batch_parms['S3LandingPadBucket']
-s3_input_folder  = batch_parms['S3LandingPadInput']
-s3_output_bucket = batch_parms['S3DatalakeBucket']
-s3_output_folder = batch_parms['S3DatalakeOutput']
-glue_table_names = batch_parms['ZipExtracted']['GlueTableNames']
-partition_folders= batch_parms['ZipExtracted']['PartitionFolders']
+import uuid
+import urllib.parse
+import time
+import math
+import datetime
+import statistics
+import threading
+import contextlib
+import concurrent.futures
+
+import botocore
+from pyspark.sql import DataFrame
+from pyspark.sql.types import StructType, StructField, StringType, IntegerType, LongType, ShortType, ByteType, DoubleType, FloatType, BooleanType
+from pyspark.sql.functions import input_file_name, regexp_extract, col, to_date, to_timestamp, rand, lit, create_map
+
+try:
+    # Spark 3.2+ (Glue 4.0) -- pinned thread mode, so a local property set in a Python thread is set on the JVM thread submitting its jobs
+    from pyspark import inheritable_thread_target
+except ImportError:
+    inheritable_thread_target = None
+
+try:
+    from awsglue.transforms import ApplyMapping
+    from awsglue.dynamicframe import DynamicFrame
+except ImportError:
+    # local Spark -- no DynamicFrames: the 'DynamicFrame' reader casts a Spark CSV read & every write is Spark's parquet writer
+    ApplyMapping = DynamicFrame = None
+
+# S3_Unzip 'ExtractCodec' of the landed CSVs -- Hadoop also picks the codec by file extension (.gz, .bz2, .zst),
+# so 'zstd' (Glue 3.0+ native ZStandardCodec) and 'none' (plain CSV) need no option
+codec_compression_types = {
+    'gzip' : 'gzip',
+    'bz2'  : 'bzip2'
+}
+DEFAULT_CODEC = 'gzip'      # S3_Unzip's default, when process_parms have no 'ExtractCodec' (unzip_functions.DEFAULT_CODEC)
 
 # ToDo: source from common glue_functions.py ...
-# from glue_functions import crup_glue_partition
-def crup_glue_partition( glue_database_name, glue_table_name, partition_keys ):
-    ''' CReate or UPdate Glue Partition '''
-    glue_table = glue_client.get_table(
-        DatabaseName = glue_database_name,
-        Name = glue_table_name
-    )
-    glue_partition_sd = glue_table['Table']['StorageDescriptor'].copy()
-    glue_partition_sd['Location'] = f"{glue_partition_sd['Location']}/{partition_keys[0]}"
-    
-    partition_input = {
-        'Values' : partition_keys,
-        'StorageDescriptor' : glue_partition_sd,
-        'Parameters' : glue_table['Table']['Parameters']
-    }
-    try:
-        response = glue_client.create_partition(
-            DatabaseName = glue_database_name,
-            TableName = glue_table_name ,
-            PartitionInput = partition_input
-        )
-        status = 'Created'
+# from glue_functions import crup_glue_partitions
+GLUE_BATCH_PARTITIONS = 100    # BatchCreatePartition & BatchUpdatePartition limit per request
+GLUE_RETRY_CODES = [ 'ThrottlingException', 'ConcurrentModificationException', 'InternalServiceException', 'OperationTimeoutException' ]
+
+def glue_batch_call( glue_method, entries, entry_values, max_attempts=8, **kwargs ):
+    ''' Call a Glue batch partition method, retrying (with backoff) the call or just its throttled entries -- returns other Errors '''
+    errors = []
+    for attempt in range( max_attempts ):
+        try:
+            response = glue_method( **kwargs, **entries )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in GLUE_RETRY_CODES or attempt == max_attempts - 1:
+                raise
+            time.sleep( min( 2 ** attempt * 0.2, 10 ) )
+            continue
 
-    except glue_client.exceptions.AlreadyExistsException:
-        response = glue_client.update_partition(
+        retry_values = []
+        for error in response.get('Errors', []):
+            if error['ErrorDetail']['ErrorCode'] in GLUE_RETRY_CODES and attempt < max_attempts - 1:
+                retry_values.append( error['PartitionValues'] )
+            else:
+                errors.append( error )
+        if len(retry_values) == 0:
+            break
+        # resubmit only the throttled entries
+        entries = { key : [ entry for entry in entry_list if entry_values( entry ) in retry_values ] for key, entry_list in entries.items() }
+        time.sleep( min( 2 ** attempt * 0.2, 10 ) )
+
+    return errors
+
+def crup_glue_partitions( glue_client, glue_database_name, glue_table_name, partition_values_list, partition_folders=None, glue_table=None ):
+    ''' CReate or UPdate many Glue Partitions -- one get_table, BatchCreatePartition by 100s, BatchUpdatePartition for those that exist '''
+    if glue_table is None:
+        glue_table = glue_client.get_table(
             DatabaseName = glue_database_name,
-            TableName = glue_table_name ,
-            PartitionValueList = partition_keys,
-            PartitionInput = partition_input
+            Name = glue_table_name
         )
-        status = 'Updated'
+    if partition_folders is None:
+        partition_folders = [ partition_values[0] for partition_values in partition_values_list ]
+
+    partition_inputs = []
+    for partition_values, partition_folder in zip( partition_values_list, partition_folders ):
+        glue_partition_sd = glue_table['Table']['StorageDescriptor'].copy()
+        glue_partition_sd['Location'] = f"{glue_partition_sd['Location']}/{partition_folder}"
+        partition_inputs.append( {
+            'Values' : partition_values,
+            'StorageDescriptor' : glue_partition_sd,
+            'Parameters' : glue_table['Table']['Parameters']
+        } )
+
+    existing_inputs = []
+    for i in range( 0, len(partition_inputs), GLUE_BATCH_PARTITIONS ):
+        chunk = partition_inputs[i:i+GLUE_BATCH_PARTITIONS]
+        errors = glue_batch_call( glue_client.batch_create_partition, { 'PartitionInputList' : chunk }, lambda entry: entry['Values'],
+                                  DatabaseName = glue_database_name, TableName = glue_table_name )
+        existing_values = [ error['PartitionValues'] for error in errors if error['ErrorDetail']['ErrorCode'] == 'AlreadyExistsException' ]
+        other_errors = [ error for error in errors if error['PartitionValues'] not in existing_values ]
+        if len(other_errors) > 0:
+            raise Exception(f"BatchCreatePartition failed for Glue Table '{glue_table_name}': {other_errors}")
+        existing_inputs.extend( [ partition_input for partition_input in chunk if partition_input['Values'] in existing_values ] )
+
+    for i in range( 0, len(existing_inputs), GLUE_BATCH_PARTITIONS ):
+        entries = [ { 'PartitionValueList' : partition_input['Values'], 'PartitionInput' : partition_input } for partition_input in existing_inputs[i:i+GLUE_BATCH_PARTITIONS] ]
+        errors = glue_batch_call( glue_client.batch_update_partition, { 'Entries' : entries }, lambda entry: entry['PartitionValueList'],
+                                  DatabaseName = glue_database_name, TableName = glue_table_name )
+        if len(errors) > 0:
+            raise Exception(f"BatchUpdatePartition failed for Glue Table '{glue_table_name}': {errors}")
+
+    print(f"Partitions Created {len(partition_inputs) - len(existing_inputs)}, Updated {len(existing_inputs)} for Glue Table '{glue_table_name}' in Database '{glue_database_name}': {partition_values_list}" )
+
+    return partition_inputs
+
+# catalog types the CSV reader parses itself -- anything else is read as a string & parsed after
+native_csv_types = {
+    'string'   : StringType(),
+    'int'      : IntegerType(),
+    'bigint'   : LongType(),
+    'long'     : LongType(),
+    'smallint' : ShortType(),
+    'short'    : ShortType(),
+    'tinyint'  : ByteType(),
+    'byte'     : ByteType(),
+    'double'   : DoubleType(),
+    'float'    : FloatType(),
+    'boolean'  : BooleanType()
+}
+
+# Spark CSV reads as the DynamicFrame reader parses them -- RFC 4180 ("" within a quoted value is a quote, not Spark's
+# default \" escape), and quoted values may span lines (S3_Unzip splits members only at unquoted newlines)
+csv_read_options = {
+    'header' : True,
+    'quote' : '"',
+    'escape' : '"',
+    'sep' : ',',
+    'multiLine' : True
+}
+
+def catalog_read_schema( columns ):
+    ''' StructType for the native CSV reader, from the Glue catalog columns '''
+    return StructType( [ StructField( column['Name'], native_csv_types.get( column['Type'], StringType() ) ) for column in columns ] )
+
+def write_started():
+    ''' S3 LastModified is to the second -- files written from now on are at or after this '''
+    return datetime.datetime.now( datetime.timezone.utc ).replace( microsecond=0 ) - datetime.timedelta( seconds=1 )
+
+class S3Storage:
+    ''' The landing pad & Datalake buckets, through an S3 client '''
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def url(self, s3_bucket, s3_key):
+        return f"s3://{s3_bucket}/{s3_key}"
+
+    def split_url(self, s3_url):
+        ''' (bucket, key) of an url() '''
+        return tuple( s3_url[len('s3://'):].split('/', 1) )
+
+    def list_objects(self, s3_bucket, s3_prefix):
+        ''' Objects under a prefix -- dicts with 'Key', 'Size', 'ETag' & 'LastModified' '''
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate( Bucket=s3_bucket, Prefix=s3_prefix ):
+            yield from page.get('Contents', [])
+
+    def read_json(self, s3_bucket, s3_key):
+        ''' An object's JSON, or None when it does not exist '''
+        try:
+            response = self.s3_client.get_object( Bucket=s3_bucket, Key=s3_key )
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return json.loads( response['Body'].read() )
+
+    def write_json(self, s3_bucket, s3_key, value):
+        self.s3_client.put_object( Bucket=s3_bucket, Key=s3_key, Body=json.dumps( value ).encode() )
+
+    def delete_prefix(self, s3_bucket, s3_prefix):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate( Bucket=s3_bucket, Prefix=s3_prefix ):
+            if len(page.get('Contents', [])) > 0:
+                self.s3_client.delete_objects( Bucket=s3_bucket, Delete={ 'Objects' : [ { 'Key' : s3_object['Key'] } for s3_object in page['Contents'] ], 'Quiet' : True } )
+
+    def delete_objects(self, s3_bucket, s3_keys):
+        for i in range( 0, len(s3_keys), 1000 ):    # DeleteObjects limit per request
+            self.s3_client.delete_objects( Bucket=s3_bucket, Delete={ 'Objects' : [ { 'Key' : s3_key } for s3_key in s3_keys[i:i+1000] ], 'Quiet' : True } )
+
+    def move_objects(self, s3_bucket, s3_key_moves):
+        ''' Rename objects -- { from key : to key }, by server-side copy (multipart when large), then delete '''
+        for from_key, to_key in s3_key_moves.items():
+            self.s3_client.copy( { 'Bucket' : s3_bucket, 'Key' : from_key }, s3_bucket, to_key )
+        self.delete_objects( s3_bucket, list( s3_key_moves.keys() ) )
+
+class CsvToParquet:
+    ''' Convert a batch's landed CSVs ('ProcessParms' with S3_Unzip's 'ZipExtracted') to Parquet & register their Glue Partitions '''
+
+    def __init__(self, batch_parms, spark, glue_client, storage, glue_context=None):
+        self.batch_parms = batch_parms
+        self.spark = spark
+        self.glue_client = glue_client
+        self.storage = storage
+        self.glue_context = glue_context if DynamicFrame is not None else None     # None -- Spark readers & writer only
+
+        self.glue_database_name = batch_parms['GlueDatabaseName']
+        self.s3_input_bucket  = batch_parms['S3LandingPadBucket']
+        self.s3_input_folder  = batch_parms['S3LandingPadInput']
+        self.s3_output_bucket = batch_parms['S3DatalakeBucket']
+        self.s3_output_folder = batch_parms['S3DatalakeOutput']
+        self.glue_table_names = batch_parms['ZipExtracted']['GlueTableNames']
+        self.partition_folders= batch_parms['ZipExtracted']['PartitionFolders']
+
+        self.codec_options = {}
+        self.extract_codec = batch_parms.get('ExtractCodec', DEFAULT_CODEC)
+        if self.extract_codec in codec_compression_types.keys():
+            self.codec_options['compressionType'] = codec_compression_types[self.extract_codec]
+
+        # 'DynamicFrame' (default) reads every column as a string, then casts them all with ApplyMapping;
+        # 'Native' reads with a StructType built from the catalog columns (no inference, no all-string pass) and parses
+        # dates, timestamps & decimals as column expressions -- a table whose files do not parse falls back to 'DynamicFrame'
+        self.csv_reader = batch_parms.get('GlueCsvReader', 'DynamicFrame')
+        self.csv_date_format = batch_parms.get('CsvDateFormat', None)           # e.g., 'MM/dd/yyyy'; default as a cast would
+        self.csv_timestamp_format = batch_parms.get('CsvTimestampFormat', None)
+
+        # 'SinglePass' reads & writes each table's partitions together, in one Spark job with partitionKeys (listing the landing prefix once, if need be),
+        # then renames the files into each partition folder -- a table with no partition keys is converted PerPartition
+        self.glue_read_mode = batch_parms.get('GlueReadMode', 'PerPartition')
+
+        # 'GlueIncremental' -- 'Manifest' keeps a manifest per Glue Table of the landed objects already converted (S3 url -> ETag)
+        # at 's3://{S3DatalakeBucket}/{S3DatalakeOutput}/_manifests/{glue_table_name}.json', and converts only the objects
+        # new or changed since; 'Bookmark' reads each table/partition folder through its own Glue job bookmark instead.
+        # 'IncrementalWrite' (Manifest) -- 'Append' (default) adds the new objects to the partitions they touch; 'Replace'
+        # rewrites those partitions from all of their landed objects.  Partitions with nothing new are not read, written or registered
+        self.glue_incremental = batch_parms.get('GlueIncremental', 'None')
+        self.incremental_write = batch_parms.get('IncrementalWrite', 'Append') if self.glue_incremental == 'Manifest' else 'Append'
+        if self.glue_incremental == 'Bookmark':
+            # only create_dynamic_frame reads are bookmarked
+            self.glue_read_mode, self.csv_reader = 'PerPartition', 'DynamicFrame'
+        self.landed_etags = {}
+        self.manifests = {}
+
+        # output file sizing -- 'TargetFileMB' & 'RowGroupMB' process_parms, each a number or { glue_table_name : number, '*' : default };
+        # without 'TargetFileMB' Spark writes however many files its read partitions make.  The Parquet size is estimated from the
+        # landed CSV bytes by 'ParquetSizeRatio' (default 0.3 for plain CSV, 1.0 for CSV already compressed by 'ExtractCodec')
+        self.parquet_size_ratio = float( batch_parms.get('ParquetSizeRatio', 0.3 if self.extract_codec == 'none' else 1.0) )
+
+        # 'GlueTableConcurrency' -- tables converted at once, each from its own driver thread in its own FAIR scheduler pool,
+        # so a small table's stages run on the executors a large table leaves idle (default 1 -- one table after another).
+        # Per-table pools need Spark 3.2+ pinned threads (Glue 4.0); on older Spark the tables still overlap, in the default pool
+        self.table_concurrency = int( batch_parms.get('GlueTableConcurrency', 1) )
+
+        self.landed_files = None
+        self.folder_sizes = {}      # { (s3_bucket, s3_folder) : { s3_key : size } } -- each landing folder listed once
+        self.stage_seconds = {}     # seconds per stage, summed over tables -- 'Write' includes the (lazy) read
+        self.output_files = []      # report_output_files() of each write
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, stage_name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stage_seconds[stage_name] = self.stage_seconds.get( stage_name, 0 ) + time.perf_counter() - start
+
+    def list_landed_files(self, landed_etags=None):
+        ''' One listing of the landing prefix -- { glue_table_name : { partition_folder : [ s3 urls ] } } for this batch (& their ETags) '''
+        landed_files = { glue_table_name : {} for glue_table_name in self.glue_table_names }
+        for s3_object in self.storage.list_objects( self.s3_input_bucket, f"{self.s3_input_folder}/" ):
+            # '{s3_folder}/{glue_table_name}/{partition_folder}/{member file}' -- anything else is not a landed member
+            nodes = s3_object['Key'][len(self.s3_input_folder)+1:].split('/')
+            if len(nodes) == 3 and nodes[0] in landed_files.keys() and nodes[1] in self.partition_folders:
+                s3_url = self.storage.url( self.s3_input_bucket, s3_object['Key'] )
+                landed_files[nodes[0]].setdefault( nodes[1], [] ).append( s3_url )
+                if landed_etags is not None:
+                    landed_etags[s3_url] = s3_object['ETag']
+        return landed_files
+
+    def extracted_files(self, s3_extracted_urls):
+        ''' S3_Unzip's 'S3ExtractedUrls' as { glue_table_name : { partition_folder : [ s3 urls ] } } -- no S3 listing '''
+        landed_files = { glue_table_name : {} for glue_table_name in self.glue_table_names }
+        for s3_url in s3_extracted_urls:
+            # 's3://{bucket}/{extract folder}/{glue_table_name}/{partition_folder}/{member file}' (or a split member's part)
+            glue_table_name, partition_folder = s3_url.split('/')[-3], s3_url.split('/')[-2]
+            if glue_table_name in landed_files.keys() and partition_folder in self.partition_folders:
+                landed_files[glue_table_name].setdefault( partition_folder, [] ).append( s3_url )
+        return landed_files
+
+    def manifest_key(self, glue_table_name):
+        return f"{self.s3_output_folder}/_manifests/{glue_table_name}.json"
+
+    def read_manifest(self, glue_table_name):
+        ''' Landed objects already converted for a Glue Table -- { s3 url : ETag } '''
+        return self.storage.read_json( self.s3_output_bucket, self.manifest_key( glue_table_name ) ) or {}
 
-    print(f"Partitions {status} for Glue Table '{glue_table_name}' in Database '{glue_database_name}: {partition_keys}'" )
+    def record_converted(self, glue_table_name, converted_urls):
+        ''' Add the objects just converted to the Glue Table's manifest '''
+        if self.glue_incremental != 'Manifest' or len(converted_urls) == 0:
+            return
+        manifest = self.manifests[glue_table_name]
+        manifest.update( { s3_url : self.landed_etags.get( s3_url, '' ) for s3_url in converted_urls } )
+        self.storage.write_json( self.s3_output_bucket, self.manifest_key( glue_table_name ), manifest )
+        print(f"Manifest for Glue Table '{glue_table_name}' now has {len(manifest)} converted objects")
 
-    return glue_partition_sd
+    def incremental_files(self, landed_files, listed_files):
+        ''' landed_files narrowed to the partitions with objects not in their table's manifest '''
+        new_files = {}
+        for glue_table_name, table_files in landed_files.items():
+            new_files[glue_table_name] = {}
+            for partition_folder, s3_urls in table_files.items():
+                new_urls = [ s3_url for s3_url in s3_urls if self.manifests[glue_table_name].get( s3_url ) != self.landed_etags.get( s3_url ) ]
+                if len(new_urls) == 0:
+                    continue
+                new_files[glue_table_name][partition_folder] = listed_files[glue_table_name].get( partition_folder, s3_urls ) if self.incremental_write == 'Replace' else new_urls
+            landed_count = sum( len(s3_urls) for s3_urls in table_files.values() )
+            new_count = sum( len(s3_urls) for s3_urls in new_files[glue_table_name].values() )
+            print(f"Glue Table '{glue_table_name}': {new_count} of {landed_count} landed objects to convert ({self.incremental_write}) in {len(new_files[glue_table_name])} partitions")
+        return new_files
 
-import boto3
-glue_client = boto3.client('glue')
+    def clear_output(self, s3_url):
+        ''' Delete a partition's Parquet before it is rewritten ('Replace') '''
+        if self.incremental_write != 'Replace':
+            return
+        self.storage.delete_prefix( *self.storage.split_url( s3_url ) )
 
-for glue_table_name in glue_table_names:
+    def clear_written(self, s3_url, written_since):
+        ''' Delete what a failed write left under s3_url (objects written since written_since), before the write is retried -- in any IncrementalWrite '''
+        s3_bucket, s3_prefix = self.storage.split_url( s3_url )
+        s3_keys = [ s3_object['Key'] for s3_object in self.storage.list_objects( s3_bucket, s3_prefix ) if s3_object['LastModified'] >= written_since ]
+        if len(s3_keys) > 0:
+            print(f"Deleting {len(s3_keys)} objects a failed write left under '{s3_url}'")
+            self.storage.delete_objects( s3_bucket, s3_keys )
 
-    glue_table = glue_client.get_table(
-        DatabaseName = glue_database_name,
-        Name = glue_table_name
-    )
-    columns = glue_table['Table']['StorageDescriptor']['Columns']
-    str_to_sd_mappings = []
-    for column in columns:
+    def parsed_column(self, column):
+        ''' Column expression parsing a catalog column the reader left as a string (date, timestamp, decimal(p,s), ...) '''
+        name, glue_type = column['Name'], column['Type']
+        if glue_type in native_csv_types.keys():
+            return col(f"`{name}`")
+        if glue_type == 'date':
+            return to_date( col(f"`{name}`"), self.csv_date_format ).alias( name )
+        if glue_type == 'timestamp':
+            return to_timestamp( col(f"`{name}`"), self.csv_timestamp_format ).alias( name )
+        return col(f"`{name}`").cast( glue_type ).alias( name )
+
+    def read_csv_native(self, paths, columns):
+        ''' Typed DataFrame of CSV files -- FAILFAST, so a malformed file fails the write instead of becoming nulls '''
+        s3_input_df = self.spark.read.schema( catalog_read_schema( columns ) ).options(
+            **csv_read_options, mode='FAILFAST', enforceSchema=False
+        ).csv( paths )
+        return s3_input_df.select( *[ self.parsed_column( column ) for column in columns ] )
+
+    def read_csv_cast(self, paths, columns):
+        ''' Typed DataFrame of CSV files read as strings, then cast to the catalog types as ApplyMapping does '''
+        s3_input_df = self.spark.read.options( **csv_read_options ).csv( paths )
         # CSV files wherein all values are enclosed in "" ...
-        str_to_sd_mappings.append ( (column['Name'], 'string', column['Name'], column['Type']) )
+        return s3_input_df.select( *[ col(f"`{column['Name']}`").cast( column['Type'] ).alias( column['Name'] ) for column in columns ] )
+
+    def table_parm(self, parm_name, glue_table_name, default=None):
+        ''' process_parm for a Glue Table -- a single value, or by table name (with '*' for the rest) '''
+        value = self.batch_parms.get( parm_name, default )
+        if isinstance( value, dict ):
+            return value.get( glue_table_name, value.get( '*', default ) )
+        return value
+
+    def parquet_format_options(self, glue_table_name):
+        ''' glueparquet format_options -- 'blockSize' is the row group size '''
+        format_options = {"compression": "snappy"}
+        row_group_mb = self.table_parm( 'RowGroupMB', glue_table_name )
+        if row_group_mb is not None:
+            format_options['blockSize'] = int( float(row_group_mb) * 1024 * 1024 )
+        return format_options
+
+    def landed_bytes(self, s3_urls):
+        ''' Total size of landed files (or 's3://.../' folders) -- one listing per folder '''
+        folder_keys = {}
+        for s3_url in s3_urls:
+            s3_bucket, s3_key = self.storage.split_url( s3_url )
+            s3_folder = s3_key if s3_key.endswith('/') else s3_key[:s3_key.rfind('/')+1]
+            folder_keys.setdefault( ( s3_bucket, s3_folder ), set() ).add( s3_key )
+        total_bytes = 0
+        for ( s3_bucket, s3_folder ), s3_keys in folder_keys.items():
+            if ( s3_bucket, s3_folder ) not in self.folder_sizes.keys():
+                self.folder_sizes[( s3_bucket, s3_folder )] = { s3_object['Key'] : s3_object['Size'] for s3_object in self.storage.list_objects( s3_bucket, s3_folder ) }
+            folder_sizes = self.folder_sizes[( s3_bucket, s3_folder )]
+            total_bytes += sum( folder_sizes.values() ) if s3_folder in s3_keys else sum( folder_sizes.get( s3_key, 0 ) for s3_key in s3_keys )
+        return total_bytes
+
+    def target_file_count(self, glue_table_name, s3_urls):
+        ''' Parquet files to write for the landed s3_urls -- None without a 'TargetFileMB' '''
+        target_file_mb = self.table_parm( 'TargetFileMB', glue_table_name )
+        if target_file_mb is None:
+            return None
+        estimated_bytes = self.landed_bytes( s3_urls ) * self.parquet_size_ratio
+        return max( 1, math.ceil( estimated_bytes / ( float(target_file_mb) * 1024 * 1024 ) ) )
+
+    def sized_frame(self, frame, file_count):
+        ''' DynamicFrame (or DataFrame) with file_count partitions -- coalesce to merge (no shuffle), repartition to split '''
+        if file_count is None:
+            return frame
+        partition_count = frame.rdd.getNumPartitions() if isinstance( frame, DataFrame ) else frame.getNumPartitions()
+        if file_count < partition_count:
+            return frame.coalesce( file_count )
+        if file_count > partition_count:
+            return frame.repartition( file_count )
+        return frame
+
+    def report_output_files(self, glue_table_name, s3_url, written_since):
+        ''' Count & size distribution of the Parquet files written under s3_url '''
+        file_sizes = [ s3_object['Size'] / 1024 / 1024
+            for s3_object in self.storage.list_objects( *self.storage.split_url( s3_url ) )
+            if s3_object['LastModified'] >= written_since and s3_object['Key'].endswith('.parquet') ]
+        if len(file_sizes) == 0:
+            print(f"No Parquet files written to '{s3_url}'")
+            return
+        target_file_mb = self.table_parm( 'TargetFileMB', glue_table_name )
+        print(f"Wrote {len(file_sizes)} Parquet files ({sum(file_sizes):.1f} MB) to '{s3_url}' -- MB min {min(file_sizes):.1f}, "
+              f"median {statistics.median(file_sizes):.1f}, max {max(file_sizes):.1f}" + ( f", target {target_file_mb}" if target_file_mb is not None else '' ) )
+        with self.lock:
+            self.output_files.append( {
+                "GlueTableName" : glue_table_name,
+                "Url" : s3_url,
+                "Files" : len(file_sizes),
+                "MB" : round( sum(file_sizes), 3 ),
+                "MinMB" : round( min(file_sizes), 3 ),
+                "MedianMB" : round( statistics.median(file_sizes), 3 ),
+                "MaxMB" : round( max(file_sizes), 3 )
+            } )
+
+    # row order -- 'SortKeys' & 'BloomFilterColumns' process_parms (a list, or { glue_table_name : list, '*' : default }),
+    # else the Glue Table's 'sort_keys' & 'bloom_filter_columns' Parameters (comma separated).  Rows sorted within each file
+    # give every row group tight min/max statistics to skip by; bloom filters (Spark's parquet writer, Glue 4.0+) skip
+    # row groups on equality predicates where min/max cannot, e.g., an id scattered across the file
+    def table_columns_parm(self, parm_name, table_parameter, glue_table_name, glue_table):
+        ''' Column names for a Glue Table from process_parms, else from its catalog Parameters '''
+        value = self.table_parm( parm_name, glue_table_name )
+        if value is None:
+            value = glue_table['Table'].get('Parameters', {}).get( table_parameter, '' )
+        if isinstance( value, str ):
+            value = value.split(',')
+        return [ column.strip() for column in value if column.strip() > '' ]
+
+    def write_parquet(self, frame, glue_table_name, glue_table, s3_output_url, partition_keys, transformation_ctx):
+        ''' Write a DynamicFrame (or DataFrame) as Parquet -- sorted within each file by the table's sort keys, with its bloom filter columns '''
+        sort_keys = self.table_columns_parm( 'SortKeys', 'sort_keys', glue_table_name, glue_table )
+        bloom_filter_columns = self.table_columns_parm( 'BloomFilterColumns', 'bloom_filter_columns', glue_table_name, glue_table )
+        format_options = self.parquet_format_options( glue_table_name )
+        data_frame = frame if isinstance( frame, DataFrame ) else frame.toDF()
+        if len(sort_keys) > 0:
+            # partition keys first, so the partitioned write keeps the order
+            data_frame = frame = data_frame.sortWithinPartitions( *partition_keys, *sort_keys )
+        if len(bloom_filter_columns) == 0 and self.glue_context is not None:
+            if isinstance( frame, DataFrame ):
+                frame = DynamicFrame.fromDF( frame, self.glue_context, f"{glue_table_name}_typed" )
+            return self.glue_context.write_dynamic_frame.from_options(
+                frame=frame,
+                connection_type="s3",
+                format="glueparquet",
+                connection_options={
+                    "path": s3_output_url,
+                    "partitionKeys": partition_keys,
+                },
+                format_options=format_options,
+                transformation_ctx=transformation_ctx,
+            )
+
+        # glueparquet writes no bloom filters (nor runs outside Glue) -- Spark's parquet writer, with statistics & dictionary encoding as glueparquet's
+        writer = data_frame.write.mode('append').option( 'compression', format_options['compression'] ).option( 'parquet.enable.dictionary', 'true' )
+        if 'blockSize' in format_options.keys():
+            writer = writer.option( 'parquet.block.size', str(format_options['blockSize']) )
+        for column in bloom_filter_columns:
+            writer = writer.option( f"parquet.bloom.filter.enabled#{column}", 'true' )
+        writer.partitionBy( *partition_keys ).parquet( s3_output_url )
+        print(f"Wrote Glue Table '{glue_table_name}' sorted by {sort_keys} with bloom filters on {bloom_filter_columns}")
+
+    def run_tables(self, convert, glue_table_names):
+        ''' convert( glue_table_name ) for each Glue Table -- { glue_table_name : result }, raising after all are done if any failed '''
+        spark_context = self.spark.sparkContext
+        def pooled( glue_table_name ):
+            spark_context.setLocalProperty( 'spark.scheduler.pool', glue_table_name )     # the Spark jobs this thread submits
+            try:
+                return convert( glue_table_name )
+            finally:
+                spark_context.setLocalProperty( 'spark.scheduler.pool', None )
+
+        results, errors = {}, {}
+        if self.table_concurrency <= 1:
+            for glue_table_name in glue_table_names:
+                results[glue_table_name] = convert( glue_table_name )
+            return results
+
+        if self.landed_files is not None:
+            # the largest (landed bytes) first, so the small ones overlap it rather than wait for it
+            table_bytes = { glue_table_name : self.landed_bytes( [ s3_url for s3_urls in self.landed_files.get( glue_table_name, {} ).values() for s3_url in s3_urls ] ) for glue_table_name in glue_table_names }
+            glue_table_names = sorted( glue_table_names, key=lambda glue_table_name: -table_bytes[glue_table_name] )
+        if inheritable_thread_target is not None:
+            pooled_target = inheritable_thread_target( pooled )
+        else:
+            print(f"Spark {self.spark.version} has no pinned threads -- {len(glue_table_names)} Glue Tables converted concurrently in the default scheduler pool")
+            pooled_target = convert
+
+        with concurrent.futures.ThreadPoolExecutor( max_workers=self.table_concurrency ) as executor:
+            futures = { executor.submit( pooled_target, glue_table_name ) : glue_table_name for glue_table_name in glue_table_names }
+            for future in concurrent.futures.as_completed( futures ):
+                glue_table_name = futures[future]
+                try:
+                    results[glue_table_name] = future.result()
+                    print(f"Converted Glue Table '{glue_table_name}'")
+                except Exception as e:
+                    errors[glue_table_name] = e
+                    print(f"ERROR: Glue Table '{glue_table_name}' failed: {e}")
+        if len(errors) > 0:
+            raise Exception(f"{len(errors)} of {len(glue_table_names)} Glue Tables failed: { { glue_table_name : str(e) for glue_table_name, e in errors.items() } }")
+        return results
+
+    def get_glue_table(self, glue_table_name):
+        return self.glue_client.get_table(
+            DatabaseName = self.glue_database_name,
+            Name = glue_table_name
+        )
+
+    def convert_table_single_pass(self, glue_table_name):
+        ''' Read & write all of a Glue Table's partitions at once, with partitionKeys -- False when it falls back to PerPartition '''
+        glue_table = self.get_glue_table( glue_table_name )
+        if len( glue_table['Table'].get('PartitionKeys', []) ) == 0:
+            print(f"Glue Table '{glue_table_name}' has no partition keys -- falling back to PerPartition")
+            return False
+        partition_key = glue_table['Table']['PartitionKeys'][0]['Name']
+        table_files = [ s3_url for partition_files in self.landed_files[glue_table_name].values() for s3_url in partition_files ]
+        if len(table_files) == 0:
+            print(f"No landed files for Glue Table '{glue_table_name}' in 's3://{self.s3_input_bucket}/{self.s3_input_folder}/' -- skipped")
+            return True
+
+        # every partition in one read -- the partition value comes from each row's file path
+        # (Hadoop picks each file's codec by its extension, so codec_options are not needed here)
+        columns = glue_table['Table']['StorageDescriptor']['Columns']
+        if self.csv_reader == 'Native':
+            typed_df = self.read_csv_native( table_files, columns )
+        else:
+            typed_df = self.read_csv_cast( table_files, columns )
+        typed_df = typed_df.withColumn( partition_key, regexp_extract( input_file_name(), f"/{glue_table_name}/([^/]+)/[^/]+$", 1 ) )
+
+        partition_file_counts = { partition_folder : self.target_file_count( glue_table_name, partition_files ) for partition_folder, partition_files in self.landed_files[glue_table_name].items() }
+        if None not in partition_file_counts.values():
+            # about that many files per partition folder -- rows hashed by partition value & a salt below its file count
+            file_count_map = create_map( *[ lit(value) for item in partition_file_counts.items() for value in item ] )
+            typed_df = typed_df.withColumn( '_file_salt', ( rand() * file_count_map[col(partition_key)] ).cast('int') )
+            typed_df = typed_df.repartition( sum( partition_file_counts.values() ), partition_key, '_file_salt' ).drop( '_file_salt' )
+
+        # one write (one Spark job) to a staging folder, where partitionKeys lays out '{partition_key}={partition_folder}/';
+        # its files are then renamed into '{table}/{partition_folder}/', as PerPartition & S3_Unzip's Parquet fast path lay them out
+        s3_table_key = f"{self.s3_output_folder}/{glue_table_name}/"
+        s3_staging_key = f"{self.s3_output_folder}/_single_pass/{glue_table_name}/{uuid.uuid4().hex}/"     # this run's own
+        written_since = write_started()
+        try:
+            with self.stage( 'Write' ):
+                self.write_parquet( typed_df, glue_table_name, glue_table, self.storage.url( self.s3_output_bucket, s3_staging_key ), [ partition_key ], f"s3_output_sink_{glue_table_name}" )
+        except Exception as e:
+            if self.csv_reader != 'Native':
+                raise
+            print(f"Native CSV reader failed for Glue Table '{glue_table_name}' -- falling back to DynamicFrame: {e}")
+            self.storage.delete_prefix( self.s3_output_bucket, s3_staging_key )
+            return False
+
+        with self.stage( 'Rename' ):
+            partition_moves = {}
+            for s3_object in self.storage.list_objects( self.s3_output_bucket, f"{s3_staging_key}{partition_key}=" ):
+                # '{staging}/{partition_key}={escaped partition_folder}/{file}' -- Spark escapes the value as a path name
+                partition_node, file_name = s3_object['Key'][len(s3_staging_key):].split('/', 1)
+                partition_folder = urllib.parse.unquote( partition_node[len(partition_key)+1:] )
+                partition_moves.setdefault( partition_folder, {} )[s3_object['Key']] = f"{s3_table_key}{partition_folder}/{file_name}"
+            for partition_folder, s3_key_moves in partition_moves.items():
+                self.clear_output( self.storage.url( self.s3_output_bucket, f"{s3_table_key}{partition_folder}/" ) )
+                self.storage.move_objects( self.s3_output_bucket, s3_key_moves )
+            self.storage.delete_prefix( self.s3_output_bucket, s3_staging_key )    # e.g., Spark's _SUCCESS
+        with self.stage( 'Report' ):
+            for partition_folder in partition_moves.keys():
+                self.report_output_files( glue_table_name, self.storage.url( self.s3_output_bucket, f"{s3_table_key}{partition_folder}/" ), written_since )
+
+        # the partitions the write produced -- at their default Location, '{table}/{partition_folder}'
+        with self.stage( 'Register' ):
+            if len(partition_moves) > 0:
+                crup_glue_partitions( self.glue_client, self.glue_database_name, glue_table_name, [ [ partition_folder ] for partition_folder in partition_moves.keys() ], glue_table=glue_table )
+            self.record_converted( glue_table_name, table_files )
+        return True
+
+    def read_csv_dynamic_frame(self, input_connection_options, columns, input_ctx):
+        ''' Typed DynamicFrame of CSV files -- all strings, cast by ApplyMapping (locally, read_csv_cast) '''
+        if self.glue_context is None:
+            return self.read_csv_cast( input_connection_options['paths'], columns )
+
+        str_to_sd_mappings = []
+        for column in columns:
+            # CSV files wherein all values are enclosed in "" ...
+            str_to_sd_mappings.append ( (column['Name'], 'string', column['Name'], column['Type']) )
 
-    for partition_folder in partition_folders:
         # Script generated for node S3 bucket
-        s3_input_df = glueContext.create_dynamic_frame.from_options(
+        s3_input_df = self.glue_context.create_dynamic_frame.from_options(
             format_options={
                 "quoteChar": '"',
                 "withHeader": True,
                 "separator": ",",
+                "multiLine": True,
                 "optimizePerformance": False,
             },
             connection_type="s3",
             format="csv",
             connection_options={
-                "paths": [
-                    f"s3://{s3_input_bucket}/{s3_input_folder}/{glue_table_name}/{partition_folder}/"
-                ],
-                "recurse": True,
+                **input_connection_options,
+                **self.codec_options,
             },
-            transformation_ctx="s3_input_df",
+            transformation_ctx=input_ctx,
         )
+        if self.glue_incremental == 'Bookmark' and s3_input_df.toDF().rdd.isEmpty():
+            return None
         # Script generated for node ApplyMapping
-        apply_str_to_sd_mappings = ApplyMapping.apply(
+        return ApplyMapping.apply(
             frame=s3_input_df,
             mappings = str_to_sd_mappings,
             transformation_ctx="ApplyMapping_node2",
         )
-        # Script generated for node S3 bucket
-        s3_output_sink = glueContext.write_dynamic_frame.from_options(
-            frame=apply_str_to_sd_mappings,
-            connection_type="s3",
-            format="glueparquet",
-            connection_options={
-                "path": f"s3://{s3_output_bucket}/{s3_output_folder}/{glue_table_name}/{partition_folder}/",
-                "partitionKeys": [],
-            },
-            format_options={"compression": "snappy"},
-            transformation_ctx="s3_output_sink",
-        )
-        crup_glue_partition( glue_database_name, glue_table_name, [ partition_folder ] )
 
-job.commit()
\ No newline at end of file
+    def convert_table(self, glue_table_name):
+        ''' Read & write each of a Glue Table's partitions on its own '''
+        glue_table = self.get_glue_table( glue_table_name )
+        columns = glue_table['Table']['StorageDescriptor']['Columns']
+
+        written_partitions = []     # registered all at once, after the table's partitions are written
+        for partition_folder in self.partition_folders:
+            input_ctx = "s3_input_df"
+            input_folder_url = self.storage.url( self.s3_input_bucket, f"{self.s3_input_folder}/{glue_table_name}/{partition_folder}/" )
+            if self.glue_incremental == 'Bookmark':
+                # the folder, less what this table/partition's own bookmark has already seen
+                input_connection_options = {
+                    "paths": [ input_folder_url ],
+                    "recurse": True,
+                }
+                input_ctx = f"s3_input_{glue_table_name}_{partition_folder}"
+            elif self.landed_files is None:
+                input_connection_options = {
+                    "paths": [ input_folder_url ],
+                    "recurse": True,
+                }
+            elif partition_folder in self.landed_files[glue_table_name].keys():
+                input_connection_options = { "paths": self.landed_files[glue_table_name][partition_folder] }
+            else:
+                continue    # this table has no member in this partition
+            file_count = self.target_file_count( glue_table_name, input_connection_options['paths'] )
+            s3_output_url = self.storage.url( self.s3_output_bucket, f"{self.s3_output_folder}/{glue_table_name}/{partition_folder}/" )
+            self.clear_output( s3_output_url )
+            written_since = write_started()
+
+            if self.csv_reader == 'Native':
+                try:
+                    with self.stage( 'Write' ):
+                        self.write_parquet( self.sized_frame( self.read_csv_native( input_connection_options['paths'], columns ), file_count ),
+                            glue_table_name, glue_table, s3_output_url, [], "s3_output_sink" )
+                except Exception as e:
+                    print(f"Native CSV reader failed for '{glue_table_name}/{partition_folder}' -- falling back to DynamicFrame: {e}")
+                    self.clear_written( s3_output_url, written_since )
+                else:
+                    with self.stage( 'Report' ):
+                        self.report_output_files( glue_table_name, s3_output_url, written_since )
+                    written_partitions.append( [ partition_folder ] )
+                    continue
+
+            with self.stage( 'Write' ):
+                typed_frame = self.read_csv_dynamic_frame( input_connection_options, columns, input_ctx )
+                if typed_frame is None:
+                    print(f"Nothing new in '{input_connection_options['paths'][0]}' since the job bookmark -- skipped")
+                    continue
+                # Script generated for node S3 bucket
+                self.write_parquet( self.sized_frame( typed_frame, file_count ), glue_table_name, glue_table, s3_output_url, [], "s3_output_sink" )
+            with self.stage( 'Report' ):
+                self.report_output_files( glue_table_name, s3_output_url, written_since )
+            written_partitions.append( [ partition_folder ] )
+
+        if len(written_partitions) > 0:
+            with self.stage( 'Register' ):
+                crup_glue_partitions( self.glue_client, self.glue_database_name, glue_table_name, written_partitions, glue_table=glue_table )
+                if self.glue_incremental == 'Manifest':
+                    self.record_converted( glue_table_name, [ s3_url for partition_values in written_partitions for s3_url in self.landed_files[glue_table_name][partition_values[0]] ] )
+
+    def run(self):
+        ''' Convert the batch -- { 'GlueTableNames', 'StageSeconds', 'OutputFiles' } '''
+        glue_table_names = self.glue_table_names
+        zip_extracted = self.batch_parms['ZipExtracted']
+        if zip_extracted.get('ParquetConverted', False):
+            # S3_Unzip already wrote Parquet & registered partitions (small batch fast path)
+            print(f"ZipExtracted already converted to Parquet -- nothing to do for {glue_table_names}")
+            glue_table_names = []
+        elif len(glue_table_names) == 0:
+            # every member matched the S3_Unzip 'DedupLedger' -- nothing changed since the last delivery
+            print(f"No changed tables in ZipExtracted -- skipped unchanged {zip_extracted.get('UnchangedMembers', [])}")
+
+        # read exactly this batch's objects from ZipExtracted 'S3ExtractedUrls' -- a prefix scan only when it has none
+        s3_extracted_urls = zip_extracted.get('S3ExtractedUrls', [])
+        if len(s3_extracted_urls) > 0:
+            self.landed_files = self.extracted_files( s3_extracted_urls )
+        else:
+            print(f"No S3ExtractedUrls in ZipExtracted -- scanning 's3://{self.s3_input_bucket}/{self.s3_input_folder}/' instead")
+
+        if self.glue_incremental == 'Manifest' and len(glue_table_names) > 0:
+            # one listing for the ETags (& the batch's objects, when ZipExtracted has no S3ExtractedUrls)
+            with self.stage( 'List' ):
+                listed_files = self.list_landed_files( self.landed_etags )
+                self.manifests = { glue_table_name : self.read_manifest( glue_table_name ) for glue_table_name in glue_table_names }
+                self.landed_files = self.incremental_files( listed_files if self.landed_files is None else self.landed_files, listed_files )
+
+        if self.glue_read_mode == 'SinglePass' and len(glue_table_names) > 0:
+            if self.landed_files is None:
+                with self.stage( 'List' ):
+                    self.landed_files = self.list_landed_files()
+            single_pass = self.run_tables( self.convert_table_single_pass, glue_table_names )
+            glue_table_names = [ glue_table_name for glue_table_name in glue_table_names if single_pass[glue_table_name] is False ]     # the rest are written
+            self.csv_reader = 'DynamicFrame'
+
+        self.run_tables( self.convert_table, glue_table_names )
+        return {
+            "GlueTableNames" : self.glue_table_names,
+            "StageSeconds" : { stage_name : round( seconds, 3 ) for stage_name, seconds in self.stage_seconds.items() },
+            "OutputFiles" : self.output_files
+        }
+
+def main():
+    ''' The Glue job -- 'ProcessParms' is the Step Function's process_parms & S3_Unzip's ZipExtracted '''
+    import boto3
+    from awsglue.utils import getResolvedOptions
+    from pyspark.context import SparkContext, SparkConf
+    from awsglue.context import GlueContext
+    from awsglue.job import Job
+
+    args = getResolvedOptions(sys.argv, ["JOB_NAME","ProcessParms"])
+    #print(args)
+    sc = SparkContext( conf=SparkConf().set('spark.scheduler.mode', 'FAIR') )     # FAIR pools for 'GlueTableConcurrency'
+    glueContext = GlueContext(sc)
+    spark = glueContext.spark_session
+    job = Job(glueContext)
+    job.init(args["JOB_NAME"], args)
+
+    batch_parms_s = args['ProcessParms']
+    #print(batch_parms_s)
+    batch_parms = json.loads(batch_parms_s)
+
+    result = CsvToParquet( batch_parms, spark, boto3.client('glue'), S3Storage( boto3.client('s3') ), glueContext ).run()
+    print(f"Stage seconds: {result['StageSeconds']}")
+
+    job.commit()
+
+if __name__ == '__main__':
+    main()
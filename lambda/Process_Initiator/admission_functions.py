@@ -0,0 +1,174 @@
+"""
+## admission_functions.py -- Admission control: start an execution only while the state machine has a free slot
+#  (over 'MaxInFlight' RUNNING executions, the execution is queued by feed 'Priority' then arrival, and is
+#   started when a slot opens -- as each execution closes, or by the scheduled drain)
+#  The limit is on the state machine's RUNNING executions, which bounds the Glue job runs they start (at most one each),
+#  not on Glue job runs themselves.  Counting then starting is not atomic, so initiators running at once can each see
+#  the same free slot & overshoot 'MaxInFlight' by up to their number -- the Glue job's MaxConcurrentRuns is the hard limit.
+#  A queued execution that fails to start stays queued only for throttling & transient errors, up to 'MaxStartAttempts'
+#  drains -- any other error (e.g., a deleted state machine, an input over 256 KB) dequeues it, so it cannot block the queue
+#  'AdmissionQueue' process_parm or environment variable: 'dynamodb://{table_name}' in AWS, or 'file://{path}' locally
+"""
+
+import os
+import json
+import datetime
+import threading
+
+from runtime_functions import get_client     # Lambda_Runtime Layer
+
+DEFAULT_PRIORITY = 5            # lower starts first
+DEFAULT_MAX_IN_FLIGHT = 2       # the Glue job's MaxConcurrentRuns -- every execution may end in a Glue run
+DEFAULT_MAX_START_ATTEMPTS = 5  # drains that may fail to start a queued execution before it is dequeued
+
+# StartExecution errors worth another drain -- anything else will fail the same way every time
+START_RETRY_CODES = [ 'ThrottlingException', 'ExecutionLimitExceeded', 'ServiceUnavailable', 'ServiceUnavailableException',
+                      'InternalServerError', 'InternalFailure', 'RequestTimeout', 'RequestTimeoutException' ]
+
+def running_executions( step_arn, limit, exclude_exec_name='' ):
+    ''' RUNNING executions of a state machine, counted up to limit (the closing execution itself excluded) '''
+    paginator = get_client('stepfunctions').get_paginator('list_executions')
+    count = 0
+    for page in paginator.paginate( stateMachineArn=step_arn, statusFilter='RUNNING', PaginationConfig={ 'MaxItems' : limit + 1 } ):
+        count += len( [ execution for execution in page['executions'] if execution['name'] != exclude_exec_name ] )
+    return count
+
+def retryable_start_error( e ):
+    ''' True for a StartExecution error that another attempt may not hit -- throttling, a 5xx, or a connection error '''
+    import botocore.exceptions
+    if isinstance( e, botocore.exceptions.ClientError ):
+        return e.response['Error']['Code'] in START_RETRY_CODES or e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+    return isinstance( e, botocore.exceptions.BotoCoreError )      # e.g., EndpointConnectionError, ReadTimeoutError
+
+def queue_key( priority, exec_name ):
+    ''' Sort key -- by priority, then arrival (exec_name starts with its %y%m%d-%H%M%S timestamp) '''
+    return f"{int(priority):03d}#{exec_name}"
+
+class DynamoDBAdmissionQueue:
+    ''' Queued executions in a DynamoDB table keyed by 'QueueName' (S, the state machine ARN) & 'QueueKey' (S) '''
+
+    def __init__(self, table_name, dynamodb_client=None):
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client or get_client('dynamodb')
+
+    def enqueue(self, queue_name, priority, entry):
+        self.dynamodb_client.put_item(
+            TableName = self.table_name,
+            Item = {
+                'QueueName' : { 'S' : queue_name },
+                'QueueKey' : { 'S' : queue_key( priority, entry['ExecName'] ) },
+                'Entry' : { 'S' : json.dumps( entry ) }
+            }
+        )
+
+    def peek(self, queue_name, count):
+        ''' Up to count (QueueKey, entry) at the head of the queue '''
+        if count <= 0:
+            return []
+        response = self.dynamodb_client.query(
+            TableName = self.table_name,
+            KeyConditionExpression = "QueueName = :queue_name",
+            ExpressionAttributeValues = { ':queue_name' : { 'S' : queue_name } },
+            ScanIndexForward = True,
+            ConsistentRead = True,
+            Limit = count
+        )
+        return [ ( item['QueueKey']['S'], dict( json.loads( item['Entry']['S'] ), StartAttempts=int( item.get('StartAttempts', {}).get('N', 0) ) ) ) for item in response['Items'] ]
+
+    def record_attempt(self, queue_name, key, error):
+        ''' Count a failed start of a queued entry -- its attempts so far (0 when it is no longer queued) '''
+        try:
+            response = self.dynamodb_client.update_item(
+                TableName = self.table_name,
+                Key = { 'QueueName' : { 'S' : queue_name }, 'QueueKey' : { 'S' : key } },
+                UpdateExpression = "ADD StartAttempts :one SET LastError = :error",
+                ConditionExpression = "attribute_exists(QueueKey)",
+                ExpressionAttributeValues = { ':one' : { 'N' : '1' }, ':error' : { 'S' : error } },
+                ReturnValues = 'UPDATED_NEW'
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return 0
+        return int( response['Attributes']['StartAttempts']['N'] )
+
+    def claim(self, queue_name, key):
+        ''' Remove an entry to start it -- False when a concurrent drain already claimed it '''
+        try:
+            self.dynamodb_client.delete_item(
+                TableName = self.table_name,
+                Key = { 'QueueName' : { 'S' : queue_name }, 'QueueKey' : { 'S' : key } },
+                ConditionExpression = "attribute_exists(QueueKey)"
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+class LocalAdmissionQueue:
+    ''' Queued executions in a local JSON file -- stand-in for DynamoDB in tests & benchmarks '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists( self.file_path ):
+            return {}
+        with open( self.file_path ) as f:
+            return json.load( f )
+
+    def _save(self, queues):
+        with open( self.file_path, 'w' ) as f:
+            json.dump( queues, f, indent=2 )
+
+    def enqueue(self, queue_name, priority, entry):
+        with self.lock:
+            queues = self._load()
+            queues.setdefault( queue_name, {} )[queue_key( priority, entry['ExecName'] )] = entry
+            self._save( queues )
+
+    def peek(self, queue_name, count):
+        with self.lock:
+            queue = self._load().get( queue_name, {} )
+        return [ ( key, dict( queue[key], StartAttempts=queue[key].get('StartAttempts', 0) ) ) for key in sorted( queue.keys() )[:max( count, 0 )] ]
+
+    def record_attempt(self, queue_name, key, error):
+        with self.lock:
+            queues = self._load()
+            if key not in queues.get( queue_name, {} ).keys():
+                return 0
+            entry = queues[queue_name][key]
+            entry.update( { 'StartAttempts' : entry.get('StartAttempts', 0) + 1, 'LastError' : error } )
+            self._save( queues )
+            return entry['StartAttempts']
+
+    def claim(self, queue_name, key):
+        with self.lock:
+            queues = self._load()
+            if key not in queues.get( queue_name, {} ).keys():
+                return False
+            del queues[queue_name][key]
+            self._save( queues )
+            return True
+
+def open_admission_queue( queue_url ):
+    ''' Open an admission queue from a 'dynamodb://{table_name}' or 'file://{path}' URL '''
+    if queue_url.startswith('dynamodb://'):
+        return DynamoDBAdmissionQueue( queue_url[len('dynamodb://'):] )
+    elif queue_url.startswith('file://'):
+        return LocalAdmissionQueue( queue_url[len('file://'):] )
+    raise Exception(f"Unknown AdmissionQueue '{queue_url}'.  Must be prefixed with 'dynamodb://' or 'file://'")
+
+def max_in_flight( process_parms ):
+    return int( process_parms.get( 'MaxInFlight', os.environ.get('MaxInFlight', DEFAULT_MAX_IN_FLIGHT) ) )
+
+def max_start_attempts( process_parms ):
+    return int( process_parms.get( 'MaxStartAttempts', os.environ.get('MaxStartAttempts', DEFAULT_MAX_START_ATTEMPTS) ) )
+
+def queue_entry( response, step_arn, exec_name, event_time='' ):
+    ''' What a drain needs to start the execution later '''
+    return {
+        'StepFnArn' : step_arn,
+        'ExecName' : exec_name,
+        'EventTime' : event_time,
+        'QueuedAt' : datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'Input' : response
+    }
@@ -1,13 +1,61 @@
 import json
 import datetime
 import os
-import boto3
 
-#import batch_functions as bat  # ToDo: refactor from v4
+from metrics_functions import MetricsLogger, sys_abbrev
+from runtime_functions import get_client, cold_start_metrics     # Lambda_Runtime Layer
+from queue_functions import coalesce_events, object_version
+from routing_functions import get_router
+from admission_functions import open_admission_queue, running_executions, queue_entry, max_in_flight, max_start_attempts, retryable_start_error, DEFAULT_PRIORITY
+import batch_functions as bat     # Lambda_Runtime Layer
 
 def lambda_handler(event, context):
     ''' Triggered by EventBridge to Execute a Step Function ARN Specified in the Event's Input Transformer '''
+    init_metrics = cold_start_metrics()
     print("Received event: " + json.dumps(event))
+
+    if 'BatchAction' in event.keys():
+        # ... or by the Step Function, to close the Batch it was started for
+        response = close_batch( event )
+        if 'AdmissionQueue' in event['process_parms'].keys():
+            # its slot is free -- start what is queued
+            step_arn = resolve_step_arn( event['process_parms']['StepFnArn'], context )
+            response['Started'] = drain_queue( event['process_parms']['AdmissionQueue'], step_arn, max_in_flight( event['process_parms'] ), event['process_parms']['ExecName'] )
+        print('Response: ' + json.dumps(response))
+        return {
+            'statusCode': 200,
+            'body': response
+        }
+
+    if event.get('AdmissionAction') == 'Drain':
+        # ... or on a schedule, in case a slot opened without a closing execution (e.g., aborted or timed out)
+        step_arn = resolve_step_arn( os.environ['StepFnArn'], context )
+        response = { 'Started' : drain_queue( os.environ['AdmissionQueue'], step_arn, max_in_flight( {} ) ) }
+        print('Response: ' + json.dumps(response))
+        return {
+            'statusCode': 200,
+            'body': response
+        }
+
+    if 'Records' in event.keys():
+        # ... or by SQS with a burst of EventBridge target inputs, batched over the event source mapping's window
+        events = [ json.loads( record['body'] ) for record in event['Records'] ]
+        responses = [ initiate_process( burst_event, context, init_metrics if i == 0 else {} ) for i, burst_event in enumerate( coalesce_events( events ) ) ]
+        print('Response: ' + json.dumps(responses))
+        return {
+            'statusCode': 200,
+            'body': responses
+        }
+
+    response = initiate_process( event, context, init_metrics )
+    print('Response: ' + json.dumps(response))
+    return {
+        'statusCode': 200,
+        'body': response
+    }
+
+def initiate_process( event, context, init_metrics={} ):
+    ''' Execute the Step Function for one S3 object, or for a coalesced burst of them ('NameList') '''
     response = event
 
     if 'source' in event.keys():
@@ -16,24 +64,31 @@ def lambda_handler(event, context):
             s3_bucket = event['detail']['bucket']['name']
             s3_key = event['detail']['object']['key']
         else:
-            Exception(f"Unknown Event Source '{event['source']}'.")
+            raise Exception(f"Unknown Event Source '{event['source']}'.")
     else:
         raise Exception("event['source'] not specified.")
 
-    batch_id = s3_key.split('/')[-1]
-    response['process_parms']['BatchId'] = batch_id
-
-    ''' ToDo:  Refactor from v4 >>>
-    # create or fetch Batch
-    batch = bat.Batch( batch_id ) 
+    response.setdefault( 'process_parms', {} )
+    routing_url = response['process_parms'].get( 'RoutingTable', os.environ.get('RoutingTable', '') )
+    if routing_url > '':
+        # process_parms by file naming convention -- the event's own process_parms override the route's
+        route_parms = get_router( routing_url, int(os.environ.get('RoutingCheckSeconds', 30)) ).route( s3_key )
+        if route_parms is None:
+            print(f"No route for 's3://{s3_bucket}/{s3_key}' in '{routing_url}' -- not processed")
+            response['Unrouted'] = True
+            return response
+        response['process_parms'] = dict( route_parms, **response['process_parms'] )
 
-    if len(batch.batch['BatchObjects']) > 0:    
-        response['process_parms']['NameList'] = batch.get_batch_objects()
-
-    if len(batch.batch['BatchObjects']) == 0 and 'NameList' in event['process_parms'].keys():
-        batch.initialize_batch_objects( event['process_parms']['NameList'] )
+    batch_id = response['process_parms'].get('BatchId', s3_key.split('/')[-1])
+    response['process_parms']['BatchId'] = batch_id
 
-    <<< '''
+    if 'BatchLedger' in event['process_parms'].keys():
+        batch_ledger = bat.open_batch_ledger( event['process_parms']['BatchLedger'] )
+    elif 'BatchLedger' in os.environ.keys():
+        batch_ledger = bat.open_batch_ledger( os.environ['BatchLedger'] )
+        response['process_parms']['BatchLedger'] = os.environ['BatchLedger']
+    else:
+        batch_ledger = None
 
     if 'StepFnArn' in event['process_parms'].keys():
         step_arn = event['process_parms']['StepFnArn']
@@ -47,25 +102,128 @@ def lambda_handler(event, context):
     
     if step_arn > '':
         # execute Step Function if ARN specified ...
-        step_arn = step_arn.replace('$Stack', context.function_name[:context.function_name.rfind('-')])
+        step_arn = resolve_step_arn( step_arn, context )
 
         now = datetime.datetime.now().strftime("%y%m%d-%H%M%S")
         exec_name = f"{now}-{batch_id}"
         response['process_parms']['ExecName'] = exec_name
 
         # Execute State Machine (here in Lambda, not EventBridge, to support process_parms exec_name)
-        sfn_client = boto3.client('stepfunctions')
-        sfn_resp = sfn_client.start_execution(
-            stateMachineArn = step_arn,
-            name = exec_name,
-            input= json.dumps(response)
-        )
-        response.update( {
-            "StepFnExecArn" : sfn_resp['executionArn']
-        } )
+        metrics = MetricsLogger( { 'SysAbbrev' : sys_abbrev( response['process_parms'] ), 'BatchId' : batch_id } )
+        if len(init_metrics) > 0:
+            metrics.put( 'Init', init_metrics )
 
-    print('Response: ' + json.dumps(response))
-    return {
-        'statusCode': 200,
-        'body': response
-    }
+        if batch_ledger is not None:
+            # claim the Batch -- a conditional write, so a duplicate event or retry does not start a second execution
+            # (unless the objects are new versions, or the claim's execution ended without closing it)
+            name_list = response['process_parms'].get('NameList', [ s3_key ])
+            batch_key = response['process_parms'].get( 'BatchKey', object_version( event ) )
+            batch = batch_ledger.start_batch( batch_id, exec_name, name_list, batch_key )
+            lease_seconds = int( response['process_parms'].get( 'BatchLeaseSeconds', os.environ.get('BatchLeaseSeconds', bat.DEFAULT_LEASE_SECONDS) ) )
+            if batch is None and bat.reconcile_batch( batch_ledger, batch_id, step_arn, lease_seconds ):
+                batch = batch_ledger.start_batch( batch_id, exec_name, name_list, batch_key )
+            if batch is None:
+                print(f"Batch '{batch_id}' is already running or succeeded -- duplicate start rejected")
+                metrics.put( 'StartExecution', { 'DuplicateStartCount' : 1 } )
+                response['DuplicateStart'] = True
+                return response
+            response['process_parms']['BatchStartCount'] = int( batch['StartCount'] )
+            if batch['StartCount'] > 1:
+                # re-run of a FAILED batch -- S3_Unzip skips the objects already EXTRACTED
+                print(f"Re-running Batch '{batch_id}' for objects: {bat.pending_objects( batch )}")
+
+        admission_url = response['process_parms'].get( 'AdmissionQueue', os.environ.get('AdmissionQueue', '') )
+        if admission_url > '':
+            # admission control -- queue when the state machine is full, or others are already waiting
+            response['process_parms']['AdmissionQueue'] = admission_url
+            admission_queue = open_admission_queue( admission_url )
+            limit = max_in_flight( response['process_parms'] )
+            if running_executions( step_arn, limit ) >= limit or len( admission_queue.peek( step_arn, 1 ) ) > 0:
+                priority = response['process_parms'].get( 'Priority', DEFAULT_PRIORITY )
+                admission_queue.enqueue( step_arn, priority, queue_entry( response, step_arn, exec_name, event.get('time', '') ) )
+                print(f"Queued '{exec_name}' at priority {priority} -- {limit} executions in flight or queued ahead")
+                metrics.put( 'Admission', { 'QueuedCount' : 1 }, properties={ 'ExecName' : exec_name } )
+                response['Queued'] = True
+                response['Started'] = drain_queue( admission_url, step_arn, limit )
+                return response
+
+        start_execution( response, step_arn, exec_name, metrics, event.get('time', '') )
+
+    return response
+
+def close_batch( event ):
+    ''' Record a Step Function execution's outcome ('BatchAction' Succeeded or Failed) in the Batch ledger '''
+    process_parms = event['process_parms']
+    if 'BatchLedger' not in process_parms.keys():
+        return { 'BatchId' : process_parms.get('BatchId'), 'BatchStatus' : 'n/a' }
+
+    batch_status = bat.BATCH_SUCCEEDED if event['BatchAction'] == 'Succeeded' else bat.BATCH_FAILED
+    error = json.dumps( event['Error'] ) if 'Error' in event.keys() else ''
+    closed = bat.open_batch_ledger( process_parms['BatchLedger'] ).close_batch( process_parms['BatchId'], process_parms['ExecName'], batch_status, error )
+    if not closed:
+        print(f"Batch '{process_parms['BatchId']}' was not started by '{process_parms['ExecName']}' -- left as is")
+    return { 'BatchId' : process_parms['BatchId'], 'BatchStatus' : batch_status if closed else 'n/a' }
+
+def resolve_step_arn( step_arn, context ):
+    return step_arn.replace('$Stack', context.function_name[:context.function_name.rfind('-')])
+
+def start_execution( response, step_arn, exec_name, metrics, event_time='', close_on_error=True ):
+    ''' Start the Step Function execution for response (the execution input) -- the Batch is closed FAILED if it cannot start (unless queued) '''
+    process_parms = response['process_parms']
+    with metrics.stage( 'StartExecution', properties={ 'ExecName' : exec_name } ) as stage_metrics:
+        sfn_client = get_client('stepfunctions')    # reused by warm invocations
+        try:
+            sfn_resp = sfn_client.start_execution(
+                stateMachineArn = step_arn,
+                name = exec_name,
+                input= json.dumps(response)
+            )
+        except Exception as e:
+            if close_on_error and 'BatchLedger' in process_parms.keys():
+                bat.open_batch_ledger( process_parms['BatchLedger'] ).close_batch( process_parms['BatchId'], exec_name, bat.BATCH_FAILED, str(e) )
+            raise
+        if event_time > '':
+            # S3 Object Created event time to execution start -- EventBridge delivery, admission queue, plus the above
+            event_time = datetime.datetime.strptime( event_time, '%Y-%m-%dT%H:%M:%SZ' ).replace( tzinfo=datetime.timezone.utc )
+            stage_metrics['StartLatency'] = round( ( sfn_resp['startDate'] - event_time ).total_seconds() * 1000, 3 )
+    response.update( {
+        "StepFnExecArn" : sfn_resp['executionArn']
+    } )
+    return response
+
+def drain_queue( admission_url, step_arn, limit, exclude_exec_name='' ):
+    ''' Start queued executions, highest priority first, into the free slots -- their exec names '''
+    admission_queue = open_admission_queue( admission_url )
+    sfn_client = get_client('stepfunctions')
+    started = []
+    free_slots = limit - running_executions( step_arn, limit, exclude_exec_name )
+    for key, entry in admission_queue.peek( step_arn, free_slots ):
+        # start, then dequeue -- StartExecution of the same name & input is idempotent, so a concurrent drain starting it too
+        # is harmless, and an entry that fails to start (throttled, or a transient error) stays queued for the next drain
+        process_parms = entry['Input']['process_parms']
+        metrics = MetricsLogger( { 'SysAbbrev' : sys_abbrev( process_parms ), 'BatchId' : process_parms['BatchId'] } )
+        queued_at = datetime.datetime.strptime( entry['QueuedAt'], '%Y-%m-%dT%H:%M:%SZ' )
+        try:
+            start_execution( entry['Input'], step_arn, entry['ExecName'], metrics, entry['EventTime'], close_on_error=False )
+        except sfn_client.exceptions.ExecutionAlreadyExists:
+            print(f"Queued '{entry['ExecName']}' was already started -- dequeued")
+        except Exception as e:
+            attempts = entry['StartAttempts'] + 1
+            if retryable_start_error( e ) and attempts < max_start_attempts( process_parms ):
+                admission_queue.record_attempt( step_arn, key, str(e) )
+                print(f"Queued '{entry['ExecName']}' failed to start (attempt {attempts}), left queued: {e}")
+                continue
+            # will not start on another drain -- dequeued, so the entries behind it (and new arrivals) are not held up
+            if admission_queue.claim( step_arn, key ):
+                print(f"Queued '{entry['ExecName']}' failed to start (attempt {attempts}), dequeued: {e}")
+                metrics.put( 'Admission', { 'StartFailedCount' : 1 }, properties={ 'ExecName' : entry['ExecName'] } )
+                if 'BatchLedger' in process_parms.keys():
+                    bat.open_batch_ledger( process_parms['BatchLedger'] ).close_batch( process_parms['BatchId'], entry['ExecName'], bat.BATCH_FAILED, str(e) )
+            continue
+        else:
+            metrics.put( 'Admission', { 'QueueLatency' : round( ( datetime.datetime.utcnow() - queued_at ).total_seconds() * 1000, 3 ) }, properties={ 'ExecName' : entry['ExecName'] } )
+        if admission_queue.claim( step_arn, key ):
+            started.append( entry['ExecName'] )
+    if len(started) > 0:
+        print(f"Started {len(started)} queued executions: {started}")
+    return started
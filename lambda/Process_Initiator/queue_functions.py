@@ -0,0 +1,95 @@
+"""
+## queue_functions.py -- Coalesce bursts of landing-pad events into one execution per SysAbbrev prefix
+#  (in AWS, the SQS event source mapping's BatchSize & MaximumBatchingWindowInSeconds collect the burst;
+#   LocalEventQueue does the same for local runs & tests)
+"""
+
+import json
+import time
+import hashlib
+import datetime
+
+def burst_key( event ):
+    ''' Events coalesce per bucket and '{Qualifier}.{SysAbbrev}' file name prefix '''
+    s3_bucket = event['detail']['bucket']['name']
+    s3_name = event['detail']['object']['key'].split('/')[-1]
+    return ( s3_bucket, '.'.join( s3_name.split('.')[:2] ) )
+
+def object_version( event ):
+    ''' S3 version-id of the event's object, else its ETag -- '' when the event has neither '''
+    s3_object = event['detail']['object']
+    version_id = s3_object.get('version-id', 'null')
+    return version_id if version_id not in ( '', 'null' ) else s3_object.get('etag', '')
+
+def coalesce_events( events ):
+    ''' Group EventBridge-shaped events into one event per burst key, with the burst's object keys as 'NameList' '''
+    bursts = {}
+    for event in events:
+        bursts.setdefault( burst_key( event ), [] ).append( event )
+
+    coalesced = []
+    for ( s3_bucket, prefix ), burst in bursts.items():
+        name_list = []
+        name_versions = {}
+        for event in burst:
+            if event['detail']['object']['key'] not in name_list:     # SQS delivers at least once
+                name_list.append( event['detail']['object']['key'] )
+            name_versions[event['detail']['object']['key']] = object_version( event )
+        first = dict( burst[0] )
+        first['process_parms'] = dict( first['process_parms'] )
+        if len(name_list) > 1:
+            # one execution extracts every archive, then runs a single Glue job
+            first['process_parms']['NameList'] = name_list
+            # same objects, same BatchId -- a redelivered burst is a duplicate start in the Batch ledger
+            burst_hash = hashlib.sha256( '\n'.join( sorted( name_list ) ).encode() ).hexdigest()[:8]
+            first['process_parms']['BatchId'] = f"{prefix}.BURST{len(name_list)}.{burst_hash}"
+            # ... unless they are new versions of the objects
+            first['process_parms']['BatchKey'] = hashlib.sha256( '\n'.join( f"{name}:{name_versions[name]}" for name in sorted( name_list ) ).encode() ).hexdigest()[:16]
+        coalesced.append( first )
+        print(f"Coalesced {len(burst)} events into {len(name_list)} objects for '{prefix}' in '{s3_bucket}'")
+
+    return coalesced
+
+def sqs_record( event ):
+    ''' SQS Lambda event record carrying an EventBridge target's input as its body '''
+    return {
+        "eventSource" : "aws:sqs",
+        "body" : json.dumps( event ),
+        "attributes" : { "SentTimestamp" : str( int( time.time() * 1000 ) ) }
+    }
+
+class LocalEventQueue:
+    ''' Stand-in for an SQS queue & batching event source mapping -- invokes handler per window or count '''
+
+    def __init__(self, handler, window_seconds=60, max_count=200, context=None, clock=time.time):
+        self.handler = handler
+        self.window_seconds = window_seconds
+        self.max_count = max_count
+        self.context = context
+        self.clock = clock
+        self.records = []
+        self.window_start = None
+
+    def send(self, event):
+        ''' Queue one event; a full batch is delivered right away '''
+        if 'time' not in event.keys():
+            event = dict( event, time=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ') )
+        if len(self.records) == 0:
+            self.window_start = self.clock()
+        self.records.append( sqs_record( event ) )
+        if len(self.records) >= self.max_count:
+            return self.flush()
+        return None
+
+    def poll(self):
+        ''' Deliver the batch once its window has elapsed '''
+        if len(self.records) > 0 and self.clock() - self.window_start >= self.window_seconds:
+            return self.flush()
+        return None
+
+    def flush(self):
+        ''' Deliver whatever is queued as one SQS batch '''
+        if len(self.records) == 0:
+            return None
+        records, self.records = self.records, []
+        return self.handler( { "Records" : records }, self.context )
@@ -0,0 +1,106 @@
+"""
+## routing_functions.py -- Route landing-pad objects by file naming convention instead of one EventBridge rule per feed
+#  ('{Qualifier}.{SysAbbrev}.{BatchDate}.{LoadType}...' file name nodes -> StepFnArn & process_parms, from a routing table
+#   compiled into a trie once per container, and recompiled only when the table's S3 version changes)
+"""
+
+import os
+import json
+import time
+
+from runtime_functions import get_client     # Lambda_Runtime Layer
+
+WILDCARD = '*'
+DEFAULT_FILE_NAME_NODES = [ 'Qualifier', 'SysAbbrev', 'BatchDate', 'LoadType' ]
+DEFAULT_CHECK_SECONDS = 30      # at most one HEAD of the routing table per container per interval
+
+_routing_tables = {}     # routing table URL -> { 'Version', 'CheckedAt', 'Router' }
+
+class RouteTrie:
+    ''' File name nodes -> route, matched node by node (exact node before '*') -- O(file name nodes), however many feeds '''
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, route_nodes, route):
+        node = self.root
+        for route_node in route_nodes:
+            node = node.setdefault( 'Children', {} ).setdefault( route_node, {} )
+        if 'Route' in node.keys():
+            raise Exception(f"Duplicate route '{'.'.join( route_nodes )}' in routing table")
+        node['Route'] = route
+
+    def match(self, name_nodes, node=None, depth=0):
+        ''' Most specific route for name_nodes -- the deepest match, with exact nodes preferred over '*' '''
+        node = self.root if node is None else node
+        if depth < len(name_nodes):
+            children = node.get( 'Children', {} )
+            for child_key in ( name_nodes[depth], WILDCARD ):
+                if child_key in children.keys():
+                    route = self.match( name_nodes, children[child_key], depth + 1 )
+                    if route is not None:
+                        return route
+        return node.get( 'Route' )     # a route on a shorter prefix matches every longer name
+
+class Router:
+    ''' Compiled routing table -- Defaults merged under each route, file name nodes substituted into '{Node}' values '''
+
+    def __init__(self, routing_table):
+        self.file_name_nodes = routing_table.get( 'FileNameNodes', DEFAULT_FILE_NAME_NODES )
+        self.trie = RouteTrie()
+        defaults = routing_table.get( 'Defaults', {} ).get( 'process_parms', {} )
+        for route in routing_table['Routes']:
+            process_parms = dict( defaults, **route.get( 'process_parms', {} ) )
+            self.trie.add( route['Route'].split('.'), { 'Route' : route['Route'], 'process_parms' : process_parms } )
+        self.route_count = len( routing_table['Routes'] )
+
+    def route(self, s3_key):
+        ''' process_parms for an S3 object key, or None when no route matches its file name '''
+        name_nodes = s3_key.split('/')[-1].split('.')
+        route = self.trie.match( name_nodes )
+        if route is None:
+            return None
+        node_values = dict( zip( self.file_name_nodes, name_nodes ) )
+        process_parms = { key : substitute_nodes( value, node_values ) for key, value in route['process_parms'].items() }
+        process_parms['Route'] = route['Route']
+        return process_parms
+
+def substitute_nodes( value, node_values ):
+    ''' Replace '{Node}' placeholders in string values with the file name's nodes '''
+    if not isinstance( value, str ):
+        return value
+    for node, node_value in node_values.items():
+        value = value.replace( '{' + node + '}', node_value )
+    return value
+
+def routing_table_version( routing_url ):
+    ''' S3 VersionId (or ETag, when the bucket is not versioned) -- or mtime of a local 'file://' table '''
+    # an unversioned (or versioning-suspended) bucket returns no VersionId, or 'null' for every overwrite
+    if routing_url.startswith('file://'):
+        return str( os.path.getmtime( routing_url[len('file://'):] ) )
+    s3_bucket, s3_key = routing_url[len('s3://'):].split('/', 1)
+    response = get_client('s3').head_object( Bucket=s3_bucket, Key=s3_key )
+    version_id = response.get( 'VersionId', 'null' )
+    return version_id if version_id != 'null' else response['ETag']
+
+def read_routing_table( routing_url ):
+    if routing_url.startswith('file://'):
+        with open( routing_url[len('file://'):] ) as f:
+            return json.load( f )
+    s3_bucket, s3_key = routing_url[len('s3://'):].split('/', 1)
+    return json.loads( get_client('s3').get_object( Bucket=s3_bucket, Key=s3_key )['Body'].read() )
+
+def get_router( routing_url, check_seconds=DEFAULT_CHECK_SECONDS, clock=time.time ):
+    ''' Router for a routing table URL, cached per container and recompiled when the table's version changes '''
+    cached = _routing_tables.get( routing_url )
+    if cached is not None and clock() - cached['CheckedAt'] < check_seconds:
+        return cached['Router']
+
+    version = routing_table_version( routing_url )
+    if cached is None or cached['Version'] != version:
+        router = Router( read_routing_table( routing_url ) )
+        print(f"Compiled {router.route_count} routes from '{routing_url}' (version '{version}')")
+    else:
+        router = cached['Router']
+    _routing_tables[routing_url] = { 'Version' : version, 'CheckedAt' : clock(), 'Router' : router }
+    return router
@@ -1,16 +1,259 @@
 import json
 import os
+import shutil
 import zipfile
-import gzip
-import boto3
 import datetime
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-s3_client = boto3.client('s3')
+from unzip_functions import stream_member_to_s3, split_member_to_s3, S3RangeReader, MemoryBudget, build_zip_extracted, plan_member_groups, merge_zip_extracted
+from unzip_functions import open_codec_writer, CODEC_EXTENSIONS, DEFAULT_CODEC, TimedArchive, TimedS3Client
+from unzip_functions import DEFAULT_CHUNK_SIZE, DEFAULT_PART_SIZE, DEFAULT_READ_AHEAD, MB
+from ledger_functions import open_hash_ledger, ledger_entry, member_sha256, file_sha256, HashingArchive, commit_ledger_entries, LEDGER_CONVERTED
+from parquet_functions import pyarrow_available, convert_member_to_parquet
+from metrics_functions import MetricsLogger, StageTiming, sys_abbrev
+from runtime_functions import LazyClient, cold_start_metrics     # Lambda_Runtime Layer
+from catalog_functions import crup_glue_partition     # Lambda_Runtime Layer
+from batch_functions import open_batch_ledger, extracted_object, OBJECT_EXTRACTED
+
+DEFAULT_SPLIT_CHUNK_MB = 128   # members over 'SplitThresholdMB' land as row-aligned chunks of about this size
+DEFAULT_GROUP_MB = 1024        # 'Plan' target uncompressed bytes per Map iteration
+DEFAULT_MAX_GROUPS = 40
+s3_client = LazyClient('s3')       # pooled for concurrent extract workers, each with its own uploads & ranged GETs
+glue_client = LazyClient('glue')   # only the Parquet fast path needs it -- 'Merge' actions need no client at all
+
+def parquet_fast_path( process_parms, uncompressed_bytes ):
+    ''' Convert to Parquet here (skipping the Glue job) when the batch is under 'ParquetMaxMB' '''
+    parquet_max_bytes = process_parms.get('ParquetMaxMB', 0) * MB
+    if parquet_max_bytes <= 0 or uncompressed_bytes > parquet_max_bytes:
+        return False
+    if not pyarrow_available():
+        print(f"pyarrow not available (attach Layer) -- {uncompressed_bytes} bytes left for Glue job")
+        return False
+    return True
+
+def extract_member( archive, member_index, member, extract_parms ):
+    ''' Extract one archive member to S3 with the feed's codec, returning its ZipExtracted entries '''
+    s3_bucket = extract_parms['S3Bucket']
+    codec = extract_parms['Codec']
+    extension = CODEC_EXTENSIONS[codec]
+    member_filename = member.filename 
+    table_folder = member_filename.replace('.','/',1).replace('.csv','')
+    s3_target_key = f"{extract_parms['S3TargetFolder']}/{table_folder}/{member_filename}{extension}"
+    s3_target_url = f"s3://{s3_bucket}/{s3_target_key}"
+    s3_target_urls = [ s3_target_url ]
+    member_result = {
+        "MemberIndex" : member_index,
+        "MemberName" : member_filename,
+        "GlueTableName" : table_folder.split('/')[0],
+        "PartitionFolder" : table_folder.split('/')[1]
+    }
+
+    ledger = extract_parms['HashLedger']
+    if ledger is not None:
+        ledger_key = f"{s3_bucket}/{extract_parms['S3TargetFolder']}/{table_folder}/{member_filename}"
+        previous = ledger.get( ledger_key )
+        # CRC-32 & size from the Central Directory cost nothing; only a match is worth a hash-only verification pass
+        # (and only of a CONVERTED entry -- a PENDING one's batch may have failed before its data reached the Datalake)
+        if previous is not None and previous.get('LedgerStatus', LEDGER_CONVERTED) == LEDGER_CONVERTED and previous['Crc32'] == member.CRC and previous['FileSize'] == member.file_size:
+            if member_sha256( archive, member, extract_parms['ChunkSize'] ) == previous['Sha256']:
+                print(f"Skipped '{member_filename}' -- unchanged since BatchId '{previous['BatchId']}'")
+                member_result.update( { "S3ExtractedUrls" : [], "Unchanged" : True } )
+                return member_result
+
+    # per-member Extract (decompress) & Upload timings; Compress is the remainder
+    timing = StageTiming()
+    archive = TimedArchive( archive, timing )
+    member_s3_client = TimedS3Client( s3_client, timing )
+    member_start = time.perf_counter()
+    if ledger is not None:
+        hasher = hashlib.sha256()
+        archive = HashingArchive( archive, hasher )     # hash while the member streams to its writer
+        extracted_sha256 = None
+
+    if extract_parms['ConvertToParquet']:
+        # small batch -- typed Snappy Parquet straight into the Datalake, same layout as the Glue job writes
+        glue_table_name, partition_folder = table_folder.split('/')[0], table_folder.split('/')[1]
+        glue_columns = extract_parms['GlueTables'][glue_table_name]['Table']['StorageDescriptor']['Columns']
+        s3_parquet_key = f"{extract_parms['S3DatalakeOutput']}/{table_folder}/{os.path.splitext(member_filename)[0]}.snappy.parquet"
+        row_count = convert_member_to_parquet( member_s3_client, archive, member, glue_columns, extract_parms['S3DatalakeBucket'], s3_parquet_key, extract_parms['PartSize'] )
+        s3_target_urls = [ f"s3://{extract_parms['S3DatalakeBucket']}/{s3_parquet_key}" ]
+        print(f"Converted '{member_filename}' ({row_count} rows) to '{s3_target_urls[0]}'")
+    elif extract_parms['SplitThreshold'] > 0 and member.file_size > extract_parms['SplitThreshold']:
+        # several header-repeating, record-aligned chunks under the same {table}/{partition} prefix, so Spark reads them in parallel
+        base_name, member_extension = os.path.splitext( member_filename )
+        chunk_key = lambda n: f"{extract_parms['S3TargetFolder']}/{table_folder}/{base_name}.part{n:04d}{member_extension}{extension}"
+        s3_keys = split_member_to_s3( member_s3_client, archive, member, s3_bucket, chunk_key, extract_parms['SplitChunkSize'], extract_parms['ChunkSize'], extract_parms['PartSize'], codec, extract_parms['CompressLevel'] )
+        s3_target_urls = [ f"s3://{s3_bucket}/{s3_key}" for s3_key in s3_keys ]
+        print(f"Split '{member_filename}' ({member.file_size} bytes) into {len(s3_keys)} chunks under 's3://{s3_bucket}/{extract_parms['S3TargetFolder']}/{table_folder}/'")
+    elif extract_parms['ExtractMode'] == 'Stream':
+        # read via archive.open(), compress & upload in chunks -- nothing staged in the work folder
+        bytes_written = stream_member_to_s3( member_s3_client, archive, member, s3_bucket, s3_target_key, extract_parms['ChunkSize'], extract_parms['PartSize'], codec, extract_parms['CompressLevel'] )
+        print(f"Streamed '{member_filename}' ({member.file_size} bytes, {bytes_written} as {codec}) to '{s3_target_url}'")
+    else:
+        # ref https://www.tutorialspoint.com/python-support-for-gzip-files-gzip
+        extract_path = archive.extract(member , extract_parms['WorkFolder'] )
+        if codec != 'none':
+            with open ( extract_path, "rb" ) as ext:
+                bindata = ext.read()
+            with open ( f"{extract_path}{extension}", "wb") as out, open_codec_writer( codec, out, extract_parms['CompressLevel'], member_filename ) as writer:
+                writer.write( bindata )
+
+        member_s3_client.upload_file( f"{extract_path}{extension}", s3_bucket, s3_target_key )
+        print(f"Uploaded '{extract_path}{extension}' to '{s3_target_url}'")
+        if ledger is not None:
+            extracted_sha256 = file_sha256( extract_path, extract_parms['ChunkSize'] )
+
+        os.remove( extract_path )
+        if codec != 'none':
+            os.remove( f"{extract_path}{extension}" )
+
+    if ledger is not None:
+        entry = ledger_entry( extracted_sha256 or hasher.hexdigest(), member, extract_parms['BatchId'] )
+        ledger.put( ledger_key, entry )
+        member_result['LedgerPending'] = { ledger_key : entry['Sha256'] }
+
+    member_metrics = timing.metrics( [ 'Extract', 'Upload' ] )
+    member_metrics['CompressDuration'] = round( max( 0.0, time.perf_counter() - member_start - sum( timing.seconds.values() ) ) * 1000, 3 )
+    member_metrics['CompressBytes'] = member_metrics['UploadBytes']
+    extract_parms['Metrics'].put( 'Member', member_metrics, { 'Table' : member_result['GlueTableName'] }, { 'MemberName' : member_filename, 'Codec' : codec } )
+
+    member_result['S3ExtractedUrls'] = s3_target_urls
+    return member_result
+
+def member_memory_cost( member, extract_parms ):
+    ''' Approximate bytes held in memory while a member is in flight '''
+    if extract_parms['ConvertToParquet']:
+        return member.file_size     # a Parquet row group is held in memory until written
+    if extract_parms['ExtractMode'] == 'Stream' or 0 < extract_parms['SplitThreshold'] < member.file_size:
+        return extract_parms['PartSize'] + extract_parms['ChunkSize'] + DEFAULT_READ_AHEAD
+    return member.file_size + extract_parms['ChunkSize']     # 'Extract' reads the whole member
+
+def extract_members_concurrently( open_archive, indexed_members, extract_parms, workers, memory_budget ):
+    ''' Extract members on a bounded worker pool; each worker thread opens its own archive handle '''
+    local = threading.local()
+    handles = []
+
+    def extract_one( indexed_member ):
+        member_index, member = indexed_member
+        if not hasattr(local, 'archive'):
+            local.archive = zipfile.ZipFile( open_archive(), mode="r" )
+            handles.append( local.archive )
+        with memory_budget.reserve( member_memory_cost( member, extract_parms ) ):
+            return extract_member( local.archive, member_index, member, extract_parms )
+
+    try:
+        with ThreadPoolExecutor( max_workers=workers ) as executor:
+            return list( executor.map( extract_one, indexed_members ) )
+    finally:
+        for handle in handles:
+            handle.close()
+
+def plan_extract( response, s3_bucket, s3_key, metrics ):
+    ''' Read the ZIP Central Directory and plan member groups balanced by uncompressed size -- the groups (the plan's totals in process_parms 'ExtractPlan') '''
+    process_parms = response['process_parms']
+    group_bytes = int( process_parms.get('ExtractGroupMB', DEFAULT_GROUP_MB) * MB )
+    max_groups = int( process_parms.get('ExtractMaxGroups', DEFAULT_MAX_GROUPS) )
+
+    with metrics.stage( 'CentralDirectory', properties={ 'ArchiveReader' : 'Range' } ) as stage_metrics:
+        archive_file = S3RangeReader( s3_client, s3_bucket, s3_key )
+        with zipfile.ZipFile( archive_file, mode="r" ) as archive:
+            infolist = archive.infolist()
+            stage_metrics['CentralDirectoryBytes'] = archive_file.size - archive.start_dir
+            stage_metrics['MemberCount'] = len(infolist)
+
+    member_groups = plan_member_groups( infolist, group_bytes, max_groups )
+    uncompressed_bytes = sum( member.file_size for member in infolist )
+    process_parms['S3InputFolder'] = s3_key[:s3_key.rfind('/')]
+    process_parms['ExtractPlan'] = {
+        "ArchiveBytes" : archive_file.size,
+        "MemberCount" : len(infolist),
+        "UncompressedBytes" : uncompressed_bytes,
+        "ConvertToParquet" : parquet_fast_path( process_parms, uncompressed_bytes ),
+        "GroupCount" : len(member_groups)
+    }
+    print(f"Planned {len(infolist)} members of 's3://{s3_bucket}/{s3_key}' into {len(member_groups)} groups")
+    return member_groups
+
+def merge_extracted_groups( response ):
+    ''' Rebuild the usual ZipExtracted structure from the Map state's per-group ExtractedMembers '''
+    process_parms = response['process_parms']
+    member_results = [ result for group_results in process_parms.pop('ExtractedGroups') for result in group_results ]
+    process_parms['ZipExtracted'] = build_zip_extracted( member_results )
+    if process_parms['ExtractPlan']['ConvertToParquet']:
+        process_parms['ZipExtracted']['ParquetConverted'] = True
+    record_extracted( response )
+
+    print("Response: " + json.dumps(response))
+    return {
+        'statusCode': 200,
+        'body':  response
+    }
+
+def merge_extracted_archives( response ):
+    ''' Rebuild one ZipExtracted from the Map state's per-archive results of a 'NameList' burst '''
+    process_parms = response['process_parms']
+    archives_extracted = process_parms.pop('ExtractedArchives')
+    process_parms['ZipExtracted'] = merge_zip_extracted( archives_extracted )
+    print(f"Merged ZipExtracted of {len(archives_extracted)} archives: {process_parms['ZipExtracted']['GlueTableNames']}")
+
+    print("Response: " + json.dumps(response))
+    return {
+        'statusCode': 200,
+        'body':  response
+    }
+
+def commit_ledger( response ):
+    ''' Mark the batch's DedupLedger entries CONVERTED -- the state machine's step after the Glue job succeeds '''
+    process_parms = response['process_parms']
+    ledger_pending = process_parms.get('ZipExtracted', {}).get('LedgerPending', {})
+    if 'DedupLedger' in process_parms.keys() and len(ledger_pending) > 0:
+        commit_ledger_entries( open_hash_ledger( process_parms['DedupLedger'] ), ledger_pending )
+
+    return {
+        'statusCode': 200,
+        'body':  response
+    }
+
+def record_extracted( response ):
+    ''' Mark the archive EXTRACTED in the Batch ledger, with its ZipExtracted for a re-run to reuse '''
+    process_parms = response['process_parms']
+    if 'BatchLedger' not in process_parms.keys():
+        return
+    s3_key = response['detail']['object']['key'] if 'detail' in response.keys() else response['S3Key']
+    open_batch_ledger( process_parms['BatchLedger'] ).set_object_status( process_parms['BatchId'], s3_key, OBJECT_EXTRACTED, process_parms['ZipExtracted'] )
+
+def already_extracted( response, s3_key, zip_extracted ):
+    ''' Response for an archive a previous attempt of the batch already extracted -- nothing is read from S3 '''
+    process_parms = response['process_parms']
+    process_parms['S3InputFolder'] = s3_key[:s3_key.rfind('/')]
+    process_parms['ZipExtracted'] = zip_extracted
+    print(f"'{s3_key}' was already extracted for Batch '{process_parms['BatchId']}' -- skipped")
+
+    print("Response: " + json.dumps(response))
+    return {
+        'statusCode': 200,
+        'body':  response
+    }
 
 def lambda_handler(event, context):
-    ''' Download ZIP archive file from S3, extract it, and upload GZip'd member files to S3 '''
+    ''' Download ZIP archive file from S3, extract it, and upload GZip'd (or other codec) member files to S3 '''
+    init_metrics = cold_start_metrics()
     print("Received event: " + json.dumps(event))
     response = event
+
+    # 'Extract' (default) the whole archive or one event['MemberGroup'];
+    # 'Plan' member groups for a Step Functions Map state; 'Merge' the Map results;
+    # 'MergeArchives' the results of each archive in a burst's NameList
+    unzip_action = response.pop('UnzipAction', 'Extract')
+    if unzip_action == 'Merge':
+        return merge_extracted_groups( response )
+    if unzip_action == 'MergeArchives':
+        return merge_extracted_archives( response )
+    if unzip_action == 'CommitLedger':
+        return commit_ledger( response )
     
     if 'source' in event.keys():
         # triggered by EventBridge ...
@@ -30,59 +273,157 @@ def lambda_handler(event, context):
     s3_source_url = f's3://{s3_bucket}/{s3_key}'
 
     work_zipfile_name = s3_source_url.split('/')[-1]
+    batch_id = event['process_parms'].get('BatchId', work_zipfile_name)
+    metrics = MetricsLogger( { 'SysAbbrev' : sys_abbrev( event['process_parms'], work_zipfile_name ), 'BatchId' : batch_id } )
+    if len(init_metrics) > 0:
+        metrics.put( 'Init', init_metrics )
+    if 'BatchLedger' in event['process_parms'].keys() and 'MemberGroup' not in event.keys():
+        # a re-run of a FAILED batch (or a retried Map iteration) skips archives already extracted
+        zip_extracted = extracted_object( open_batch_ledger( event['process_parms']['BatchLedger'] ), batch_id, s3_key )
+        if zip_extracted is not None:
+            return already_extracted( response, s3_key, zip_extracted )
     s3_source_folder = s3_key[:s3_key.rfind('/')]
     if 'S3ExtractFolder' in event['process_parms'].keys():
         s3_target_folder = event['process_parms']['S3ExtractFolder'] 
     else:
         s3_target_folder = s3_source_folder
 
+    # 'Extract' (default) stages members in the work folder; 'Stream' pipes them straight to S3
+    extract_mode = event['process_parms'].get('ExtractMode', 'Extract')
+    chunk_size = int(event['process_parms'].get('StreamChunkMB', DEFAULT_CHUNK_SIZE / MB) * MB)
+    part_size = int(event['process_parms'].get('StreamPartMB', DEFAULT_PART_SIZE / MB) * MB)
+    # 'gzip' (default), 'zstd', 'bz2' (splittable), or 'none' (passthrough CSV), at an optional 'ExtractCompressLevel'
+    codec = event['process_parms'].get('ExtractCodec', DEFAULT_CODEC)
+    compress_level = event['process_parms'].get('ExtractCompressLevel', None)
+    # 'Download' (default) copies the whole archive to the work folder; 'Range' reads it in place with ranged GETs
+    # (the default for a 'MemberGroup' -- each Map iteration reads only its own members, not the whole archive)
+    archive_reader = event['process_parms'].get('ArchiveReader', 'Range' if 'MemberGroup' in event.keys() else 'Download')
+    # >1 extracts members concurrently, with members in flight capped by the memory budget
+    extract_workers = int(event['process_parms'].get('ExtractWorkers', 1))
+    # members larger than 'SplitThresholdMB' are split into chunks of about 'SplitChunkMB' (0 = never split)
+    split_threshold = int(event['process_parms'].get('SplitThresholdMB', 0) * MB)
+    split_chunk_size = int(event['process_parms'].get('SplitChunkMB', DEFAULT_SPLIT_CHUNK_MB) * MB)
+    memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 512))
+    extract_memory = int(event['process_parms'].get('ExtractMemoryMB', memory_mb / 2) * MB)
+
     now = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
     if 'WorkFolder' not in os.environ.keys():
         os.environ['WorkFolder'] = '/tmp/unzip'     # Lambda default only 512M -- mount EFS to support large archive files
     work_folder = f"{os.environ['WorkFolder']}/{now}"
-    if not os.path.exists(work_folder):
-        os.makedirs( work_folder )
-    
-    s3_client.download_file(s3_bucket, s3_key, f"{work_folder}/{work_zipfile_name}")
-    print(f"Downloaded '{s3_source_url}' to '{work_folder}/{work_zipfile_name}'")
+    if unzip_action == 'Plan':
+        member_groups = plan_extract( response, s3_bucket, s3_key, metrics )
+        if len(member_groups) > 1:
+            # the Map's items -- outside process_parms, so each iteration gets only its own group, and the Merge none
+            response['MemberGroups'] = member_groups
+            print("Response: " + json.dumps(response))
+            return {
+                'statusCode': 200,
+                'body':  response
+            }
+        # one group (or none) -- extract the archive here, with no Map iteration or Merge; the response has its ZipExtracted
+        print(f"One member group -- extracting 's3://{s3_bucket}/{s3_key}' without a Map state")
+
+    if not ( archive_reader == 'Range' and extract_mode == 'Stream' ):
+        if not os.path.exists(work_folder):
+            os.makedirs( work_folder )
+
+    if archive_reader == 'Range':
+        open_archive = lambda: S3RangeReader( s3_client, s3_bucket, s3_key )
+        archive_file = open_archive()
+        archive_size = archive_file.size
+        print(f"Opened '{s3_source_url}' ({archive_file.size} bytes) for ranged reads")
+    else:
+        with metrics.stage( 'Download' ) as stage_metrics:
+            s3_client.download_file(s3_bucket, s3_key, f"{work_folder}/{work_zipfile_name}")
+            stage_metrics['DownloadBytes'] = archive_size = os.path.getsize( f"{work_folder}/{work_zipfile_name}" )
+        print(f"Downloaded '{s3_source_url}' to '{work_folder}/{work_zipfile_name}'")
+        open_archive = lambda: f"{work_folder}/{work_zipfile_name}"
+        archive_file = open_archive()
+
+    extract_parms = {
+        "S3Bucket" : s3_bucket,
+        "S3TargetFolder" : s3_target_folder,
+        "ExtractMode" : extract_mode,
+        "ChunkSize" : chunk_size,
+        "PartSize" : part_size,
+        "Codec" : codec,
+        "CompressLevel" : compress_level,
+        "SplitThreshold" : split_threshold,
+        "SplitChunkSize" : split_chunk_size,
+        "WorkFolder" : work_folder,
+        "ConvertToParquet" : False,
+        "HashLedger" : open_hash_ledger( event['process_parms']['DedupLedger'] ) if 'DedupLedger' in event['process_parms'].keys() else None,
+        "BatchId" : batch_id,
+        "Metrics" : metrics
+    }
     
-    with zipfile.ZipFile(f"{work_folder}/{work_zipfile_name}", mode="r") as archive:
+    with metrics.stage( 'CentralDirectory', properties={ 'ArchiveReader' : archive_reader } ) as stage_metrics:
+        archive = zipfile.ZipFile(archive_file, mode="r")
+        stage_metrics['CentralDirectoryBytes'] = archive_size - archive.start_dir
+        stage_metrics['MemberCount'] = len( archive.infolist() )
+    with archive:
         archive.printdir()
         infolist = archive.infolist()
-        zip_extracted = {
-            "GlueTableNames" : [],
-            "PartitionFolders" : [],
-            "S3ExtractedUrls" : []
-        }
-        
-        for member in infolist:
-            member_filename = member.filename 
-            # ref https://www.tutorialspoint.com/python-support-for-gzip-files-gzip
-            extract_path = archive.extract(member , work_folder )
-            with open ( extract_path, "rb" ) as ext:
-                bindata = ext.read()
-                with gzip.open ( f"{extract_path}.gz", "wb") as gz:
-                    gz.write( bindata )
-                    
-            table_folder = member_filename.replace('.','/',1).replace('.csv','')
-            s3_client.upload_file( f"{extract_path}.gz", s3_bucket, f'{s3_target_folder}/{table_folder}/{member_filename}.gz' )
-            s3_target_url = f"s3://{s3_bucket}/{s3_target_folder}/{table_folder}/{member_filename}.gz"
-            print(f"Uploaded '{extract_path}' to '{s3_target_url}'")
-
-            zip_extracted['GlueTableNames'].append( table_folder.split('/')[0] )
-            zip_extracted['S3ExtractedUrls'].append( s3_target_url )
-            partition_folder = table_folder.split('/')[1]
-            if partition_folder not in zip_extracted['PartitionFolders']:
-                zip_extracted['PartitionFolders'].append( partition_folder )
-
-            os.remove( extract_path )
-            os.remove( f"{extract_path}.gz" )
+        indexed_members = list( enumerate(infolist) )
+        if 'MemberGroup' in event.keys():
+            # one Map iteration of a planned extract -- only this group's members
+            indexed_members = [ (m['MemberIndex'], infolist[m['MemberIndex']]) for m in event['MemberGroup']['Members'] ]
+            for (member_index, member), planned in zip( indexed_members, event['MemberGroup']['Members'] ):
+                if member.filename != planned['MemberName']:
+                    raise Exception(f"Member {member_index} is '{member.filename}', planned '{planned['MemberName']}' -- archive changed since planning?")
+
+        if 'ExtractPlan' in event['process_parms'].keys():
+            extract_parms['ConvertToParquet'] = event['process_parms']['ExtractPlan']['ConvertToParquet']
+        else:
+            extract_parms['ConvertToParquet'] = parquet_fast_path( event['process_parms'], sum( member.file_size for member in infolist ) )
+        if extract_parms['ConvertToParquet']:
+            glue_database_name = event['process_parms']['GlueDatabaseName']
+            extract_parms['S3DatalakeBucket'] = event['process_parms']['S3DatalakeBucket']
+            extract_parms['S3DatalakeOutput'] = event['process_parms']['S3DatalakeOutput']
+            extract_parms['GlueTables'] = {}
+            for member_index, member in indexed_members:
+                glue_table_name = member.filename.split('.')[0]
+                if glue_table_name not in extract_parms['GlueTables'].keys():
+                    extract_parms['GlueTables'][glue_table_name] = glue_client.get_table( DatabaseName = glue_database_name, Name = glue_table_name )
+
+        if extract_workers > 1:
+            member_results = extract_members_concurrently( open_archive, indexed_members, extract_parms, extract_workers, MemoryBudget(extract_memory) )
+        else:
+            member_results = [ extract_member( archive, i, member, extract_parms ) for i, member in indexed_members ]
+
+    zip_extracted = build_zip_extracted( member_results )
+    if extract_parms['ConvertToParquet']:
+        registered = []
+        for result in member_results:
+            if result.get('Unchanged', False):
+                continue
+            if (result['GlueTableName'], result['PartitionFolder']) not in registered:
+                crup_glue_partition( glue_client, glue_database_name, extract_parms['GlueTables'][result['GlueTableName']], [ result['PartitionFolder'] ] )
+                registered.append( (result['GlueTableName'], result['PartitionFolder']) )
+        zip_extracted['ParquetConverted'] = True
+        # converted & registered here -- the DedupLedger entries need not wait for the batch
+        if extract_parms['HashLedger'] is not None:
+            ledger_pending = zip_extracted.pop( 'LedgerPending', {} )
+            for result in member_results:
+                result.pop( 'LedgerPending', None )
+            commit_ledger_entries( extract_parms['HashLedger'], ledger_pending )
 
     response['process_parms']['S3InputFolder'] = s3_source_folder
     response['process_parms']['ZipExtracted']  = zip_extracted
+    if 'MemberGroup' in event.keys():
+        response['ExtractedMembers'] = member_results
+    else:
+        record_extracted( response )
 
-    import shutil
-    shutil.rmtree( work_folder ) #use shutil b/c os.removedirs( work_folder ) only works when empty
+    if archive_reader == 'Range':
+        print(f"Ranged GETs: {archive_file.get_count} requests, {archive_file.bytes_fetched} of {archive_file.size} bytes")
+        metrics.put( 'Download', {
+            'DownloadDuration' : round( archive_file.get_seconds * 1000, 3 ),
+            'DownloadBytes' : archive_file.bytes_fetched,
+            'DownloadCount' : archive_file.get_count
+        }, properties={ 'ArchiveReader' : 'Range' } )
+    if os.path.exists(work_folder):
+        shutil.rmtree( work_folder ) #use shutil b/c os.removedirs( work_folder ) only works when empty
     
     print("Response: " + json.dumps(response))
     return {
@@ -0,0 +1,189 @@
+"""
+## ledger_functions.py -- Content-hash ledger so re-delivered, unchanged members are skipped
+#  ('DedupLedger' process_parm: 'dynamodb://{table_name}' in AWS, or 'file://{path}' JSON stand-in for local runs)
+#  An entry is written PENDING as its member is extracted, and only trusted to skip a re-delivery once CONVERTED --
+#  after the Glue job (the state machine's 'CommitLedger'), or the Parquet fast path, has converted it
+"""
+
+import io
+import os
+import json
+import hashlib
+import datetime
+import threading
+
+from runtime_functions import get_client    # Lambda_Runtime Layer
+
+LEDGER_PENDING = 'PENDING'
+LEDGER_CONVERTED = 'CONVERTED'     # entries written before LedgerStatus existed are CONVERTED
+
+class HashingReader(io.RawIOBase):
+    ''' Read-through file object that feeds every byte read into a hashlib object '''
+
+    def __init__(self, fileobj, hasher):
+        super().__init__()
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.fileobj.read( len(b) )
+        self.hasher.update( data )
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+class HashingArchive:
+    ''' ZipFile stand-in whose open() hashes member bytes as they stream to whichever writer consumes them '''
+
+    def __init__(self, archive, hasher):
+        self.archive = archive
+        self.hasher = hasher
+
+    def open(self, member):
+        return HashingReader( self.archive.open( member ), self.hasher )
+
+    def extract(self, member, path):
+        return self.archive.extract( member, path )
+
+def member_sha256( archive, member, chunk_size ):
+    ''' SHA-256 of a member's uncompressed bytes (decompress only -- nothing written) '''
+    hasher = hashlib.sha256()
+    with archive.open( member ) as src:
+        for data in iter( lambda: src.read( chunk_size ), b'' ):
+            hasher.update( data )
+    return hasher.hexdigest()
+
+def file_sha256( file_path, chunk_size ):
+    ''' SHA-256 of a local file '''
+    hasher = hashlib.sha256()
+    with open( file_path, "rb" ) as f:
+        for data in iter( lambda: f.read( chunk_size ), b'' ):
+            hasher.update( data )
+    return hasher.hexdigest()
+
+class DynamoDBHashLedger:
+    ''' Member hashes in a DynamoDB table keyed by 'MemberKey' (S) '''
+
+    def __init__(self, table_name, dynamodb_client=None):
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client or get_client('dynamodb')
+
+    def get(self, member_key):
+        response = self.dynamodb_client.get_item(
+            TableName = self.table_name,
+            Key = { 'MemberKey' : { 'S' : member_key } },
+            ConsistentRead = True
+        )
+        if 'Item' not in response.keys():
+            return None
+        item = response['Item']
+        return {
+            'Sha256' : item['Sha256']['S'],
+            'Crc32' : int( item['Crc32']['N'] ),
+            'FileSize' : int( item['FileSize']['N'] ),
+            'BatchId' : item.get('BatchId', {}).get('S', ''),
+            'UpdatedAt' : item.get('UpdatedAt', {}).get('S', ''),
+            'LedgerStatus' : item.get('LedgerStatus', {}).get('S', LEDGER_CONVERTED)
+        }
+
+    def put(self, member_key, entry):
+        self.dynamodb_client.put_item(
+            TableName = self.table_name,
+            Item = {
+                'MemberKey' : { 'S' : member_key },
+                'Sha256' : { 'S' : entry['Sha256'] },
+                'Crc32' : { 'N' : str( entry['Crc32'] ) },
+                'FileSize' : { 'N' : str( entry['FileSize'] ) },
+                'BatchId' : { 'S' : entry['BatchId'] },
+                'UpdatedAt' : { 'S' : entry['UpdatedAt'] },
+                'LedgerStatus' : { 'S' : entry['LedgerStatus'] }
+            }
+        )
+
+    def commit(self, member_key, sha256):
+        ''' Mark an entry CONVERTED -- unless a later delivery has since replaced it '''
+        try:
+            self.dynamodb_client.update_item(
+                TableName = self.table_name,
+                Key = { 'MemberKey' : { 'S' : member_key } },
+                UpdateExpression = "SET LedgerStatus = :converted, UpdatedAt = :now",
+                ConditionExpression = "Sha256 = :sha256",
+                ExpressionAttributeValues = {
+                    ':converted' : { 'S' : LEDGER_CONVERTED },
+                    ':now' : { 'S' : datetime.datetime.now().isoformat() },
+                    ':sha256' : { 'S' : sha256 }
+                }
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+class LocalHashLedger:
+    ''' Member hashes in a local JSON file -- stand-in for DynamoDB in tests & benchmarks '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists( self.file_path ):
+            return {}
+        with open( self.file_path ) as f:
+            return json.load( f )
+
+    def get(self, member_key):
+        with self.lock:
+            return self._load().get( member_key )
+
+    def _save(self, entries):
+        directory = os.path.dirname( self.file_path )
+        if directory > '' and not os.path.isdir( directory ):
+            os.makedirs( directory )
+        with open( self.file_path, 'w' ) as f:
+            json.dump( entries, f, indent=2 )
+
+    def put(self, member_key, entry):
+        with self.lock:
+            entries = self._load()
+            entries[member_key] = entry
+            self._save( entries )
+
+    def commit(self, member_key, sha256):
+        with self.lock:
+            entries = self._load()
+            if entries.get( member_key, {} ).get('Sha256') != sha256:
+                return False
+            entries[member_key].update( { 'LedgerStatus' : LEDGER_CONVERTED, 'UpdatedAt' : datetime.datetime.now().isoformat() } )
+            self._save( entries )
+            return True
+
+def open_hash_ledger( ledger_url ):
+    ''' Open a hash ledger from a 'dynamodb://{table_name}' or 'file://{path}' URL '''
+    if ledger_url.startswith('dynamodb://'):
+        return DynamoDBHashLedger( ledger_url[len('dynamodb://'):] )
+    elif ledger_url.startswith('file://'):
+        return LocalHashLedger( ledger_url[len('file://'):] )
+    raise Exception(f"Unknown DedupLedger '{ledger_url}'.  Must be prefixed with 'dynamodb://' or 'file://'")
+
+def ledger_entry( sha256, member, batch_id ):
+    ''' Ledger record for a member just extracted -- PENDING until it is converted '''
+    return {
+        'Sha256' : sha256,
+        'Crc32' : member.CRC,
+        'FileSize' : member.file_size,
+        'BatchId' : batch_id,
+        'UpdatedAt' : datetime.datetime.now().isoformat(),
+        'LedgerStatus' : LEDGER_PENDING
+    }
+
+def commit_ledger_entries( ledger, ledger_pending ):
+    ''' Mark { member_key : sha256 } entries CONVERTED, once their data is in the Datalake '''
+    committed = [ member_key for member_key, sha256 in ledger_pending.items() if ledger.commit( member_key, sha256 ) ]
+    print(f"DedupLedger: {len(committed)} of {len(ledger_pending)} pending entries committed")
+    return committed
@@ -0,0 +1,72 @@
+"""
+## parquet_functions.py -- In-Lambda CSV to Parquet conversion for small batches
+#  (same Glue Catalog column types as Convert_CSV_To_Parquet's ApplyMapping, without Glue job startup;
+#   pyarrow comes from a Lambda Layer, e.g. AWS SDK for pandas, and is imported only when used)
+"""
+
+from unzip_functions import S3MultipartWriter, DEFAULT_PART_SIZE, MB
+
+DEFAULT_BLOCK_SIZE = 4 * MB     # CSV bytes parsed per record batch
+
+def pyarrow_available():
+    ''' True when pyarrow can be imported (i.e., the Layer is attached) '''
+    try:
+        import pyarrow
+        return True
+    except ImportError:
+        return False
+
+def arrow_type( glue_type ):
+    ''' Convert a Glue Catalog column type to a pyarrow type (string when unknown) '''
+    import pyarrow as pa
+
+    glue_type = glue_type.lower().replace(' ', '')
+    if glue_type.startswith('decimal'):
+        precision, scale = 10, 0
+        if '(' in glue_type:
+            precision, scale = [ int(n) for n in glue_type[glue_type.find('(')+1:-1].split(',') ]
+        return pa.decimal128( precision, scale )
+    if glue_type.startswith(('varchar','char')):
+        return pa.string()
+
+    glue_to_arrow = {
+        'string'    : pa.string(),
+        'boolean'   : pa.bool_(),
+        'tinyint'   : pa.int8(),
+        'byte'      : pa.int8(),
+        'smallint'  : pa.int16(),
+        'short'     : pa.int16(),
+        'int'       : pa.int32(),
+        'integer'   : pa.int32(),
+        'bigint'    : pa.int64(),
+        'long'      : pa.int64(),
+        'float'     : pa.float32(),
+        'double'    : pa.float64(),
+        'date'      : pa.date32(),
+        'timestamp' : pa.timestamp('ms'),
+    }
+    return glue_to_arrow.get( glue_type, pa.string() )
+
+def convert_member_to_parquet( s3_client, archive, member, glue_columns, s3_bucket, s3_key, part_size=DEFAULT_PART_SIZE, block_size=DEFAULT_BLOCK_SIZE ):
+    ''' Stream a CSV archive member into a Snappy Parquet object typed by Glue Catalog columns '''
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    column_names = [ column['Name'] for column in glue_columns ]
+    convert_options = pv.ConvertOptions(
+        column_types = { column['Name'] : arrow_type( column['Type'] ) for column in glue_columns },
+        include_columns = column_names,         # like ApplyMapping -- catalog columns only, in catalog order
+        include_missing_columns = True,
+        strings_can_be_null = False,
+        quoted_strings_can_be_null = False
+    )
+    row_count = 0
+    with archive.open( member ) as src, S3MultipartWriter( s3_client, s3_bucket, s3_key, part_size ) as dest:
+        reader = pv.open_csv( src, read_options=pv.ReadOptions( block_size=block_size ), convert_options=convert_options )
+        writer = pq.ParquetWriter( dest, reader.schema, compression='snappy' )
+        for batch in reader:
+            writer.write_batch( batch )
+            row_count += batch.num_rows
+        writer.close()      # only on success -- a failed member aborts the upload instead of leaving a partial file
+
+    return row_count
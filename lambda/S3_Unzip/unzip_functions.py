@@ -0,0 +1,463 @@
+"""
+## unzip_functions.py -- Streaming helpers for the S3_Unzip Lambda
+#  (ZIP members are read, compressed, and uploaded in fixed-size chunks so that
+#   neither memory nor /tmp usage grows with member size)
+"""
+
+import io
+import os
+import bz2
+import gzip
+import math
+import heapq
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+MB = 1024 * 1024
+S3_MIN_PART_SIZE = 5 * MB       # S3 Multipart Upload minimum for all but the last part
+DEFAULT_PART_SIZE = 8 * MB
+DEFAULT_CHUNK_SIZE = 1 * MB
+DEFAULT_READ_AHEAD = 8 * MB
+DEFAULT_TAIL_SIZE = 1 * MB      # End of Central Directory record (+ 64K max comment) and usually the whole Central Directory
+
+# extracted member codecs -- the file extension is how Spark/Hadoop (and so the Glue job) picks a decompressor
+CODEC_EXTENSIONS = {
+    'gzip' : '.gz',
+    'zstd' : '.zst',
+    'bz2'  : '.bz2',        # splittable -- Spark can read one large member with several tasks
+    'none' : ''
+}
+DEFAULT_CODEC = 'gzip'
+DEFAULT_COMPRESS_LEVELS = {
+    'gzip' : 9,             # gzip.open() default, as always used before codecs were configurable
+    'zstd' : 3,
+    'bz2'  : 9
+}
+
+class PassthroughWriter(io.RawIOBase):
+    ''' Uncompressed 'codec' -- forwards writes, leaving the underlying file object open on close '''
+
+    def __init__(self, fileobj):
+        super().__init__()
+        self.fileobj = fileobj
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+def open_codec_writer( codec, fileobj, compress_level=None, filename='' ):
+    ''' Wrap a binary file object in a compressing writer; closing the writer does not close fileobj '''
+    if codec not in CODEC_EXTENSIONS.keys():
+        raise Exception(f"Unknown codec '{codec}'.  Must be one of {list(CODEC_EXTENSIONS.keys())}")
+    if compress_level is None:
+        compress_level = DEFAULT_COMPRESS_LEVELS.get(codec)
+
+    if codec == 'gzip':
+        return gzip.GzipFile( filename=filename, mode="wb", fileobj=fileobj, compresslevel=compress_level )
+    elif codec == 'bz2':
+        return bz2.BZ2File( fileobj, mode="wb", compresslevel=compress_level )
+    elif codec == 'zstd':
+        import zstandard    # optional -- package it with the function when a feed uses zstd
+        return zstandard.ZstdCompressor( level=compress_level ).stream_writer( fileobj, closefd=False )
+    else:
+        return PassthroughWriter( fileobj )
+
+class S3MultipartWriter(io.RawIOBase):
+    ''' Write-only file object that buffers writes into S3 Multipart Upload parts '''
+
+    def __init__(self, s3_client, s3_bucket, s3_key, part_size=DEFAULT_PART_SIZE):
+        super().__init__()
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.s3_key = s3_key
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.s3_bucket, Key=self.s3_key)
+            self.upload_id = response['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket = self.s3_bucket,
+            Key = self.s3_key,
+            UploadId = self.upload_id,
+            PartNumber = part_number,
+            Body = data
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        ''' Complete the upload (single PUT when everything fit in one part) '''
+        if self.closed:
+            return
+        if self.upload_id is None:
+            self.s3_client.put_object(Bucket=self.s3_bucket, Key=self.s3_key, Body=bytes(self.buffer))
+        else:
+            if len(self.buffer) > 0:
+                self._upload_part(bytes(self.buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket = self.s3_bucket,
+                Key = self.s3_key,
+                UploadId = self.upload_id,
+                MultipartUpload = {'Parts': self.parts}
+            )
+        self.buffer = bytearray()
+        super().close()
+
+    def abort(self):
+        ''' Discard buffered data and any parts already uploaded '''
+        if self.closed:
+            return
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.s3_bucket, Key=self.s3_key, UploadId=self.upload_id)
+        self.buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # never complete a partial object when the body raised
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def stream_member_to_s3( s3_client, archive, member, s3_bucket, s3_key, chunk_size=DEFAULT_CHUNK_SIZE, part_size=DEFAULT_PART_SIZE, codec=DEFAULT_CODEC, compress_level=None ):
+    ''' Stream a ZIP archive member through the codec's compression into an S3 Multipart Upload '''
+    with archive.open( member ) as src, S3MultipartWriter( s3_client, s3_bucket, s3_key, part_size ) as dest:
+        with open_codec_writer( codec, dest, compress_level, member.filename ) as writer:
+            shutil.copyfileobj( src, writer, chunk_size )
+
+    return dest.bytes_written
+
+class S3RangeReader(io.RawIOBase):
+    ''' Seekable, read-only file object over an S3 Object using ranged GETs with read-ahead buffering '''
+
+    def __init__(self, s3_client, s3_bucket, s3_key, read_ahead=DEFAULT_READ_AHEAD, tail_size=DEFAULT_TAIL_SIZE):
+        super().__init__()
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.s3_key = s3_key
+        self.read_ahead = read_ahead
+        head = s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
+        self.size = head['ContentLength']
+        self.etag = head['ETag']        # every ranged GET must see the same object version
+        self.position = 0
+        self.buffer = b''
+        self.buffer_start = 0
+        self.get_count = 0
+        self.bytes_fetched = 0
+        self.get_seconds = 0.0
+
+        # one GET for the archive tail, where zipfile looks for the Central Directory
+        if self.size > 0:
+            self._fetch( max(0, self.size - tail_size), self.size )
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.position = position
+        return self.position
+
+    def _fetch(self, start, end):
+        ''' GET bytes [start, end) into the read-ahead buffer '''
+        get_start = time.perf_counter()
+        response = self.s3_client.get_object(
+            Bucket = self.s3_bucket,
+            Key = self.s3_key,
+            Range = f"bytes={start}-{end - 1}",
+            IfMatch = self.etag
+        )
+        self.buffer = response['Body'].read()
+        self.buffer_start = start
+        self.get_count += 1
+        self.bytes_fetched += len(self.buffer)
+        self.get_seconds += time.perf_counter() - get_start
+
+    def readinto(self, b):
+        if self.position >= self.size:
+            return 0
+        end = min(self.position + len(b), self.size)
+        if self.position < self.buffer_start or end > self.buffer_start + len(self.buffer):
+            # zipfile expects full reads, so refill from the current position rather than splice
+            self._fetch( self.position, min(self.size, self.position + max(len(b), self.read_ahead)) )
+        offset = self.position - self.buffer_start
+        count = end - self.position
+        b[:count] = self.buffer[offset:offset + count]
+        self.position = end
+        return count
+
+class TimedReader(io.RawIOBase):
+    ''' Read-through file object adding read time & bytes to a StageTiming stage '''
+
+    def __init__(self, fileobj, timing, stage):
+        super().__init__()
+        self.fileobj = fileobj
+        self.timing = timing
+        self.stage = stage
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        start = time.perf_counter()
+        data = self.fileobj.read( len(b) )
+        self.timing.add( self.stage, time.perf_counter() - start, len(data) )
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+class TimedArchive:
+    ''' ZipFile stand-in timing member reads (decompression, and any ranged GETs) as the 'Extract' stage '''
+
+    def __init__(self, archive, timing):
+        self.archive = archive
+        self.timing = timing
+
+    def open(self, member):
+        return TimedReader( self.archive.open( member ), self.timing, 'Extract' )
+
+    def extract(self, member, path):
+        with self.timing.timed( 'Extract', member.file_size ):
+            return self.archive.extract( member, path )
+
+class TimedS3Client:
+    ''' S3 client stand-in timing object writes as the 'Upload' stage (other calls pass straight through) '''
+    UPLOAD_METHODS = [ 'put_object', 'upload_part', 'upload_file', 'create_multipart_upload', 'complete_multipart_upload' ]
+
+    def __init__(self, s3_client, timing):
+        self.s3_client = s3_client
+        self.timing = timing
+
+    def __getattr__(self, name):
+        method = getattr( self.s3_client, name )
+        if name not in self.UPLOAD_METHODS:
+            return method
+
+        def timed_upload( *args, **kwargs ):
+            if 'Body' in kwargs.keys():
+                nbytes = len( kwargs['Body'] )
+            elif name == 'upload_file':
+                nbytes = os.path.getsize( kwargs.get('Filename', args[0] if len(args) > 0 else '') )
+            else:
+                nbytes = 0
+            with self.timing.timed( 'Upload', nbytes ):
+                return method( *args, **kwargs )
+        return timed_upload
+
+class MemoryBudget:
+    ''' Blocking byte budget that caps the memory held by members in flight '''
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.available = budget_bytes
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        nbytes = min(nbytes, self.budget)   # an oversized member waits to run alone rather than never
+        with self.condition:
+            self.condition.wait_for( lambda: nbytes <= self.available )
+            self.available -= nbytes
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.available += nbytes
+                self.condition.notify_all()
+
+def build_zip_extracted( member_results ):
+    ''' Assemble the ZipExtracted output from per-member results, in archive order (changed members only) '''
+    zip_extracted = {
+        "GlueTableNames" : [],
+        "PartitionFolders" : [],
+        "S3ExtractedUrls" : []
+    }
+    for result in sorted( member_results, key=lambda r: r['MemberIndex'] ):
+        if result.get('Unchanged', False):
+            # identical re-delivery (DedupLedger) -- reported, but nothing for the Glue job to convert
+            zip_extracted.setdefault( 'UnchangedMembers', [] ).append( result['MemberName'] )
+            continue
+        zip_extracted['GlueTableNames'].append( result['GlueTableName'] )
+        zip_extracted['S3ExtractedUrls'].extend( result['S3ExtractedUrls'] )
+        if result['PartitionFolder'] not in zip_extracted['PartitionFolders']:
+            zip_extracted['PartitionFolders'].append( result['PartitionFolder'] )
+        if 'LedgerPending' in result.keys():
+            # DedupLedger entries to commit once the batch is converted
+            zip_extracted.setdefault( 'LedgerPending', {} ).update( result['LedgerPending'] )
+
+    return zip_extracted
+
+def plan_member_groups( infolist, group_bytes, max_groups ):
+    ''' Partition archive members into groups balanced by uncompressed size (largest member onto the lightest group) '''
+    total_bytes = sum( member.file_size for member in infolist )
+    group_count = max( 1, min( len(infolist), max_groups, math.ceil( total_bytes / group_bytes ) ) )
+
+    groups = [ { "GroupId" : g, "UncompressedBytes" : 0, "Members" : [] } for g in range(group_count) ]
+    lightest = [ (0, g) for g in range(group_count) ]
+    for member_index, member in sorted( enumerate(infolist), key=lambda im: im[1].file_size, reverse=True ):
+        group_size, g = heapq.heappop( lightest )
+        groups[g]['Members'].append( { "MemberIndex" : member_index, "MemberName" : member.filename } )
+        groups[g]['UncompressedBytes'] += member.file_size
+        heapq.heappush( lightest, (group_size + member.file_size, g) )
+
+    for group in groups:
+        group['Members'].sort( key=lambda m: m['MemberIndex'] )     # extract in archive order within each group
+
+    return [ group for group in groups if len(group['Members']) > 0 ]
+
+def find_record_end( data, start, in_quote ):
+    ''' Index of the first newline at/after start that is outside a quoted field (-1 if none), and quote state at the end of data '''
+    position = start
+    while True:
+        newline = data.find( b'\n', position )
+        if newline == -1:
+            return -1, in_quote ^ bool( data.count( b'"', position ) & 1 )
+        in_quote ^= bool( data.count( b'"', position, newline ) & 1 )     # "" escapes toggle twice, so parity holds
+        if not in_quote:
+            return newline, in_quote
+        position = newline + 1
+
+def split_csv_stream( src, open_chunk, close_chunk, split_bytes, block_size=DEFAULT_CHUNK_SIZE ):
+    ''' Copy a CSV stream into chunks of about split_bytes that break on record boundaries and repeat the header '''
+    # header is everything up to the first unquoted newline
+    data = b''
+    in_quote = False
+    while True:
+        block = src.read( block_size )
+        header_end, in_quote = find_record_end( data + block, len(data), in_quote ) if block else ( len(data) - 1, False )
+        data += block
+        if header_end != -1 or not block:
+            break
+    header, data = data[:header_end + 1], data[header_end + 1:]
+
+    chunk = None
+    chunk_count = 0
+    in_quote = False
+    while True:
+        position = 0
+        while position < len(data):
+            if chunk is None:
+                chunk = open_chunk()
+                chunk.write( header )
+                chunk_count += 1
+                chunk_written = 0
+            room = max( split_bytes - chunk_written, 0 )
+            if len(data) - position <= room:
+                chunk.write( data[position:] )
+                in_quote ^= bool( data.count( b'"', position ) & 1 )
+                chunk_written += len(data) - position
+                break
+            # quote state where this chunk reaches split_bytes, then the next record boundary after it
+            split_from = position + room
+            in_quote ^= bool( data.count( b'"', position, split_from ) & 1 )
+            record_end, in_quote = find_record_end( data, split_from, in_quote )
+            if record_end == -1:
+                chunk.write( data[position:] )      # no boundary in this block -- keep filling
+                chunk_written += len(data) - position
+                break
+            chunk.write( data[position:record_end + 1] )
+            close_chunk()
+            chunk = None
+            position = record_end + 1
+
+        data = src.read( block_size )
+        if not data:
+            break
+
+    if chunk_count == 0:
+        chunk = open_chunk()        # header-only member still lands as one object
+        chunk.write( header )
+        chunk_count = 1
+    if chunk is not None:
+        close_chunk()
+
+    return chunk_count
+
+def split_member_to_s3( s3_client, archive, member, s3_bucket, chunk_key, split_bytes, chunk_size=DEFAULT_CHUNK_SIZE, part_size=DEFAULT_PART_SIZE, codec=DEFAULT_CODEC, compress_level=None ):
+    ''' Stream a CSV archive member into row-aligned, header-repeating compressed chunks on S3; chunk_key(n) names chunk n '''
+    s3_keys = []
+    open_chunks = []
+
+    def open_chunk():
+        s3_key = chunk_key( len(s3_keys) + 1 )
+        dest = S3MultipartWriter( s3_client, s3_bucket, s3_key, part_size )
+        writer = open_codec_writer( codec, dest, compress_level, member.filename )
+        open_chunks.append( (writer, dest) )
+        s3_keys.append( s3_key )
+        return writer
+
+    def close_chunk():
+        writer, dest = open_chunks.pop()
+        writer.close()
+        dest.close()
+
+    try:
+        with archive.open( member ) as src:
+            split_csv_stream( src, open_chunk, close_chunk, split_bytes, chunk_size )
+    except BaseException:
+        for writer, dest in open_chunks:
+            dest.abort()
+        raise
+
+    return s3_keys
+
+def merge_zip_extracted( archives_extracted ):
+    ''' Combine the ZipExtracted of several archives (a 'NameList' burst) into one, for a single Glue job run '''
+    zip_extracted = {
+        "GlueTableNames" : [],
+        "PartitionFolders" : [],
+        "S3ExtractedUrls" : []
+    }
+    for archive_extracted in archives_extracted:
+        if archive_extracted.get('ParquetConverted', False):
+            continue    # already in the Datalake
+        for key in [ 'GlueTableNames', 'PartitionFolders' ]:
+            zip_extracted[key].extend( [ name for name in archive_extracted[key] if name not in zip_extracted[key] ] )
+        zip_extracted['S3ExtractedUrls'].extend( archive_extracted['S3ExtractedUrls'] )
+        if 'LedgerPending' in archive_extracted.keys():
+            zip_extracted.setdefault( 'LedgerPending', {} ).update( archive_extracted['LedgerPending'] )
+        if 'UnchangedMembers' in archive_extracted.keys():
+            zip_extracted.setdefault( 'UnchangedMembers', [] ).extend( archive_extracted['UnchangedMembers'] )
+
+    return zip_extracted
@@ -0,0 +1,240 @@
+"""
+## batch_functions.py -- Batch ledger: one record per BatchId with the state of each of its objects
+#  (conditional writes make a start idempotent -- a duplicate event or retry cannot start a second execution,
+#   and a re-run of a FAILED batch only extracts the objects that did not finish)
+#  'BatchKey' is the version of the batch's objects (S3 version-id or ETag) -- a corrected re-delivery under the same name
+#  starts the batch afresh even after it SUCCEEDED; a RUNNING claim whose execution has closed (or never started within
+#  'BatchLeaseSeconds' of its 'ClaimedAt') is reconciled, so it cannot block its BatchId forever
+#  'BatchLedger' process_parm or environment variable: 'dynamodb://{table_name}' in AWS, or 'file://{path}' locally
+"""
+
+import os
+import json
+import datetime
+import threading
+
+from runtime_functions import get_client
+
+BATCH_RUNNING = 'RUNNING'
+BATCH_SUCCEEDED = 'SUCCEEDED'
+BATCH_FAILED = 'FAILED'
+OBJECT_PENDING = 'PENDING'
+OBJECT_EXTRACTED = 'EXTRACTED'
+DEFAULT_LEASE_SECONDS = 6 * 3600     # a claim whose execution never started (e.g., lost between claim & start) -- beyond any admission queue wait
+
+def now_iso():
+    return datetime.datetime.now().isoformat()
+
+def new_objects( object_names ):
+    ''' BatchObjects for a first start -- every object PENDING '''
+    return { name : { 'ObjectStatus' : OBJECT_PENDING, 'UpdatedAt' : now_iso() } for name in object_names }
+
+def unknown_batch( batch_id, ledger_url ):
+    ''' Error message for an object status set on a batch the ledger never claimed -- alike from either ledger '''
+    return f"Batch '{batch_id}' is not in BatchLedger '{ledger_url}' -- its object status cannot be set"
+
+def pending_objects( batch ):
+    ''' Names of a batch's objects still to be extracted '''
+    return [ name for name, batch_object in batch['BatchObjects'].items() if batch_object['ObjectStatus'] != OBJECT_EXTRACTED ]
+
+class DynamoDBBatchLedger:
+    ''' Batches in a DynamoDB table keyed by 'BatchId' (S) '''
+
+    def __init__(self, table_name, dynamodb_client=None):
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client or get_client('dynamodb')
+
+    def _item(self, values):
+        from boto3.dynamodb.types import TypeSerializer
+        serializer = TypeSerializer()
+        return { key : serializer.serialize( value ) for key, value in values.items() }
+
+    def _values(self, item):
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializer = TypeDeserializer()
+        return { key : deserializer.deserialize( value ) for key, value in item.items() }
+
+    def get_batch(self, batch_id):
+        response = self.dynamodb_client.get_item(
+            TableName = self.table_name,
+            Key = { 'BatchId' : { 'S' : batch_id } },
+            ConsistentRead = True
+        )
+        return self._values( response['Item'] ) if 'Item' in response.keys() else None
+
+    def start_batch(self, batch_id, exec_name, object_names, batch_key=''):
+        ''' Claim the batch for exec_name -- None when it is already RUNNING, or SUCCEEDED for the same batch_key '''
+        try:
+            # new objects (a new BatchId, or new versions of a closed batch's) -- start afresh
+            response = self.dynamodb_client.update_item(
+                TableName = self.table_name,
+                Key = { 'BatchId' : { 'S' : batch_id } },
+                UpdateExpression = "SET BatchStatus = :running, ExecName = :exec_name, ClaimedAt = :now, UpdatedAt = :now, BatchObjects = :objects, BatchKey = :batch_key, StartCount = :one",
+                ConditionExpression = "attribute_not_exists(BatchId) OR ( BatchStatus IN (:failed, :succeeded) AND BatchKey <> :batch_key )",
+                ExpressionAttributeValues = self._item( {
+                    ':running' : BATCH_RUNNING,
+                    ':failed' : BATCH_FAILED,
+                    ':succeeded' : BATCH_SUCCEEDED,
+                    ':exec_name' : exec_name,
+                    ':now' : now_iso(),
+                    ':objects' : new_objects( object_names ),
+                    ':batch_key' : batch_key,
+                    ':one' : 1
+                } ),
+                ReturnValues = 'ALL_NEW'
+            )
+            return self._values( response['Attributes'] )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            pass
+        try:
+            # the same objects -- a re-run of a FAILED batch, keeping the objects already extracted
+            response = self.dynamodb_client.update_item(
+                TableName = self.table_name,
+                Key = { 'BatchId' : { 'S' : batch_id } },
+                UpdateExpression = "SET BatchStatus = :running, ExecName = :exec_name, ClaimedAt = :now, UpdatedAt = :now, BatchKey = :batch_key ADD StartCount :one",
+                ConditionExpression = "BatchStatus = :failed",
+                ExpressionAttributeValues = self._item( {
+                    ':running' : BATCH_RUNNING,
+                    ':failed' : BATCH_FAILED,
+                    ':exec_name' : exec_name,
+                    ':now' : now_iso(),
+                    ':batch_key' : batch_key,
+                    ':one' : 1
+                } ),
+                ReturnValues = 'ALL_NEW'
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return None
+        return self._values( response['Attributes'] )
+
+    def set_object_status(self, batch_id, object_name, status, zip_extracted=None):
+        batch_object = { 'ObjectStatus' : status, 'UpdatedAt' : now_iso() }
+        if zip_extracted is not None:
+            batch_object['ZipExtracted'] = json.dumps( zip_extracted )   # a string -- no 400KB-deep nesting
+        try:
+            self.dynamodb_client.update_item(
+                TableName = self.table_name,
+                Key = { 'BatchId' : { 'S' : batch_id } },
+                UpdateExpression = "SET BatchObjects.#name = :object, UpdatedAt = :now",
+                ConditionExpression = "attribute_exists(BatchId)",
+                ExpressionAttributeNames = { '#name' : object_name },
+                ExpressionAttributeValues = self._item( { ':object' : batch_object, ':now' : now_iso() } )
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            raise Exception( unknown_batch( batch_id, f"dynamodb://{self.table_name}" ) )
+
+    def close_batch(self, batch_id, exec_name, status, error=''):
+        ''' Set the final status -- only the execution that started the batch may close it '''
+        try:
+            self.dynamodb_client.update_item(
+                TableName = self.table_name,
+                Key = { 'BatchId' : { 'S' : batch_id } },
+                UpdateExpression = "SET BatchStatus = :status, UpdatedAt = :now, BatchError = :error",
+                ConditionExpression = "ExecName = :exec_name",
+                ExpressionAttributeValues = self._item( { ':status' : status, ':now' : now_iso(), ':error' : error, ':exec_name' : exec_name } )
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+class LocalBatchLedger:
+    ''' Batches in a local JSON file, with the same conditions -- stand-in for DynamoDB in tests & benchmarks '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists( self.file_path ):
+            return {}
+        with open( self.file_path ) as f:
+            return json.load( f )
+
+    def _save(self, batches):
+        directory = os.path.dirname( self.file_path )
+        if directory > '' and not os.path.isdir( directory ):
+            os.makedirs( directory )
+        with open( self.file_path, 'w' ) as f:
+            json.dump( batches, f, indent=2 )
+
+    def get_batch(self, batch_id):
+        with self.lock:
+            return self._load().get( batch_id )
+
+    def start_batch(self, batch_id, exec_name, object_names, batch_key=''):
+        with self.lock:
+            batches = self._load()
+            batch = batches.get( batch_id )
+            if batch is None or ( batch['BatchStatus'] != BATCH_RUNNING and batch.get('BatchKey', batch_key) != batch_key ):
+                batch = { 'BatchId' : batch_id, 'BatchObjects' : new_objects( object_names ), 'StartCount' : 0 }
+            elif batch['BatchStatus'] != BATCH_FAILED:
+                return None
+            batch.update( { 'BatchStatus' : BATCH_RUNNING, 'ExecName' : exec_name, 'ClaimedAt' : now_iso(), 'UpdatedAt' : now_iso(), 'BatchKey' : batch_key, 'StartCount' : batch['StartCount'] + 1 } )
+            batches[batch_id] = batch
+            self._save( batches )
+            return batch
+
+    def set_object_status(self, batch_id, object_name, status, zip_extracted=None):
+        with self.lock:
+            batches = self._load()
+            if batch_id not in batches.keys():
+                raise Exception( unknown_batch( batch_id, f"file://{self.file_path}" ) )
+            batch_object = { 'ObjectStatus' : status, 'UpdatedAt' : now_iso() }
+            if zip_extracted is not None:
+                batch_object['ZipExtracted'] = json.dumps( zip_extracted )
+            batches[batch_id]['BatchObjects'][object_name] = batch_object
+            batches[batch_id]['UpdatedAt'] = now_iso()
+            self._save( batches )
+
+    def close_batch(self, batch_id, exec_name, status, error=''):
+        with self.lock:
+            batches = self._load()
+            if batch_id not in batches.keys() or batches[batch_id]['ExecName'] != exec_name:
+                return False
+            batches[batch_id].update( { 'BatchStatus' : status, 'UpdatedAt' : now_iso(), 'BatchError' : error } )
+            self._save( batches )
+            return True
+
+def open_batch_ledger( ledger_url ):
+    ''' Open a batch ledger from a 'dynamodb://{table_name}' or 'file://{path}' URL '''
+    if ledger_url.startswith('dynamodb://'):
+        return DynamoDBBatchLedger( ledger_url[len('dynamodb://'):] )
+    elif ledger_url.startswith('file://'):
+        return LocalBatchLedger( ledger_url[len('file://'):] )
+    raise Exception(f"Unknown BatchLedger '{ledger_url}'.  Must be prefixed with 'dynamodb://' or 'file://'")
+
+def execution_arn( step_arn, exec_name ):
+    ''' 'arn:...:stateMachine:{name}' -> 'arn:...:execution:{name}:{exec_name}' '''
+    return step_arn.replace( ':stateMachine:', ':execution:', 1 ) + f":{exec_name}"
+
+def reconcile_batch( batch_ledger, batch_id, step_arn, lease_seconds=DEFAULT_LEASE_SECONDS ):
+    ''' Close a RUNNING claim its execution can no longer close -- True when it was closed, so the batch may be claimed again '''
+    batch = batch_ledger.get_batch( batch_id )
+    if batch is None or batch['BatchStatus'] != BATCH_RUNNING:
+        return False
+    sfn_client = get_client('stepfunctions')
+    try:
+        execution_status = sfn_client.describe_execution( executionArn = execution_arn( step_arn, batch['ExecName'] ) )['status']
+    except sfn_client.exceptions.ExecutionDoesNotExist:
+        # queued by admission control, or lost before it started -- stale only once past the lease
+        # (from the claim -- UpdatedAt moves with every object status; a batch claimed before 'ClaimedAt' has only UpdatedAt)
+        claim_age = datetime.datetime.now() - datetime.datetime.fromisoformat( batch.get('ClaimedAt', batch['UpdatedAt']) )
+        if claim_age.total_seconds() < lease_seconds:
+            return False
+        execution_status = 'NOT_STARTED'
+    if execution_status == 'RUNNING':
+        return False
+    # ended without Close Batch (timed out, aborted, crashed) -- record its outcome
+    batch_status = BATCH_SUCCEEDED if execution_status == 'SUCCEEDED' else BATCH_FAILED
+    print(f"Batch '{batch_id}' claim by '{batch['ExecName']}' is stale (execution {execution_status}) -- closed {batch_status}")
+    return batch_ledger.close_batch( batch_id, batch['ExecName'], batch_status, f"Reconciled: execution {execution_status}" )
+
+def extracted_object( batch_ledger, batch_id, object_name ):
+    ''' ZipExtracted recorded for an object a previous attempt already extracted, else None '''
+    batch = batch_ledger.get_batch( batch_id )
+    if batch is None:
+        return None
+    batch_object = batch['BatchObjects'].get( object_name, {} )
+    if batch_object.get('ObjectStatus') != OBJECT_EXTRACTED:
+        return None
+    return json.loads( batch_object['ZipExtracted'] )
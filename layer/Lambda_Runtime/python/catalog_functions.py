@@ -0,0 +1,36 @@
+"""
+## catalog_functions.py -- Glue Catalog partition registration shared by the Lambda functions (Lambda_Runtime Layer)
+#  (the glue_client is passed in, so callers reuse their runtime_functions client & Table lookups)
+"""
+
+def crup_glue_partition( glue_client, glue_database_name, glue_table, partition_keys ):
+    ''' CReate or UPdate Glue Partition '''
+    glue_table_name = glue_table['Table']['Name']
+    glue_partition_sd = glue_table['Table']['StorageDescriptor'].copy()
+    glue_partition_sd['Location'] = f"{glue_partition_sd['Location']}/{partition_keys[0]}"
+
+    partition_input = {
+        'Values' : partition_keys,
+        'StorageDescriptor' : glue_partition_sd,
+        'Parameters' : glue_table['Table']['Parameters']
+    }
+    try:
+        response = glue_client.create_partition(
+            DatabaseName = glue_database_name,
+            TableName = glue_table_name ,
+            PartitionInput = partition_input
+        )
+        status = 'Created'
+
+    except glue_client.exceptions.AlreadyExistsException:
+        response = glue_client.update_partition(
+            DatabaseName = glue_database_name,
+            TableName = glue_table_name ,
+            PartitionValueList = partition_keys,
+            PartitionInput = partition_input
+        )
+        status = 'Updated'
+
+    print(f"Partitions {status} for Glue Table '{glue_table_name}' in Database '{glue_database_name}: {partition_keys}'" )
+
+    return glue_partition_sd
@@ -0,0 +1,101 @@
+"""
+## metrics_functions.py -- Per-stage durations & byte counts as CloudWatch Embedded Metric Format (EMF) log records
+#  (CloudWatch extracts the metrics from the Lambda log -- no PutMetricData calls, nothing added to the critical path)
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_NAMESPACE = 'SimpleFileProcessing'
+DIMENSION_KEYS = [ 'SysAbbrev', 'Table', 'BatchId' ]    # rolled up left to right, e.g. per feed, per table, per batch
+METRIC_UNITS = {
+    'Duration' : 'Milliseconds',
+    'Latency' : 'Milliseconds',
+    'Bytes' : 'Bytes',
+    'Count' : 'Count'
+}
+
+def sys_abbrev( process_parms, batch_id='' ):
+    ''' Feed SysAbbrev from process_parms, else from a '{Qualifier}.{SysAbbrev}...' BatchId '''
+    if 'SysAbbrev' in process_parms.keys():
+        return process_parms['SysAbbrev']
+    batch_id = process_parms.get('BatchId', batch_id)
+    return batch_id.split('.')[1] if batch_id.count('.') > 1 else 'n/a'
+
+def metric_unit( metric_name ):
+    ''' CloudWatch Unit from a metric name suffix ('DownloadDuration' is Milliseconds, 'UploadBytes' is Bytes) '''
+    for suffix, unit in METRIC_UNITS.items():
+        if metric_name.endswith( suffix ):
+            return unit
+    return 'None'
+
+class MetricsLogger:
+    ''' Prints one EMF record per put(), with SysAbbrev/Table/BatchId dimension rollups '''
+
+    def __init__(self, dimensions, namespace=None):
+        self.dimensions = { key : str(value) for key, value in dimensions.items() }
+        self.namespace = namespace or os.environ.get('MetricsNamespace', DEFAULT_NAMESPACE)
+        self.lock = threading.Lock()
+
+    def put(self, stage, metrics, dimensions={}, properties={}):
+        ''' Log metrics (name : value) for a stage; properties are searchable in Logs Insights but not dimensions '''
+        record_dimensions = dict( self.dimensions, **{ key : str(value) for key, value in dimensions.items() } )
+        keys = [ key for key in DIMENSION_KEYS if key in record_dimensions.keys() ]
+        record = {
+            "_aws" : {
+                "Timestamp" : int( time.time() * 1000 ),
+                "CloudWatchMetrics" : [ {
+                    "Namespace" : self.namespace,
+                    "Dimensions" : [ keys[:n] for n in range( 1, len(keys) + 1 ) ],
+                    "Metrics" : [ { "Name" : name, "Unit" : metric_unit( name ) } for name in metrics.keys() ]
+                } ]
+            },
+            "Stage" : stage,
+            **properties,
+            **record_dimensions,
+            **metrics
+        }
+        with self.lock:
+            print( json.dumps( record ) )
+        return record
+
+    @contextmanager
+    def stage(self, stage, dimensions={}, properties={}):
+        ''' Time a block as '{stage}Duration'; the block may add e.g. '{stage}Bytes' to the yielded metrics '''
+        metrics = {}
+        start = time.perf_counter()
+        yield metrics
+        metrics[f"{stage}Duration"] = round( ( time.perf_counter() - start ) * 1000, 3 )
+        self.put( stage, metrics, dimensions, properties )
+
+class StageTiming:
+    ''' Thread-safe seconds & bytes accumulated per stage, e.g. while one member streams through several stages '''
+
+    def __init__(self):
+        self.seconds = {}
+        self.bytes = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds, nbytes=0):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+
+    @contextmanager
+    def timed(self, stage, nbytes=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add( stage, time.perf_counter() - start, nbytes )
+
+    def metrics(self, stages):
+        ''' '{stage}Duration' (ms) & '{stage}Bytes' for each stage '''
+        metrics = {}
+        for stage in stages:
+            metrics[f"{stage}Duration"] = round( self.seconds.get(stage, 0.0) * 1000, 3 )
+            metrics[f"{stage}Bytes"] = self.bytes.get(stage, 0)
+        return metrics
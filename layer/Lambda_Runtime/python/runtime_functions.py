@@ -0,0 +1,62 @@
+"""
+## runtime_functions.py -- Lambda container runtime shared by Process_Initiator & S3_Unzip (Lambda_Runtime Layer)
+#  (boto3 clients are created on first use and reused by every warm invocation of the container, and heavy
+#   modules are imported only when an invocation needs them -- so a cold start pays only for what it uses)
+"""
+
+import time
+import threading
+
+CONTAINER_START = time.perf_counter()   # Layer module import -- about when function init began
+
+# per-service connection pools -- at least as many as threads that share the client
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+MAX_POOL_CONNECTIONS = {
+    's3' : 50,
+    'stepfunctions' : 2,
+    'glue' : 10,
+    'dynamodb' : 10
+}
+DEFAULT_CLIENT_CONFIG = {
+    'connect_timeout' : 5,
+    'read_timeout' : 60,
+    'retries' : { 'mode' : 'standard', 'max_attempts' : 5 }
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+_cold_start = True
+
+def get_client( service_name, **config ):
+    ''' boto3 client for a service, created once per container (per config) with a tuned connection pool '''
+    client_key = ( service_name, repr( sorted( config.items() ) ) )
+    if client_key not in _clients:
+        with _clients_lock:     # client creation from the default session is not thread safe
+            if client_key not in _clients:
+                import boto3
+                from botocore.config import Config
+                client_config = dict( DEFAULT_CLIENT_CONFIG, max_pool_connections=MAX_POOL_CONNECTIONS.get( service_name, DEFAULT_MAX_POOL_CONNECTIONS ) )
+                client_config.update( config )
+                _clients[client_key] = boto3.client( service_name, config=Config( **client_config ) )
+    return _clients[client_key]
+
+class LazyClient:
+    ''' Module-level stand-in for a client -- boto3 is imported & the client created at first call, not at init '''
+
+    def __init__(self, service_name, **config):
+        self.service_name = service_name
+        self.config = config
+
+    def __getattr__(self, name):
+        return getattr( get_client( self.service_name, **self.config ), name )
+
+def cold_start_metrics():
+    ''' 'InitDuration' (Layer import to first handler call) on a container's first invocation, else {} '''
+    global _cold_start
+    if not _cold_start:
+        return {}
+    _cold_start = False
+    return {
+        'InitDuration' : round( ( time.perf_counter() - CONTAINER_START ) * 1000, 3 ),
+        'ColdStartCount' : 1
+    }
@@ -19,39 +19,97 @@ import boto3
 glue = boto3.client('glue')
 s3 = boto3.client('s3')
 
-def list_glue_tables( glue_database_name, regex = '.'):
-    ''' List Glue Database Tables filtered by RegEx '''
-    import os
-    import boto3
-    import re
+GLUE_CACHE_SECONDS = int( os.environ.get('GlueCacheSeconds', 300) )    # catalog metadata TTL
+GLUE_CACHE_ENTRIES = 256            # LRU limit -- a partition list entry can hold tens of thousands of partitions
+GLUE_PARTITION_SEGMENTS = 10        # GetPartitions TotalSegments limit
+GLUE_DELETE_PARTITIONS = 25         # BatchDeletePartition limit per request
+
+class GlueCatalogCache:
+    ''' Glue Catalog metadata (tables, table lists, partition lists) cached by key tuple, expired by TTL, evicted LRU '''
+
+    def __init__(self, ttl_seconds=GLUE_CACHE_SECONDS, max_entries=GLUE_CACHE_ENTRIES):
+        import threading
+        from collections import OrderedDict
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        ''' Cached value for key, else loader() -- cached unless None '''
+        import time
+        with self.lock:
+            if key in self.entries:
+                expires, value = self.entries[key]
+                if expires > time.monotonic():
+                    self.entries.move_to_end( key )
+                    return value
+                del self.entries[key]
+        value = loader()
+        if value is not None:
+            self.put( key, value )
+        return value
+
+    def put(self, key, value):
+        import time
+        with self.lock:
+            self.entries[key] = ( time.monotonic() + self.ttl_seconds, value )
+            self.entries.move_to_end( key )
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem( last=False )
+
+    def invalidate(self, *key_prefix):
+        ''' Drop every key starting with key_prefix (all keys if none) '''
+        with self.lock:
+            for key in [ key for key in self.entries.keys() if key[:len(key_prefix)] == key_prefix ]:
+                del self.entries[key]
+
+glue_cache = GlueCatalogCache()
+
+def get_glue_database( glue_database_name ):
+    ''' Glue Database (cached) '''
+    return glue_cache.get( ( 'Database', glue_database_name ), lambda: glue.get_database( Name = glue_database_name )['Database'] )
+
+def get_glue_table( glue_database_name, glue_table_name ):
+    ''' Glue Table (cached) -- None if not found '''
+    def load_table():
+        try:
+            return glue.get_table( DatabaseName = glue_database_name, Name = glue_table_name )['Table']
+        except glue.exceptions.EntityNotFoundException:
+            return None
+    return glue_cache.get( ( 'Table', glue_database_name, glue_table_name.lower() ), load_table )
+
+def glue_name_expression( regex ):
+    ''' GetTables Expression (a '*' wildcard pattern) for a literal RegEx, optionally ^ $ anchored -- else '' (no server-side filter) '''
+    match = re.fullmatch( r'(\^?)([A-Za-z0-9_]+)(\$?)', regex )
+    if match is None:
+        return ''
+    anchor_beg, literal, anchor_end = match.groups()
+    return ( '' if anchor_beg else '*' ) + literal.lower() + ( '' if anchor_end else '*' )
+
+def list_glue_tables( glue_database_name, regex = '.', expression = None ):
+    ''' List Glue Database Tables filtered by RegEx (server-side by Expression, derived from a literal RegEx by default) '''
+    if expression is None:
+        expression = glue_name_expression( regex )
+
+    def load_tables():
+        paginate_parms = { 'DatabaseName' : glue_database_name }
+        if expression > '':
+            paginate_parms['Expression'] = expression
+        table_list = []
+        for page in glue.get_paginator('get_tables').paginate( **paginate_parms ):
+            table_list.extend( page['TableList'] )
+        for table in table_list:
+            glue_cache.put( ( 'Table', glue_database_name, table['Name'] ), table )
+        return table_list
+
+    table_list = glue_cache.get( ( 'Tables', glue_database_name, expression ), load_tables )
 
-    #os.environ['AWS_DEFAULT_REGION'] = 'us-gov-west-1'
     regex = re.compile( regex )
-
-    # get list of Glue tables
-    glue = boto3.client('glue')
-    response = glue.get_tables(
-        #CatalogId='string',
-        DatabaseName=glue_database_name,
-        #Expression='string',
-        #NextToken='string',
-        #MaxResults=123
-    )
-    table_list = response['TableList']
-    while 'NextToken' in response:
-        response = glue.get_tables(
-            DatabaseName=glue_database_name,
-            NextToken = response['NextToken']
-        )
-        table_list.extend(response['TableList'])
-
     tables = []
     table_names = []
     for table in table_list:
-        #print(table)
         if regex.search( table['Name'] ):
-            #print('{}\t{}\t{}'.format(table['Name'], table['StorageDescriptor']['Location'], ''))
-            #print('{}\t{}\t{}'.format(table['Name'], '', ''))
             tables.append( table )
             table_names.append( table['Name'] )
 
@@ -60,7 +118,7 @@ def list_glue_tables( glue_database_name, regex = '.'):
 def crup_glue_table( glue_database_name, glue_table_name, glue_sd_columns ):
     ''' CReate or UPdate Glue Table '''
 
-    glue_db = glue.get_database( Name = glue_database_name )
+    glue_db = get_glue_database( glue_database_name )
 
     # convert to Glue-compatible data types
     tds_to_glue = {
@@ -77,39 +135,50 @@ def crup_glue_table( glue_database_name, glue_table_name, glue_sd_columns ):
 
     glue_table_input['TableInput']['Name'] = glue_table_name
     glue_table_input['TableInput']['StorageDescriptor']['Columns'] = glue_sd_columns
-    if 'LocationUri' in glue_db['Database'].keys():
-        glue_table_input['TableInput']['StorageDescriptor']['Location'] = glue_db['Database']['LocationUri'] + '{}/'.format(glue_table_name.upper())
-
-    try:
-        response = glue.create_table (
-            DatabaseName = glue_database_name,
-            TableInput = glue_table_input['TableInput']
-        )
-        status = 'created'
-    except glue.exceptions.AlreadyExistsException:
+    if 'LocationUri' in glue_db.keys():
+        glue_table_input['TableInput']['StorageDescriptor']['Location'] = glue_db['LocationUri'] + '{}/'.format(glue_table_name.upper())
+
+    response = None
+    if get_glue_table( glue_database_name, glue_table_name ) is None:
+        try:
+            response = glue.create_table (
+                DatabaseName = glue_database_name,
+                TableInput = glue_table_input['TableInput']
+            )
+            status = 'created'
+        except glue.exceptions.AlreadyExistsException:
+            pass    # created since it was cached
+    if response is None:
         response = glue.update_table (
             DatabaseName = glue_database_name,
             TableInput = glue_table_input['TableInput']
         )
         status = 'updated'
+    glue_cache.invalidate( 'Table', glue_database_name, glue_table_name.lower() )
+    glue_cache.invalidate( 'Tables', glue_database_name )
 
     print(f"Glue Table {glue_table_name} {status} in Database {glue_database_name}" )
 
     return response
 
 def crup_glue_partition( glue_database_name, glue_table_name, partition_keys ):
+    ''' CReate or UPdate a Glue Table Partition (table from the catalog cache) '''
+    glue_table = get_glue_table( glue_database_name, glue_table_name )
+    if glue_table is None:
+        raise Exception(f"Glue Table '{glue_table_name}' not found in Database '{glue_database_name}'")
     glue_partition_sd = glue_table['StorageDescriptor'].copy()
-    glue_partition_sd['Location'] += partition_key + '/'
+    glue_partition_sd['Location'] += '/'.join( partition_keys ) + '/'
+    partition_input = {
+        'Values' : partition_keys,
+        'StorageDescriptor' : glue_partition_sd,
+        'Parameters' : glue_table.get('Parameters', {})
+    }
 
     try:
         response = glue.create_partition(
             DatabaseName = glue_database_name,
             TableName = glue_table['Name'] ,
-            PartitionInput = {
-                'Values' : [ partition_key ],
-                'StorageDescriptor' : glue_partition_sd,
-                'Parameters' : glue_table['Parameters']
-            }
+            PartitionInput = partition_input
         )
         status = 'Created'
 
@@ -119,17 +188,14 @@ def crup_glue_partition( glue_database_name, glue_table_name, partition_keys ):
             DatabaseName = glue_database_name,
             TableName = glue_table['Name'] ,
             PartitionValueList = partition_keys ,
-            PartitionInput = {
-                'Values' : [ partition_key ],
-                'StorageDescriptor' : glue_partition_sd,
-                'Parameters' : glue_table['Parameters']
-            }
+            PartitionInput = partition_input
         )
         status = 'Updated'
 
     except Exception as e:
         status = e
 
+    glue_cache.invalidate( 'Partitions', glue_database_name, glue_table['Name'] )
     print(f"Partitions {status} for Glue Table '{glue_table_name}' in Database '{glue_database_name}: {partition_keys}'" )
 
 
@@ -157,26 +223,46 @@ def crup_glue_date_partitions( glue_database_name, glue_tables_list, partkey_for
             partition_key = beg_date.strftime(partkey_format)
         beg_date += delta
 
-def list_glue_partitions( glue_database_name, glue_table_name, regex = '.', mode='List' ):
-    ''' List (Delete) a set of Glue Partions filtered by RegEx  '''
+def glue_partition_expression( glue_table, regex ):
+    ''' GetPartitions Expression (LIKE on the first partition key) for a literal RegEx, optionally ^ $ anchored -- else '' (no server-side filter) '''
+    match = re.fullmatch( r'(\^?)((?:[A-Za-z0-9_\-]|\\\.)+)(\$?)', regex )
+    partition_keys = glue_table.get('PartitionKeys', [])
+    if match is None or len(partition_keys) == 0 or partition_keys[0]['Type'] != 'string':
+        return ''
+    anchor_beg, literal, anchor_end = match.groups()
+    return "{} LIKE '{}{}{}'".format( partition_keys[0]['Name'], '' if anchor_beg else '%', literal.replace('\\.', '.'), '' if anchor_end else '%' )
+
+def get_glue_partitions( glue_database_name, glue_table_name, expression = '', segments = GLUE_PARTITION_SEGMENTS ):
+    ''' Glue Table Partitions matching Expression (cached) -- paged in parallel Segments '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def load_segment( segment ):
+        paginate_parms = { 'DatabaseName' : glue_database_name, 'TableName' : glue_table_name }
+        if expression > '':
+            paginate_parms['Expression'] = expression
+        if segments > 1:
+            paginate_parms['Segment'] = { 'SegmentNumber' : segment, 'TotalSegments' : segments }
+        partition_list = []
+        for page in glue.get_paginator('get_partitions').paginate( **paginate_parms ):
+            partition_list.extend( page['Partitions'] )
+        return partition_list
+
+    def load_partitions():
+        with ThreadPoolExecutor( max_workers = segments ) as executor:
+            return [ partition for partition_list in executor.map( load_segment, range( segments ) ) for partition in partition_list ]
+
+    segments = max( 1, min( segments, GLUE_PARTITION_SEGMENTS ) )
+    return glue_cache.get( ( 'Partitions', glue_database_name, glue_table_name.lower(), expression ), load_partitions )
+
+def list_glue_partitions( glue_database_name, glue_table_name, regex = '.', mode='List', expression = None ):
+    ''' List (Delete) a set of Glue Partions filtered by RegEx (server-side by Expression, derived from a literal RegEx by default) '''
+    if expression is None:
+        glue_table = get_glue_table( glue_database_name, glue_table_name )
+        expression = '' if glue_table is None else glue_partition_expression( glue_table, regex )
+
+    partition_list = get_glue_partitions( glue_database_name, glue_table_name, expression )
     regex = re.compile( regex )
 
-    response = glue.get_partitions(
-        DatabaseName = glue_database_name,
-        TableName = glue_table_name
-    )
-    partition_list = response['Partitions']
-    #print (response)
-    #break
-    while 'NextToken' in response:
-        print(response['NextToken'])
-        response = glue.get_partitions(
-            DatabaseName = glue_database_name,
-            TableName = glue_table_name ,
-            NextToken = response['NextToken']
-        )
-        partition_list.extend(response['Partitions'])
-
     partitions = []
     partition_names = []
     print(f"{mode} Partitions for Glue Database {glue_database_name}")
@@ -186,15 +272,17 @@ def list_glue_partitions( glue_database_name, glue_table_name, regex = '.', mode
             print( partition_name, partition['StorageDescriptor']['Location'] )
             partitions.append( partition )
             partition_names.append( partition_name )
-            if mode == 'Delete':
-                #continue
-                #print('Deleting ...')
-                response = glue.delete_partition(
-                    DatabaseName = glue_database_name,
-                    TableName = glue_table_name,
-                    PartitionValues = partition['Values']
-                )
-                #print(response)
+
+    if mode == 'Delete':
+        for i in range( 0, len(partitions), GLUE_DELETE_PARTITIONS ):
+            response = glue.batch_delete_partition(
+                DatabaseName = glue_database_name,
+                TableName = glue_table_name,
+                PartitionsToDelete = [ { 'Values' : partition['Values'] } for partition in partitions[i:i+GLUE_DELETE_PARTITIONS] ]
+            )
+            for error in response.get('Errors', []):
+                print( error['PartitionValues'], error['ErrorDetail'] )
+        glue_cache.invalidate( 'Partitions', glue_database_name, glue_table_name.lower() )
 
     return partitions, partition_names
 
@@ -202,9 +290,9 @@ def export_glue_to_raml( glue_database_name, glue_table_name, output_path='' ):
     ''' Export Glue table metadata to Mule-compatible RAMLv1.0 '''
     import yaml
 
-    tables, table_names = list_glue_tables( glue_database_name, glue_table_name )
-
-    table = tables[0]
+    table = get_glue_table( glue_database_name, glue_table_name )
+    if table is None:
+        raise Exception(f"Glue Table '{glue_table_name}' not found in Database '{glue_database_name}'")
 
     dt_properties = {}
     for sd_column in table['StorageDescriptor']['Columns']:
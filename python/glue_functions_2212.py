@@ -133,6 +133,80 @@ def crup_glue_partition( glue_database_name, glue_table_name, partition_keys ):
 
     return glue_partition_sd
 
+GLUE_BATCH_PARTITIONS = 100    # BatchCreatePartition & BatchUpdatePartition limit per request
+GLUE_RETRY_CODES = [ 'ThrottlingException', 'ConcurrentModificationException', 'InternalServiceException', 'OperationTimeoutException' ]
+
+def glue_batch_call( glue_method, entries, entry_values, max_attempts=8, **kwargs ):
+    ''' Call a Glue batch partition method, retrying (with backoff) the call or just its throttled entries -- returns other Errors '''
+    import time
+    import botocore
+
+    errors = []
+    for attempt in range( max_attempts ):
+        try:
+            response = glue_method( **kwargs, **entries )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in GLUE_RETRY_CODES or attempt == max_attempts - 1:
+                raise
+            time.sleep( min( 2 ** attempt * 0.2, 10 ) )
+            continue
+
+        retry_values = []
+        for error in response.get('Errors', []):
+            if error['ErrorDetail']['ErrorCode'] in GLUE_RETRY_CODES and attempt < max_attempts - 1:
+                retry_values.append( error['PartitionValues'] )
+            else:
+                errors.append( error )
+        if len(retry_values) == 0:
+            break
+        # resubmit only the throttled entries
+        entries = { key : [ entry for entry in entry_list if entry_values( entry ) in retry_values ] for key, entry_list in entries.items() }
+        time.sleep( min( 2 ** attempt * 0.2, 10 ) )
+
+    return errors
+
+def crup_glue_partitions( glue_database_name, glue_table_name, partition_values_list, partition_folders=None, glue_table=None ):
+    ''' CReate or UPdate many Glue Partitions -- one get_table, BatchCreatePartition by 100s, BatchUpdatePartition for those that exist '''
+    if glue_table is None:
+        glue_table = glue_client.get_table(
+            DatabaseName = glue_database_name,
+            Name = glue_table_name
+        )
+    if partition_folders is None:
+        partition_folders = [ partition_values[0] for partition_values in partition_values_list ]
+
+    partition_inputs = []
+    for partition_values, partition_folder in zip( partition_values_list, partition_folders ):
+        glue_partition_sd = glue_table['Table']['StorageDescriptor'].copy()
+        glue_partition_sd['Location'] = f"{glue_partition_sd['Location']}/{partition_folder}"
+        partition_inputs.append( {
+            'Values' : partition_values,
+            'StorageDescriptor' : glue_partition_sd,
+            'Parameters' : glue_table['Table']['Parameters']
+        } )
+
+    existing_inputs = []
+    for i in range( 0, len(partition_inputs), GLUE_BATCH_PARTITIONS ):
+        chunk = partition_inputs[i:i+GLUE_BATCH_PARTITIONS]
+        errors = glue_batch_call( glue_client.batch_create_partition, { 'PartitionInputList' : chunk }, lambda entry: entry['Values'],
+                                  DatabaseName = glue_database_name, TableName = glue_table_name )
+        existing_values = [ error['PartitionValues'] for error in errors if error['ErrorDetail']['ErrorCode'] == 'AlreadyExistsException' ]
+        other_errors = [ error for error in errors if error['PartitionValues'] not in existing_values ]
+        if len(other_errors) > 0:
+            raise Exception(f"BatchCreatePartition failed for Glue Table '{glue_table_name}': {other_errors}")
+        existing_inputs.extend( [ partition_input for partition_input in chunk if partition_input['Values'] in existing_values ] )
+
+    for i in range( 0, len(existing_inputs), GLUE_BATCH_PARTITIONS ):
+        entries = [ { 'PartitionValueList' : partition_input['Values'], 'PartitionInput' : partition_input } for partition_input in existing_inputs[i:i+GLUE_BATCH_PARTITIONS] ]
+        errors = glue_batch_call( glue_client.batch_update_partition, { 'Entries' : entries }, lambda entry: entry['PartitionValueList'],
+                                  DatabaseName = glue_database_name, TableName = glue_table_name )
+        if len(errors) > 0:
+            raise Exception(f"BatchUpdatePartition failed for Glue Table '{glue_table_name}': {errors}")
+
+    print(f"Partitions Created {len(partition_inputs) - len(existing_inputs)}, Updated {len(existing_inputs)} for Glue Table '{glue_table_name}' in Database '{glue_database_name}'" )
+
+    return partition_inputs
+
 def crup_glue_date_partitions( glue_database_name, glue_tables_list, partkey_format='D%y%m%d.Full', beg_date='', end_date='' ):
     ''' CReate or UPdate Glue Table(s) Set of Date Partitions ''' 
     # deprecated 2212
@@ -151,16 +225,18 @@ def crup_glue_date_partitions( glue_database_name, glue_tables_list, partkey_for
 
     if glue_tables_list == []:    # default all tables in database
         glue_tables_list, table_names = list_glue_tables( glue_database_name )
+    else:
+        table_names = [ glue_table['Name'] if isinstance( glue_table, dict ) else glue_table for glue_table in glue_tables_list ]
 
+    partition_keys = []
     while beg_date <= end_date:
-        #for glue_table in glue_tables_list:
-        for glue_table_name in table_names:
-            partition_key = beg_date.strftime(partkey_format)
-
-            crup_glue_partition( glue_database_name, glue_table_name, [ partition_key ] )
-
+        partition_keys.append( [ beg_date.strftime(partkey_format) ] )
         beg_date += delta
 
+    # every date at once per table -- batched, instead of a get_table & create/update per partition
+    for glue_table_name in table_names:
+        crup_glue_partitions( glue_database_name, glue_table_name, partition_keys )
+
 def list_glue_partitions( glue_database_name, glue_table_name, regex = '.', mode='List' ):
     ''' List (Delete) a set of Glue Partions filtered by RegEx  '''
     regex = re.compile( regex )
@@ -0,0 +1,14 @@
+"""
+## conftest.py -- Import paths of the Lambda functions, the Lambda_Runtime Layer & the Glue job, as their runtimes see them
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+for path in [ 'lambda/Process_Initiator', 'layer/Lambda_Runtime/python', 'glue', 'benchmark' ]:
+    if f"{REPO_ROOT}/{path}" not in sys.path:
+        sys.path.append( f"{REPO_ROOT}/{path}" )
+
+os.environ.setdefault( 'AWS_DEFAULT_REGION', 'us-east-1' )
@@ -0,0 +1,81 @@
+"""
+## test_admission_queue.py -- Process_Initiator's drain of the admission queue, when a queued execution fails to start
+#  (a throttled start stays queued for the next drain, up to 'MaxStartAttempts'; any other error dequeues it & fails its Batch)
+"""
+
+import botocore.exceptions
+import boto3
+import pytest
+from moto import mock_aws
+
+import batch_functions as bat
+from admission_functions import queue_entry, DEFAULT_MAX_START_ATTEMPTS
+
+STEP_ARN = 'arn:aws:states:us-east-1:123456789012:stateMachine:pipeline-Extract_Zip_to_Parquet'
+
+def client_error( code, status=400 ):
+    return botocore.exceptions.ClientError( { 'Error' : { 'Code' : code, 'Message' : code }, 'ResponseMetadata' : { 'HTTPStatusCode' : status } }, 'StartExecution' )
+
+@pytest.fixture( params=[ 'file', 'dynamodb' ] )
+def queued( request, tmp_path, monkeypatch ):
+    ''' Three queued executions, each with its Batch claimed -- (lambda_function, admission url, batch ledger, start errors by exec name) '''
+    import lambda_function
+    with mock_aws():
+        if request.param == 'dynamodb':
+            boto3.client('dynamodb').create_table( TableName='pipeline-AdmissionQueue', BillingMode='PAY_PER_REQUEST',
+                KeySchema=[ { 'AttributeName' : 'QueueName', 'KeyType' : 'HASH' }, { 'AttributeName' : 'QueueKey', 'KeyType' : 'RANGE' } ],
+                AttributeDefinitions=[ { 'AttributeName' : 'QueueName', 'AttributeType' : 'S' }, { 'AttributeName' : 'QueueKey', 'AttributeType' : 'S' } ] )
+            admission_url = 'dynamodb://pipeline-AdmissionQueue'
+        else:
+            admission_url = f"file://{tmp_path}/admission_queue.json"
+        ledger_url = f"file://{tmp_path}/batch_ledger.json"
+        batch_ledger = bat.open_batch_ledger( ledger_url )
+        admission_queue = lambda_function.open_admission_queue( admission_url )
+        for exec_name in [ '221212-180001-A.zip', '221212-180002-B.zip', '221212-180003-C.zip' ]:
+            batch_id = exec_name[len('221212-180001-'):]
+            batch_ledger.start_batch( batch_id, exec_name, [ batch_id ], 'v1' )
+            response = { 'source' : 'aws.s3', 'process_parms' : { 'BatchId' : batch_id, 'BatchLedger' : ledger_url } }
+            admission_queue.enqueue( STEP_ARN, 5, queue_entry( response, STEP_ARN, exec_name, '2022-12-12T18:00:00Z' ) )
+
+        start_errors = {}
+        def start_execution( response, step_arn, exec_name, metrics, event_time='', close_on_error=True ):
+            if exec_name in start_errors.keys():
+                raise start_errors[exec_name]
+            return response
+        monkeypatch.setattr( lambda_function, 'start_execution', start_execution )
+        monkeypatch.setattr( lambda_function, 'running_executions', lambda step_arn, limit, exclude_exec_name='': 0 )
+        yield lambda_function, admission_url, batch_ledger, start_errors
+
+def queued_names( admission_url ):
+    from admission_functions import open_admission_queue
+    return [ entry['ExecName'] for key, entry in open_admission_queue( admission_url ).peek( STEP_ARN, 10 ) ]
+
+@pytest.mark.parametrize( 'error', [ client_error( 'StateMachineDoesNotExist' ), client_error( 'InvalidExecutionInput' ), client_error( 'ValidationException' ) ] )
+def test_permanent_error_is_dequeued_and_fails_its_batch( queued, error ):
+    lambda_function, admission_url, batch_ledger, start_errors = queued
+    start_errors['221212-180001-A.zip'] = error
+    started = lambda_function.drain_queue( admission_url, STEP_ARN, 3 )
+    assert started == [ '221212-180002-B.zip', '221212-180003-C.zip' ]
+    assert queued_names( admission_url ) == []
+    assert batch_ledger.get_batch( 'A.zip' )['BatchStatus'] == bat.BATCH_FAILED
+
+def test_throttled_start_stays_queued_up_to_max_attempts( queued ):
+    lambda_function, admission_url, batch_ledger, start_errors = queued
+    start_errors['221212-180001-A.zip'] = client_error( 'ThrottlingException' )
+    assert lambda_function.drain_queue( admission_url, STEP_ARN, 3 ) == [ '221212-180002-B.zip', '221212-180003-C.zip' ]
+    for attempt in range( 2, DEFAULT_MAX_START_ATTEMPTS ):
+        assert lambda_function.drain_queue( admission_url, STEP_ARN, 3 ) == []
+        assert queued_names( admission_url ) == [ '221212-180001-A.zip' ]
+        assert batch_ledger.get_batch( 'A.zip' )['BatchStatus'] == bat.BATCH_RUNNING
+    # the last attempt dequeues it
+    assert lambda_function.drain_queue( admission_url, STEP_ARN, 3 ) == []
+    assert queued_names( admission_url ) == []
+    assert batch_ledger.get_batch( 'A.zip' )['BatchStatus'] == bat.BATCH_FAILED
+
+def test_transient_start_then_success( queued ):
+    lambda_function, admission_url, batch_ledger, start_errors = queued
+    start_errors['221212-180001-A.zip'] = client_error( 'InternalServerError', 500 )
+    lambda_function.drain_queue( admission_url, STEP_ARN, 3 )
+    del start_errors['221212-180001-A.zip']
+    assert lambda_function.drain_queue( admission_url, STEP_ARN, 3 ) == [ '221212-180001-A.zip' ]
+    assert queued_names( admission_url ) == []
@@ -0,0 +1,61 @@
+"""
+## test_batch_ledger.py -- the Batch ledger's claim lease & object status, alike in DynamoDB (moto) and a local file
+"""
+
+import datetime
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import batch_functions as bat
+
+STEP_NAME = 'pipeline-Extract_Zip_to_Parquet'
+
+@pytest.fixture( params=[ 'file', 'dynamodb' ] )
+def batch_ledger( request, tmp_path ):
+    with mock_aws():
+        if request.param == 'dynamodb':
+            boto3.client('dynamodb').create_table( TableName='pipeline-BatchLedger', BillingMode='PAY_PER_REQUEST',
+                KeySchema=[ { 'AttributeName' : 'BatchId', 'KeyType' : 'HASH' } ],
+                AttributeDefinitions=[ { 'AttributeName' : 'BatchId', 'AttributeType' : 'S' } ] )
+            yield bat.open_batch_ledger( 'dynamodb://pipeline-BatchLedger' )
+        else:
+            yield bat.open_batch_ledger( f"file://{tmp_path}/batch_ledger.json" )
+
+def claimed_hours_ago( monkeypatch, hours ):
+    ''' Run start_batch as if at a time hours ago '''
+    claimed_at = ( datetime.datetime.now() - datetime.timedelta( hours=hours ) ).isoformat()
+    monkeypatch.setattr( bat, 'now_iso', lambda: claimed_at )
+    return claimed_at
+
+def test_object_status_does_not_renew_the_claim( batch_ledger, monkeypatch ):
+    ''' A claim whose execution never started is stale past the lease, however recently an object status was set '''
+    step_arn = boto3.client('stepfunctions').create_state_machine( name=STEP_NAME, roleArn='arn:aws:iam::123456789012:role/pipeline-states',
+        definition='{ "StartAt" : "Done", "States" : { "Done" : { "Type" : "Succeed" } } }' )['stateMachineArn']
+    with monkeypatch.context() as clock:
+        claimed_at = claimed_hours_ago( clock, 2 )
+        batch_ledger.start_batch( 'A.zip', '221212-180001-A.zip', [ 'FSDATA/Inbound/A.zip' ], 'v1' )
+    batch_ledger.set_object_status( 'A.zip', 'FSDATA/Inbound/A.zip', bat.OBJECT_EXTRACTED, { 'GlueTableNames' : [] } )
+    batch = batch_ledger.get_batch( 'A.zip' )
+    assert batch['ClaimedAt'] == claimed_at
+    assert batch['UpdatedAt'] > claimed_at
+
+    assert not bat.reconcile_batch( batch_ledger, 'A.zip', step_arn, lease_seconds=3 * 3600 )
+    assert bat.reconcile_batch( batch_ledger, 'A.zip', step_arn, lease_seconds=3600 )
+    assert batch_ledger.get_batch( 'A.zip' )['BatchStatus'] == bat.BATCH_FAILED
+
+def test_rerun_of_failed_batch_renews_the_claim( batch_ledger, monkeypatch ):
+    with monkeypatch.context() as clock:
+        claimed_hours_ago( clock, 2 )
+        batch_ledger.start_batch( 'A.zip', '221212-180001-A.zip', [ 'FSDATA/Inbound/A.zip' ], 'v1' )
+    batch_ledger.close_batch( 'A.zip', '221212-180001-A.zip', bat.BATCH_FAILED )
+    rerun = batch_ledger.start_batch( 'A.zip', '221212-200001-A.zip', [ 'FSDATA/Inbound/A.zip' ], 'v1' )
+    assert rerun['StartCount'] == 2
+    assert rerun['ClaimedAt'] > ( datetime.datetime.now() - datetime.timedelta( minutes=1 ) ).isoformat()
+
+def test_object_status_of_unknown_batch( batch_ledger ):
+    ''' Either ledger raises the same error -- never a KeyError from one and a ConditionalCheckFailed from the other '''
+    with pytest.raises( Exception, match="Batch 'A.zip' is not in BatchLedger" ) as raised:
+        batch_ledger.set_object_status( 'A.zip', 'FSDATA/Inbound/A.zip', bat.OBJECT_EXTRACTED )
+    assert type( raised.value ) is Exception
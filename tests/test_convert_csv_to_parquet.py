@@ -0,0 +1,104 @@
+"""
+## test_convert_csv_to_parquet.py -- CsvToParquet(...).run() on local[*] Spark, through benchmark/glue_local_benchmark.py's seams
+#  (LocalStorage for the buckets, StubCatalog for the Glue Catalog) -- skipped without pyspark & a Java runtime
+"""
+
+import os
+import shutil
+
+import pytest
+
+from conftest import REPO_ROOT
+
+pytest.importorskip( 'pyspark' )
+if shutil.which( 'java' ) is None and 'JAVA_HOME' not in os.environ.keys():
+    pytest.skip( 'local Spark needs a Java runtime', allow_module_level=True )
+
+import glue_local_benchmark as bench
+
+DATASETS = [ 'top_federal', 'top_state' ]
+
+@pytest.fixture( scope='module' )
+def spark():
+    from pyspark.sql import SparkSession
+    spark = SparkSession.builder.master( 'local[2]' ).appName( 'test_convert_csv_to_parquet' ) \
+        .config( 'spark.scheduler.mode', 'FAIR' ).config( 'spark.ui.enabled', 'false' ).getOrCreate()
+    spark.sparkContext.setLogLevel( 'ERROR' )
+    yield spark
+    spark.stop()
+
+@pytest.fixture( scope='module' )
+def landed( tmp_path_factory ):
+    ''' A batch of synthetic CSVs -- 2 tables x 2 partition folders x 2 files '''
+    cwd = os.getcwd()
+    os.chdir( REPO_ROOT )     # fiscaldata_generator reads data/metadata
+    try:
+        storage = bench.LocalStorage( str( tmp_path_factory.mktemp( 'buckets' ) ) )
+        s3_urls, partition_folders, rows, landed_bytes = bench.land_batch( storage, DATASETS, 2, 2, 0.25, 20 )
+    finally:
+        os.chdir( cwd )
+    return storage, s3_urls, partition_folders, rows, landed_bytes
+
+def run( spark, landed, process_parms, scenario='test' ):
+    storage, s3_urls, partition_folders, rows, landed_bytes = landed
+    return bench.run_scenario( spark, storage, scenario, process_parms, DATASETS, s3_urls, partition_folders, rows, landed_bytes, quiet=False )
+
+def test_reader_modes_write_the_same_output( spark, landed ):
+    ''' PerPartition & SinglePass, Native & cast readers -- every row, in the same '{table}/{partition_folder}' folders '''
+    rows, partition_folders = landed[3], landed[2]
+    results = [ run( spark, landed, process_parms, scenario ) for scenario, process_parms in bench.READER_MODES.items() ]
+    for result in results:
+        assert result['WrittenRows'] == rows, result['Scenario']
+        assert result['Partitions'] == len(DATASETS) * len(partition_folders), result['Scenario']
+        assert sorted( result['Folders'].keys() ) == sorted( f"{dataset}/{partition_folder}" for dataset in DATASETS for partition_folder in partition_folders )
+    assert bench.compare_outputs( results ) == []
+
+@pytest.mark.parametrize( 'writer', [ 'TargetFile', 'SortedBloom' ] )
+@pytest.mark.parametrize( 'reader', [ 'PerPartition-Native', 'SinglePass-Native' ] )
+def test_writer_modes( spark, landed, reader, writer ):
+    ''' File sizing, sort keys & bloom filters change the files, not the rows '''
+    baseline = run( spark, landed, bench.READER_MODES[reader], 'baseline' )
+    result = run( spark, landed, dict( bench.READER_MODES[reader], **bench.WRITER_MODES[writer] ), f"{reader}/{writer}" )
+    assert result['WrittenRows'] == landed[3]
+    assert bench.compare_outputs( [ baseline, result ] ) == []
+    if writer == 'TargetFile':
+        # ~0.25 MB of CSV per partition folder, 16 MB target files -- one file per folder
+        assert result['OutputFiles']['Files'] == len(result['Folders'])
+
+def test_table_concurrency( spark, landed ):
+    ''' Tables converted from concurrent driver threads write what one after another does '''
+    results = [ run( spark, landed, dict( bench.READER_MODES['PerPartition-Native'], GlueTableConcurrency=concurrency ), f"concurrency {concurrency}" ) for concurrency in [ 1, 2 ] ]
+    assert results[1]['WrittenRows'] == landed[3]
+    assert bench.compare_outputs( results ) == []
+
+@pytest.mark.parametrize( 'read_mode', [ 'PerPartition', 'SinglePass' ] )
+def test_incremental_manifest( spark, landed, read_mode ):
+    ''' A re-run of the same batch converts nothing new; Replace rewrites the partitions it touches '''
+    from Convert_CSV_To_Parquet import CsvToParquet
+    storage, s3_urls, partition_folders, rows, landed_bytes = landed
+    shutil.rmtree( f"{storage.root}/{bench.S3_OUTPUT_BUCKET}", ignore_errors=True )
+    glue_client = bench.stub_catalog( storage, DATASETS )
+    batch_parms = {
+        "GlueReadMode" : read_mode,
+        "GlueCsvReader" : "Native",
+        "GlueIncremental" : "Manifest",
+        "GlueDatabaseName" : bench.GLUE_DATABASE_NAME,
+        "S3LandingPadBucket" : bench.S3_INPUT_BUCKET,
+        "S3LandingPadInput" : bench.S3_INPUT_FOLDER,
+        "S3DatalakeBucket" : bench.S3_OUTPUT_BUCKET,
+        "S3DatalakeOutput" : bench.S3_OUTPUT_FOLDER,
+        "ZipExtracted" : { "GlueTableNames" : DATASETS, "PartitionFolders" : partition_folders, "S3ExtractedUrls" : s3_urls }
+    }
+    first = CsvToParquet( dict( batch_parms ), spark, glue_client, storage ).run()
+    assert len(first['OutputFiles']) > 0
+    assert sum( folder['Rows'] for folder in bench.written_folders( spark, storage, DATASETS ).values() ) == rows
+
+    second = CsvToParquet( dict( batch_parms ), spark, glue_client, storage ).run()
+    assert second['OutputFiles'] == []
+    assert sum( folder['Rows'] for folder in bench.written_folders( spark, storage, DATASETS ).values() ) == rows
+
+    # a changed object -- Replace rewrites its partition from all of its landed objects, so no row is written twice
+    os.utime( s3_urls[0][len('file://'):], ( 0, 0 ) )
+    third = CsvToParquet( dict( batch_parms, IncrementalWrite='Replace' ), spark, glue_client, storage ).run()
+    assert len(third['OutputFiles']) == 1
+    assert sum( folder['Rows'] for folder in bench.written_folders( spark, storage, DATASETS ).values() ) == rows
@@ -0,0 +1,140 @@
+"""
+## test_event_transformer.py -- S3 'Object Created' events through the EventBridge input transformers to Process_Initiator
+#  (the rule target's output, not a hand-made event, is what Process_Initiator claims its Batch with)
+"""
+
+import re
+import json
+import types
+import datetime
+
+import yaml
+import boto3
+import pytest
+from moto import mock_aws
+
+from conftest import REPO_ROOT
+
+# as code_sync substitutes them when it deploys the templates (moto's default account)
+DEPLOYED = { '$Partition' : 'aws', '$Region' : 'us-east-1', '$AccountId' : '123456789012', '$Stack' : 'pipeline', '$SysAbbrev' : 'FSDATA' }
+
+# an EventBridge 'Object Created' event, as S3 sends it for a versioned bucket
+S3_EVENT = {
+    "version": "0",
+    "id": "17793124-05d4-b198-2fde-7ededc63b103",
+    "detail-type": "Object Created",
+    "source": "aws.s3",
+    "account": "123456789012",
+    "time": "2022-12-12T18:43:48Z",
+    "region": "us-east-1",
+    "resources": [ "arn:aws:s3:::pipeline-landing-pad" ],
+    "detail": {
+        "version": "0",
+        "bucket": { "name": "pipeline-landing-pad" },
+        "object": {
+            "key": "FSDATA/Inbound/FDMD.FSDATA.D221212.zip",
+            "size": 5,
+            "etag": "b1946ac92492d2347c6235b4d2611184",
+            "version-id": "IYV3p45BT0ac8hjHg1houSdS1a.Mro8e",
+            "sequencer": "00617F08299329D189"
+        },
+        "request-id": "N4N7GDK58NMKJ12R",
+        "requester": "123456789012",
+        "source-ip-address": "1.2.3.4",
+        "reason": "PutObject"
+    }
+}
+
+class CfnLoader( yaml.SafeLoader ):
+    ''' YAML loader that reads CloudFormation intrinsic functions ('!If', '!Ref', ...) as plain values '''
+
+def construct_intrinsic( loader, tag_suffix, node ):
+    if isinstance( node, yaml.SequenceNode ):
+        return loader.construct_sequence( node, deep=True )
+    if isinstance( node, yaml.MappingNode ):
+        return loader.construct_mapping( node, deep=True )
+    return loader.construct_scalar( node )
+
+CfnLoader.add_multi_constructor( '!', construct_intrinsic )
+
+def json_path( event, path ):
+    ''' Value of a '$.a.b' path in the event -- '' when it is not there '''
+    value = event
+    for name in path[len('$.'):].split('.'):
+        if not isinstance( value, dict ) or name not in value.keys():
+            return ''
+        value = value[name]
+    return value
+
+def transform( input_transformer, event ):
+    ''' The target input EventBridge sends for event -- each '<name>' in the InputTemplate replaced by its InputPathsMap value '''
+    values = { name : json_path( event, path ) for name, path in input_transformer['InputPathsMap'].items() }
+    input_template = input_transformer['InputTemplate']
+    for name, value in DEPLOYED.items():
+        input_template = input_template.replace( name, value )
+    return json.loads( re.sub( r"<([^<>]+)>", lambda match: str( values[match.group(1)] ), input_template ) )
+
+def cfn_input_transformers():
+    with open( f"{REPO_ROOT}/ci-cd/cfn_template.yaml" ) as f:
+        resources = yaml.load( f, Loader=CfnLoader )['Resources']
+    input_transformer = resources['EventRuleFDMDxFISCALDATA']['Properties']['Targets'][0]['InputTransformer']
+    # InputTemplate: !If [ RouteByFileName, {template}, {template} ]
+    return [ { 'InputPathsMap' : input_transformer['InputPathsMap'], 'InputTemplate' : template } for template in input_transformer['InputTemplate'][1:] ]
+
+def targets_input_transformers():
+    with open( f"{REPO_ROOT}/eventbridge/FDMD.FSDATA/targets.json" ) as f:
+        return [ target['InputTransformer'] for target in json.load( f ) ]
+
+INPUT_TRANSFORMERS = cfn_input_transformers() + targets_input_transformers()
+
+class SteppingClock( datetime.datetime ):
+    ''' datetime whose now() moves a minute per call -- each start gets its own '{now}-{batch_id}' execution name '''
+    calls = 0
+
+    @classmethod
+    def now( cls, tz=None ):
+        cls.calls += 1
+        return datetime.datetime( 2022, 12, 12, 18, 0 ) + datetime.timedelta( minutes=cls.calls )
+
+def redelivered( **s3_object ):
+    event = json.loads( json.dumps( S3_EVENT ) )
+    event['detail']['object'].update( s3_object )
+    return event
+
+@pytest.mark.parametrize( 'input_transformer', INPUT_TRANSFORMERS )
+def test_target_input_has_object_version( input_transformer ):
+    from queue_functions import object_version
+    target_input = transform( input_transformer, S3_EVENT )
+    assert target_input['detail']['object']['key'] == S3_EVENT['detail']['object']['key']
+    assert object_version( target_input ) == S3_EVENT['detail']['object']['version-id']
+
+@pytest.mark.parametrize( 'input_transformer', INPUT_TRANSFORMERS )
+def test_unversioned_bucket_falls_back_to_etag( input_transformer ):
+    from queue_functions import object_version
+    event = redelivered()
+    del event['detail']['object']['version-id']
+    assert object_version( transform( input_transformer, event ) ) == S3_EVENT['detail']['object']['etag']
+
+@pytest.mark.parametrize( 'input_transformer', INPUT_TRANSFORMERS )
+def test_redelivery_of_succeeded_batch( input_transformer, tmp_path, monkeypatch ):
+    ''' An identical re-delivery of a SUCCEEDED batch is a duplicate; a corrected one (new version) starts it again '''
+    import lambda_function
+    monkeypatch.setenv( 'BatchLedger', f"file://{tmp_path}/batch_ledger.json" )
+    monkeypatch.setattr( lambda_function.datetime, 'datetime', SteppingClock )
+    context = types.SimpleNamespace( function_name='pipeline-Process_Initiator' )
+    with mock_aws():
+        sfn_client = boto3.client( 'stepfunctions' )
+        step_arn = sfn_client.create_state_machine( name='pipeline-Extract_Zip_to_Parquet', roleArn='arn:aws:iam::123456789012:role/pipeline-states',
+            definition=json.dumps( { "StartAt" : "Done", "States" : { "Done" : { "Type" : "Succeed" } } } ) )['stateMachineArn']
+        monkeypatch.setenv( 'StepFnArn', step_arn )
+
+        started = lambda_function.lambda_handler( transform( input_transformer, S3_EVENT ), context )['body']
+        assert 'StepFnExecArn' in started.keys()
+        lambda_function.lambda_handler( { 'BatchAction' : 'Succeeded', 'process_parms' : started['process_parms'] }, context )
+
+        duplicate = lambda_function.lambda_handler( transform( input_transformer, redelivered() ), context )['body']
+        assert duplicate.get('DuplicateStart', False)
+
+        corrected = lambda_function.lambda_handler( transform( input_transformer, redelivered( etag='5d41402abc4b2a76b9719d911017c592', **{ 'version-id' : 'm3fJ0ZLzvJmZzQ0WY1ZyN0oEYvV2o1HR' } ) ), context )['body']
+        assert 'StepFnExecArn' in corrected.keys()
+        assert corrected['process_parms']['BatchStartCount'] == 1
@@ -0,0 +1,109 @@
+"""
+## test_extract_plan.py -- S3_Unzip's 'Plan', the Map state's per-group 'Extract' & the 'Merge', as the Extract_Zip_to_Parquet state machine passes them
+#  (each Map iteration's input is built from the deployed state machine's ItemSelector, not by hand)
+"""
+
+import io
+import sys
+import json
+import zipfile
+import importlib.util
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from conftest import REPO_ROOT
+
+S3_BUCKET = 'pipeline-landing-pad'
+S3_KEY = 'FSDATA/Inbound/FDMD.FSDATA.D221212.zip'
+MEMBERS = [ f"top_{table}.2022-12.csv" for table in [ 'federal', 'state', 'county', 'city' ] ]
+
+def load_s3_unzip():
+    ''' S3_Unzip's lambda_function, under its own name -- Process_Initiator's is 'lambda_function' on the test path '''
+    if f"{REPO_ROOT}/lambda/S3_Unzip" not in sys.path:
+        sys.path.append( f"{REPO_ROOT}/lambda/S3_Unzip" )
+    spec = importlib.util.spec_from_file_location( 's3_unzip_lambda_function', f"{REPO_ROOT}/lambda/S3_Unzip/lambda_function.py" )
+    module = importlib.util.module_from_spec( spec )
+    spec.loader.exec_module( module )
+    return module
+
+def state_machine_states():
+    with open( f"{REPO_ROOT}/stepfunctions/Extract_Zip_to_Parquet/state_machine.json" ) as f:
+        return json.load( f )['States']
+
+def select( path, state_input, item ):
+    ''' Value of a '$.a.b' (state input) or '$$.Map.Item.Value' (context) path '''
+    if path == '$$.Map.Item.Value':
+        return item
+    value = state_input
+    for name in path[len('$.'):].split('.'):
+        value = value[name]
+    return value
+
+def item_selector( selector, state_input, item ):
+    ''' A Map iteration's input, as Step Functions builds it from the ItemSelector '''
+    selected = {}
+    for name, value in selector.items():
+        if isinstance( value, dict ):
+            selected[name] = item_selector( value, state_input, item )
+        elif name.endswith( '.$' ):
+            selected[name[:-len('.$')]] = select( value, state_input, item )
+        else:
+            selected[name] = value
+    return selected
+
+@pytest.fixture
+def s3_unzip( tmp_path, monkeypatch ):
+    monkeypatch.setenv( 'WorkFolder', str( tmp_path / 'unzip' ) )
+    with mock_aws():
+        archive_bytes = io.BytesIO()
+        with zipfile.ZipFile( archive_bytes, mode='w', compression=zipfile.ZIP_DEFLATED ) as archive:
+            for i, member_name in enumerate( MEMBERS ):
+                archive.writestr( member_name, 'RECORD_DATE,AMOUNT\n' + ''.join( f"2022-12-{d:02},{d * i}\n" for d in range( 1, 28 ) ) * 20 )
+        s3_client = boto3.client( 's3' )
+        s3_client.create_bucket( Bucket=S3_BUCKET )
+        s3_client.put_object( Bucket=S3_BUCKET, Key=S3_KEY, Body=archive_bytes.getvalue() )
+        yield load_s3_unzip()
+
+def test_map_iterations_get_only_their_own_group( s3_unzip ):
+    states = state_machine_states()
+    event = {
+        "source" : "aws.s3",
+        "detail" : { "bucket" : { "name" : S3_BUCKET }, "object" : { "key" : S3_KEY } },
+        "process_parms" : { "BatchId" : "D221212.zip", "ExtractGroupMB" : 0.005, "ExtractMaxGroups" : 4 }
+    }
+    planned = s3_unzip.lambda_handler( dict( event, UnzipAction='Plan' ), None )
+    assert 'ZipExtracted' not in planned['body']['process_parms'].keys()
+    assert planned['body']['process_parms']['ExtractPlan']['GroupCount'] == len(MEMBERS)
+    assert 'MemberGroups' not in planned['body']['process_parms']['ExtractPlan'].keys()
+
+    map_state = states['Extract Member Groups']
+    member_groups = select( map_state['ItemsPath'], planned, None )
+    assert len(member_groups) == len(MEMBERS)
+    extracted_groups = []
+    for member_group in member_groups:
+        iteration_input = item_selector( map_state['ItemSelector'], planned, member_group )
+        assert iteration_input['MemberGroup'] == member_group
+        assert 'MemberGroups' not in json.dumps( iteration_input )
+        extracted = s3_unzip.lambda_handler( iteration_input, None )
+        extracted_groups.append( extracted['body']['ExtractedMembers'] )
+
+    merge_input = json.loads( json.dumps( planned ) )
+    merge_input['body']['process_parms']['ExtractedGroups'] = extracted_groups
+    merged = s3_unzip.lambda_handler( item_selector( states['Merge ZIP Extracted']['Parameters']['Payload'], merge_input, None ), None )['body']
+    assert 'MemberGroups' not in merged.keys()
+    assert sorted( merged['process_parms']['ZipExtracted']['GlueTableNames'] ) == sorted( member_name.split('.')[0] for member_name in MEMBERS )
+    assert len( merged['process_parms']['ZipExtracted']['S3ExtractedUrls'] ) == len(MEMBERS)
+
+def test_one_group_is_extracted_by_plan( s3_unzip ):
+    ''' No 'MemberGroups' for a Map -- the Plan response carries ZipExtracted past it ('Planned Member Groups?') '''
+    event = {
+        "UnzipAction" : "Plan",
+        "source" : "aws.s3",
+        "detail" : { "bucket" : { "name" : S3_BUCKET }, "object" : { "key" : S3_KEY } },
+        "process_parms" : { "BatchId" : "D221212.zip" }
+    }
+    planned = s3_unzip.lambda_handler( event, None )['body']
+    assert 'MemberGroups' not in planned.keys()
+    assert len( planned['process_parms']['ZipExtracted']['S3ExtractedUrls'] ) == len(MEMBERS)